@@ -0,0 +1,96 @@
+"""
+Compares the throughput of the sync and async failed login auditing paths.
+
+Runs the same number of failed logins through
+AuthFailedLoggerBackend.authenticate() from a pool of threads and through
+AuthFailedLoggerBackend.aauthenticate() from concurrent asyncio tasks,
+against a freshly created test database.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/async_login_audit.py [--logins 2000] [--concurrency 50]
+
+The settings module defaults to useraudit.test_settings, set
+DJANGO_SETTINGS_MODULE to benchmark against another database. With
+SQLite all writes are serialised, so run it against PostgreSQL for
+numbers that are representative of a production deployment. The async
+path only runs on the event loop from Django 4.1 (async ORM), before that
+it runs the sync code in threads.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+
+import django
+
+
+def run_sync(backend_class, requests, concurrency):
+    def fail_login(args):
+        request, username = args
+        backend_class().authenticate(request, username=username, password='wrong')
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(fail_login, requests))
+
+
+def run_async(backend_class, requests, concurrency):
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fail_login(request, username):
+            async with semaphore:
+                await backend_class().aauthenticate(request, username=username, password='wrong')
+
+        await asyncio.gather(*[fail_login(request, username) for request, username in requests])
+
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=100, help='Number of existing users the logins are spread over')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'useraudit.test_settings')
+    django.setup()
+    # Every unknown username is logged as a warning
+    logging.getLogger('django.security').setLevel(logging.ERROR)
+
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test.client import RequestFactory
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from useraudit.backend import AuthFailedLoggerBackend
+    from useraudit.models import FailedLoginLog, LoginAttempt
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        UserModel = get_user_model()
+        UserModel.objects.bulk_create([UserModel(username='user%d' % i) for i in range(args.users)])
+        rf = RequestFactory()
+        requests = [(rf.post('/login', REMOTE_ADDR='10.0.%d.%d' % (i // 250 % 250, i % 250)),
+                     'user%d' % (i % (args.users * 2)))  # Half of the usernames don't exist
+                    for i in range(args.logins)]
+
+        print('Django %s, %s, %d failed logins, concurrency %d' % (
+            django.get_version(), connection.vendor, args.logins, args.concurrency))
+        for name, run in (('sync', run_sync), ('async', run_async)):
+            FailedLoginLog.objects.all().delete()
+            LoginAttempt.objects.all().delete()
+            start = time.perf_counter()
+            run(AuthFailedLoggerBackend, requests, args.concurrency)
+            elapsed = time.perf_counter() - start
+            print('%-5s %8.1f logins/sec (%.2fs)' % (name, args.logins / elapsed, elapsed))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Shows the query plans and timings of the login log queries with and without
+the indexes added by the 0010_log_indexes migration.
+
+Generates a FailedLoginLog table in a freshly created test database, runs
+the LogQuerySet queries and the admin changelist query, then migrates back
+to 0009 (dropping the indexes) and runs them again.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/log_queries.py [--rows 500000]
+
+The settings module defaults to useraudit.test_settings, set
+DJANGO_SETTINGS_MODULE to benchmark against another database.
+"""
+import argparse
+from datetime import timedelta
+import os
+import random
+import time
+
+import django
+
+
+def generate_logs(model, rows, users, ips, now, batch_size=10000):
+    rnd = random.Random(0)
+    for start in range(0, rows, batch_size):
+        model.objects.bulk_create([
+            model(username='user%d' % rnd.randrange(users),
+                  ip_address='10.%d.%d.%d' % (rnd.randrange(ips) // 65536, rnd.randrange(ips) // 256 % 256,
+                                              rnd.randrange(ips) % 256),
+                  user_agent='Mozilla/5.0 (Benchmark)',
+                  timestamp=now - timedelta(seconds=rnd.randrange(365 * 24 * 3600)))
+            for _ in range(min(batch_size, rows - start))])
+
+
+def run_queries(queries, repeat):
+    for name, queryset in queries:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            list(queryset.all())
+        elapsed = (time.perf_counter() - start) / repeat
+        print('%-28s %8.2f ms' % (name, elapsed * 1000))
+        print('    ' + queryset.explain().replace('\n', '\n    '))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--ips', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'useraudit.test_settings')
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from django.utils import timezone
+    from useraudit.models import FailedLoginLog
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        now = timezone.now()
+        start = time.perf_counter()
+        generate_logs(FailedLoginLog, args.rows, args.users, args.ips, now)
+        print('Generated %d rows in %.1fs on %s' % (args.rows, time.perf_counter() - start, connection.vendor))
+
+        logs = FailedLoginLog.objects.all()
+        queries = [
+            ('for_user()', logs.for_user('user42')[:50]),
+            ('for_ip()', logs.for_ip('10.0.1.1')[:50]),
+            ('between() last day', logs.between(now - timedelta(days=1), now)[:100]),
+            ('for_user().between()', logs.for_user('user42').between(now - timedelta(days=30))[:50]),
+            ('admin changelist', logs[:100]),
+        ]
+
+        print('\nWith indexes')
+        run_queries(queries, args.repeat)
+
+        call_command('migrate', 'useraudit', '0009', verbosity=0)
+        print('\nWithout indexes')
+        run_queries(queries, args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Counts the queries of a user save with the lockout pre_save receiver
+connected, with and without the expiry one.
+
+Saves a loaded user (changing a field other than the password and
+is_active, like most saves do) under each combination of settings that
+connects the receivers (see useraudit.receivers), against a freshly
+created test database, and prints the queries per save and the time.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/user_save_queries.py [--saves 1000]
+
+The settings module defaults to useraudit.test_settings, set
+DJANGO_SETTINGS_MODULE to benchmark against another database.
+"""
+import argparse
+import os
+import time
+
+import django
+
+
+CONFIGURATIONS = (
+    ('nothing configured', {}),
+    ('LOGIN_FAILURE_LIMIT', {'LOGIN_FAILURE_LIMIT': 5}),
+    ('ACCOUNT_EXPIRY_DAYS', {'ACCOUNT_EXPIRY_DAYS': 90}),
+    ('both', {'LOGIN_FAILURE_LIMIT': 5, 'ACCOUNT_EXPIRY_DAYS': 90}),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--saves', type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'useraudit.test_settings')
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext, override_settings
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from useraudit.receivers import connected_receivers
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user_model = get_user_model()
+        user_model.objects.create_user(username='john', password='sue')
+        for name, overrides in CONFIGURATIONS:
+            with override_settings(**overrides):
+                user = user_model.objects.get(username='john')
+                start = time.perf_counter()
+                with CaptureQueriesContext(connection) as queries:
+                    for i in range(args.saves):
+                        user.first_name = 'John %d' % i
+                        user.save()
+                elapsed = (time.perf_counter() - start) / args.saves
+                print('%-22s %4.1f queries/save %8.3f ms/save  %s' % (
+                    name, len(queries) / float(args.saves), elapsed * 1000, ', '.join(connected_receivers()) or '-'))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    main()
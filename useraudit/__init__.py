@@ -0,0 +1,5 @@
+import django
+
+if django.VERSION < (3, 2):
+    # Django 3.2+ finds the only AppConfig in useraudit.apps by itself
+    default_app_config = 'useraudit.apps.UserAuditConfig'
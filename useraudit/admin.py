@@ -11,8 +11,24 @@ class LogAdmin(admin.ModelAdmin):
 
     search_fields = ['username']
     list_filter = ['timestamp']
-    list_display = ('username', 'ip_address', 'forwarded_by', 'user_agent', 'timestamp')
+    list_display = ('username', 'ip', 'forwarded', 'agent', 'timestamp')
     list_display_links = None
+    list_select_related = ('user_agent_ref',)
+
+    def ip(self, obj):
+        return obj.ip
+
+    ip.short_description = "IP"
+
+    def forwarded(self, obj):
+        return obj.forwarded
+
+    forwarded.short_description = "Forwarded by"
+
+    def agent(self, obj):
+        return obj.agent
+
+    agent.short_description = "User agent"
 
 
 class LoginAttemptAdmin(admin.ModelAdmin):
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class UserAuditConfig(AppConfig):
+    name = 'useraudit'
+    # The tables were created with AutoField primary keys
+    default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        from . import receivers
+        receivers.connect_receivers()
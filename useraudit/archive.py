@@ -0,0 +1,273 @@
+"""
+Archive segment files for old LoginLog and FailedLoginLog rows.
+
+The archive_audit_logs command moves old log rows out of the database
+into segment files. Each segment holds a range of primary keys of one
+model, and is named after them: <model>-<first pk>-<last pk>.seg
+
+A segment file is laid out as:
+
+- a fixed size header (see HEADER) with the number of rows, the
+  timestamp and primary key ranges, and the offsets of the sections
+- the records, one fixed width RECORD per row, sorted by timestamp.
+  Strings (username, IP address, forwarded by and user agent) are
+  stored as indexes into the string table
+- the string table: every distinct string of the segment once,
+  zlib compressed
+
+The reader memory maps the records and binary searches them by time, so
+queries only touch the pages they need. Only the string table, which is
+small because usernames, addresses and user agents repeat a lot, is
+loaded into memory.
+
+Reading an archive::
+
+    with Archive('/var/archive/useraudit', 'FailedLoginLog') as archive:
+        for log in archive.query(username='john', start=datetime(2019, 1, 1)):
+            print(log.timestamp, log.ip_address)
+"""
+from collections import namedtuple
+import bisect
+import datetime
+import mmap
+import os
+import re
+import struct
+import tempfile
+import zlib
+
+from django.utils import timezone
+
+
+MAGIC = b'UAARCH01'
+VERSION = 1
+FLAG_AWARE = 1
+
+# magic, version, flags, row count, string count, min/max timestamp, first/last pk,
+# records offset, strings offset, strings length
+HEADER = struct.Struct('<8sBB2xIIqqqqQQQ')
+# pk, timestamp, username, ip address, forwarded by, user agent
+RECORD = struct.Struct('<qqIIII')
+TIMESTAMP = struct.Struct('<q')
+NO_STRING = 0xFFFFFFFF
+
+SEGMENT_SUFFIX = '.seg'
+SEGMENT_NAME_RE = re.compile(r'^(?P<model>[a-z]+)-(?P<first>\d+)-(?P<last>\d+)\.seg$')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+LOG_FIELDS = ('pk', 'timestamp', 'username', 'ip_address', 'forwarded_by', 'user_agent')
+ArchivedLog = namedtuple('ArchivedLog', LOG_FIELDS)
+
+
+def to_microseconds(timestamp):
+    if timezone.is_aware(timestamp):
+        timestamp = timezone.make_naive(timestamp, datetime.timezone.utc)
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_microseconds(value, aware):
+    timestamp = EPOCH + datetime.timedelta(microseconds=value)
+    if aware:
+        return timezone.make_aware(timestamp, datetime.timezone.utc)
+    return timestamp
+
+
+def segment_name(model_name, first_pk, last_pk):
+    return '%s-%012d-%012d%s' % (model_name.lower(), first_pk, last_pk, SEGMENT_SUFFIX)
+
+
+def list_segments(directory, model_name):
+    """Returns (first pk, last pk, path) of the segments of the model in the directory, ordered by pk."""
+    segments = []
+    if not os.path.isdir(directory):
+        return segments
+    for filename in os.listdir(directory):
+        match = SEGMENT_NAME_RE.match(filename)
+        if match and match.group('model') == model_name.lower():
+            segments.append((int(match.group('first')), int(match.group('last')), os.path.join(directory, filename)))
+    return sorted(segments)
+
+
+def write_segment(directory, model_name, rows):
+    """Writes rows, tuples of LOG_FIELDS, to a new segment file. Returns the path of the file.
+
+    The file is written under a temporary name and renamed when complete, so
+    a segment file is never seen half written."""
+    rows = sorted(rows, key=lambda row: (row[1], row[0]))
+    if not rows:
+        raise ValueError("A segment can't be empty")
+    aware = timezone.is_aware(rows[0][1])
+
+    strings = {}
+
+    def string_id(value):
+        if value is None:
+            return NO_STRING
+        return strings.setdefault(value, len(strings))
+
+    records = bytearray(RECORD.size * len(rows))
+    for i, (pk, timestamp, username, ip_address, forwarded_by, user_agent) in enumerate(rows):
+        RECORD.pack_into(records, i * RECORD.size, pk, to_microseconds(timestamp), string_id(username),
+                         string_id(ip_address), string_id(forwarded_by), string_id(user_agent))
+
+    encoded = [value.encode('utf-8') for value in sorted(strings, key=strings.get)]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    string_table = zlib.compress(struct.pack('<%dI' % len(offsets), *offsets) + b''.join(encoded))
+
+    pks = [row[0] for row in rows]
+    first_pk, last_pk = min(pks), max(pks)
+    header = HEADER.pack(MAGIC, VERSION, FLAG_AWARE if aware else 0, len(rows), len(strings),
+                         to_microseconds(rows[0][1]), to_microseconds(rows[-1][1]), first_pk, last_pk,
+                         HEADER.size, HEADER.size + len(records), len(string_table))
+
+    path = os.path.join(directory, segment_name(model_name, first_pk, last_pk))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(records)
+            f.write(string_table)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+class Segment(object):
+    """A memory mapped segment file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, flags, self.row_count, self.string_count, self.min_ts, self.max_ts,
+         self.first_pk, self.last_pk, self._records_offset, self._strings_offset,
+         self._strings_length) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("%s is not a useraudit archive segment" % path)
+        self.aware = bool(flags & FLAG_AWARE)
+        self._strings = None
+        self._string_ids = None
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            data = zlib.decompress(self._mmap[self._strings_offset:self._strings_offset + self._strings_length])
+            offsets = struct.unpack_from('<%dI' % (self.string_count + 1), data)
+            blob = memoryview(data)[len(offsets) * 4:]
+            self._strings = [bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8')
+                             for i in range(self.string_count)]
+        return self._strings
+
+    def string_id(self, value):
+        if self._string_ids is None:
+            self._string_ids = dict((string, i) for i, string in enumerate(self.strings))
+        return self._string_ids.get(value)
+
+    def __len__(self):
+        return self.row_count
+
+    def pks(self):
+        """Yields the primary keys of the archived rows."""
+        for i in range(self.row_count):
+            yield RECORD.unpack_from(self._mmap, self._records_offset + i * RECORD.size)[0]
+
+    def query(self, username=None, ip_address=None, start=None, end=None):
+        """Yields the ArchivedLogs matching all the given conditions, oldest first.
+        start is inclusive and end exclusive, like in LogQuerySet.between()."""
+        if not self._overlaps(start, end):
+            return
+        username_id = ip_id = None
+        if username is not None:
+            username_id = self.string_id(username)
+            if username_id is None:
+                return
+        if ip_address is not None:
+            ip_id = self.string_id(ip_address)
+            if ip_id is None:
+                return
+
+        low = 0 if start is None else self._bisect(to_microseconds(start))
+        high = self.row_count if end is None else self._bisect(to_microseconds(end))
+        for i in range(low, high):
+            record = RECORD.unpack_from(self._mmap, self._records_offset + i * RECORD.size)
+            if username_id is not None and record[2] != username_id:
+                continue
+            if ip_id is not None and record[3] != ip_id:
+                continue
+            yield self._log(record)
+
+    def _overlaps(self, start, end):
+        if start is not None and to_microseconds(start) > self.max_ts:
+            return False
+        if end is not None and to_microseconds(end) <= self.min_ts:
+            return False
+        return True
+
+    def _bisect(self, timestamp):
+        """Index of the first record at or after timestamp."""
+        return bisect.bisect_left(_Timestamps(self), timestamp)
+
+    def _log(self, record):
+        strings = self.strings
+
+        def string(string_id):
+            return None if string_id == NO_STRING else strings[string_id]
+
+        pk, timestamp, username, ip_address, forwarded_by, user_agent = record
+        return ArchivedLog(pk, from_microseconds(timestamp, self.aware), string(username), string(ip_address),
+                           string(forwarded_by), string(user_agent))
+
+
+class _Timestamps(object):
+    """Sequence view of the timestamps of a segment, for bisect."""
+
+    def __init__(self, segment):
+        self.segment = segment
+
+    def __len__(self):
+        return self.segment.row_count
+
+    def __getitem__(self, i):
+        offset = self.segment._records_offset + i * RECORD.size + 8
+        return TIMESTAMP.unpack_from(self.segment._mmap, offset)[0]
+
+
+class Archive(object):
+    """All the segments of a model in an archive directory."""
+
+    def __init__(self, directory, model_name):
+        self.segments = [Segment(path) for _, _, path in list_segments(directory, model_name)]
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def query(self, username=None, ip_address=None, start=None, end=None):
+        """Yields the ArchivedLogs matching all the given conditions, segment by segment."""
+        for segment in self.segments:
+            for log in segment.query(username, ip_address, start, end):
+                yield log
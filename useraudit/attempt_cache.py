@@ -0,0 +1,117 @@
+"""
+Failed login counters kept in Django's cache framework.
+
+When enabled, LoginAttemptLogger counts failed logins with the cache's
+atomic incr() (on backends that support it, such as memcached or redis)
+instead of writing to the LoginAttempt table on every attempt. The
+counts are written back to LoginAttempt periodically by the process that
+counted them, and by the flush_login_attempts management command.
+
+A counter that isn't in the cache yet is loaded from the LoginAttempt
+table, so the cache should be shared by all processes and shouldn't
+evict the counters before they have been written back.
+
+Settings::
+
+    # Alias of the cache (see CACHES) holding the counters. Not set by default.
+    USERAUDIT_LOGIN_ATTEMPT_CACHE = "default"
+    # Seconds between writing the counts back to the LoginAttempt table.
+    USERAUDIT_LOGIN_ATTEMPT_FLUSH_INTERVAL = 60
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+SETTINGS = (
+    'CACHES',
+    'USERAUDIT_LOGIN_ATTEMPT_CACHE',
+    'USERAUDIT_LOGIN_ATTEMPT_FLUSH_INTERVAL',
+)
+
+
+class AttemptCache(object):
+
+    def __init__(self, cache, flush_interval=60):
+        self.cache = cache
+        self.flush_interval = flush_interval
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+
+    def key(self, username):
+        # Hashed, because usernames may contain characters that aren't valid in cache keys
+        return 'useraudit:attempts:%s' % hashlib.md5((username or '').encode('utf-8')).hexdigest()
+
+    def incr(self, username):
+        """Increments the counter and returns the new count, or None if the counter isn't in the cache."""
+        try:
+            return self.cache.incr(self.key(username))
+        except ValueError:
+            return None
+
+    def load(self, username, count):
+        """Stores the count unless another process has already loaded the counter.
+        Returns True if the count was stored."""
+        return self.cache.add(self.key(username), count, timeout=None)
+
+    def get(self, username):
+        return self.cache.get(self.key(username))
+
+    def get_many(self, usernames):
+        keys = dict((self.key(username), username) for username in usernames)
+        return dict((keys[key], count) for key, count in self.cache.get_many(list(keys)).items())
+
+    def reset(self, username):
+        self.cache.set(self.key(username), 0, timeout=None)
+        with self._lock:
+            self._dirty.discard(username)
+
+    def reset_many(self, usernames):
+        self.cache.set_many(dict((self.key(username), 0) for username in usernames), timeout=None)
+        with self._lock:
+            self._dirty.difference_update(usernames)
+
+    def mark_dirty(self, username):
+        with self._lock:
+            self._dirty.add(username)
+
+    def pop_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            self._last_flush = time.time()
+        return dirty
+
+    def is_flush_due(self):
+        return time.time() - self._last_flush >= self.flush_interval
+
+
+_attempt_cache = None
+_attempt_cache_lock = threading.Lock()
+
+
+def get_attempt_cache():
+    """Returns the process wide AttemptCache, or None if the counters aren't cached."""
+    global _attempt_cache
+    alias = getattr(settings, 'USERAUDIT_LOGIN_ATTEMPT_CACHE', None)
+    if not alias:
+        return None
+    if _attempt_cache is None:
+        with _attempt_cache_lock:
+            if _attempt_cache is None:
+                _attempt_cache = AttemptCache(
+                    caches[alias],
+                    flush_interval=getattr(settings, 'USERAUDIT_LOGIN_ATTEMPT_FLUSH_INTERVAL', 60))
+    return _attempt_cache
+
+
+@receiver(setting_changed)
+def reset_attempt_cache(setting, **kwargs):
+    global _attempt_cache
+    if setting in SETTINGS:
+        _attempt_cache = None
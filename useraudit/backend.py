@@ -1,22 +1,28 @@
+import hashlib
 import logging
+import time
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.core.cache import caches
 from django.core.exceptions import PermissionDenied
-from django.dispatch import receiver
-from django.db.models.signals import pre_save
+from django.utils.module_loading import import_string
 from django.views.decorators.debug import sensitive_variables
 
+from . import login_state
 from .signals import login_failure_limit_reached
-from .models import LoginLogger, LoginAttempt
-from .models import LoginAttemptLogger
+from .models import LoginLogger
+from .models import LoginAttemptLogger, sync_to_async
 from .middleware import get_request
+from .lookup import aget_user_by_natural_key, get_user_by_natural_key, lookup_scope
+from .throttle import get_ip_throttle
+from .tracking import is_reactivated
 
 
 logger = logging.getLogger("django.security")
 
 
-@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
-def user_pre_save(sender, instance=None, raw=False, **kwargs):
+# Connected by useraudit.receivers
+def user_pre_save(sender, instance=None, raw=False, update_fields=None, **kwargs):
     user = instance
     is_new_user = user.pk is None
     if is_new_user or raw:
@@ -24,9 +30,111 @@ def user_pre_save(sender, instance=None, raw=False, **kwargs):
 
     # User has been re-activated. Ensure the failed login counter is set to 0 so
     # that the user isn't inactivated on next login by the AuthFailedLoggerBackend
-    current_user = sender.objects.get(pk=user.pk)
-    if not current_user.is_active and user.is_active:
+    if is_reactivated(user, update_fields):
         LoginAttemptLogger().reset(user.username)
+        get_lockout_policy().reset(user.username)
+
+
+class CumulativeLockoutPolicy(object):
+    """
+    Locks out users after LOGIN_FAILURE_LIMIT failed logins since their last
+    successful login or reactivation. This is the default policy.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.login_attempt_logger = LoginAttemptLogger()
+
+    def record_failure(self, username, count):
+        """Called on each failed login with the cumulative count of failures.
+        Returns the count to compare to the limit."""
+        return count
+
+    def get_count(self, username):
+        return self.login_attempt_logger.get_count(username)
+
+    def reset(self, username):
+        # LoginAttemptLogger.reset() has already reset the count
+        pass
+
+
+class SlidingWindowLockoutPolicy(CumulativeLockoutPolicy):
+    """
+    Locks out users after LOGIN_FAILURE_LIMIT failed logins within the last
+    LOGIN_FAILURE_WINDOW_MINUTES, so that occasional failures spread over
+    months don't add up to a lockout.
+
+    The window is divided into LOGIN_FAILURE_WINDOW_BUCKETS (default 10)
+    buckets, each one a counter in the LOGIN_FAILURE_WINDOW_CACHE cache
+    (default "default") that expires after the window has passed. Checking
+    an attempt costs the same regardless of the number of past failures.
+    Failures are counted with the granularity of a bucket, so the window
+    slides in steps of LOGIN_FAILURE_WINDOW_MINUTES / buckets.
+
+    The cache should be shared by all processes, a per-process cache
+    (ex. locmem) would count the failures in each process separately.
+    """
+    def __init__(self, limit, window_minutes=None, buckets=None, cache_alias=None):
+        super(SlidingWindowLockoutPolicy, self).__init__(limit)
+        if window_minutes is None:
+            window_minutes = getattr(settings, 'LOGIN_FAILURE_WINDOW_MINUTES', None) or 60
+        if buckets is None:
+            buckets = getattr(settings, 'LOGIN_FAILURE_WINDOW_BUCKETS', None) or 10
+        if cache_alias is None:
+            cache_alias = getattr(settings, 'LOGIN_FAILURE_WINDOW_CACHE', None) or 'default'
+        self.window = window_minutes * 60
+        self.buckets = buckets
+        self.bucket_seconds = float(self.window) / buckets
+        self.cache = caches[cache_alias]
+
+    def record_failure(self, username, count):
+        current = self._current_bucket()
+        key = self._key(username, current)
+        # The bucket is needed for a whole window after it has been filled
+        timeout = int(self.window + self.bucket_seconds) + 1
+        if not self.cache.add(key, 1, timeout=timeout):
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # Expired in the meantime
+                self.cache.add(key, 1, timeout=timeout)
+        return self._window_count(username, current)
+
+    def get_count(self, username):
+        return self._window_count(username, self._current_bucket())
+
+    def reset(self, username):
+        self.cache.delete_many(self._window_keys(username, self._current_bucket()))
+
+    def _current_bucket(self):
+        return int(time.time() // self.bucket_seconds)
+
+    def _key(self, username, bucket):
+        # Hashed, because usernames may contain characters that aren't valid in cache keys
+        digest = hashlib.md5((username or '').encode('utf-8')).hexdigest()
+        return 'useraudit:window:%s:%d' % (digest, bucket)
+
+    def _window_keys(self, username, current):
+        return [self._key(username, bucket) for bucket in range(current - self.buckets + 1, current + 1)]
+
+    def _window_count(self, username, current):
+        return sum(self.cache.get_many(self._window_keys(username, current)).values())
+
+
+def get_lockout_policy():
+    """Returns the policy deciding when to lock out users after failed logins.
+
+    LOGIN_FAILURE_POLICY can be set to the dotted path of a custom policy class.
+    Otherwise the SlidingWindowLockoutPolicy is used if LOGIN_FAILURE_WINDOW_MINUTES
+    is set, and the CumulativeLockoutPolicy if it isn't."""
+    limit = getattr(settings, 'LOGIN_FAILURE_LIMIT', None) or 0
+    policy_path = getattr(settings, 'LOGIN_FAILURE_POLICY', None)
+    if policy_path:
+        policy_class = import_string(policy_path)
+    elif getattr(settings, 'LOGIN_FAILURE_WINDOW_MINUTES', None):
+        policy_class = SlidingWindowLockoutPolicy
+    else:
+        policy_class = CumulativeLockoutPolicy
+    return policy_class(limit)
 
 
 class AuthFailedLoggerBackend(object):
@@ -35,28 +143,77 @@ class AuthFailedLoggerBackend(object):
         self.login_logger = LoginLogger()
         self.login_failure_limit = getattr(settings, 'LOGIN_FAILURE_LIMIT', None) or 0
         self.login_attempt_logger = LoginAttemptLogger()
+        self.lockout_policy = get_lockout_policy()
+        self.ip_throttle = get_ip_throttle()
 
     @sensitive_variables('credentials')
     def authenticate(self, request=None, **credentials):
         if request is None:
-            # TODO remove this when we don't support Django 1.10 anymore
-            # request is passed to authenticate starting with Django 1.11
+            # authenticate() called without the request, use the one of the middleware
             request = get_request()
         UserModel = get_user_model()
         self.username = credentials.get(UserModel.USERNAME_FIELD)
-        self.login_logger.log_failed_login(self.username, request)
-        if self._get_user() is not None:
-            self.login_attempt_logger.increment(self.username)
-            self.block_user_if_needed()
+        with lookup_scope():
+            self.login_logger.log_failed_login(self.username, request)
+            self.throttle_ip_if_needed(request)
+            if self._get_user() is not None:
+                self._record_failure()
 
         return None
 
-    def block_user_if_needed(self):
+    @sensitive_variables('credentials')
+    async def aauthenticate(self, request=None, **credentials):
+        if request is None:
+            request = get_request()
+        UserModel = get_user_model()
+        self.username = credentials.get(UserModel.USERNAME_FIELD)
+        with lookup_scope():
+            await self.login_logger.alog_failed_login(self.username, request)
+            await self.athrottle_ip_if_needed(request)
+            if await self._aget_user() is not None:
+                # Counting the failure uses raw SQL and the cache,
+                # so that and blocking the user run in a single thread
+                await sync_to_async(self._record_failure)()
+
+        return None
+
+    def _record_failure(self):
+        count = self.login_attempt_logger.increment(self.username)
+        if self.is_login_failure_limit_enabled():
+            count = self.lockout_policy.record_failure(self.username, count)
+            # Also after the policy counted it, so that a login clearing the state meanwhile
+            # doesn't leave the failure in the policy behind a clean marker (see useraudit.login_state)
+            login_state.mark_dirty(self.username)
+        self.block_user_if_needed(count)
+
+    def throttle_ip_if_needed(self, request):
+        """Counts the failed login against the client's IP address and subnet.
+        Raises PermissionDenied without counting it if they are over their limit."""
+        if self.ip_throttle is None or request is None:
+            return
+        ip_address = self.ip_throttle.client_address(request)
+        if self.ip_throttle.is_blocked(ip_address):
+            logger.info("Login Prevented for user '%s'! Too many failed logins from %s",
+                        self.username, ip_address)
+            raise PermissionDenied("Too many failed logins from %s" % ip_address)
+        self.ip_throttle.record_failure(ip_address)
+
+    async def athrottle_ip_if_needed(self, request):
+        if self.ip_throttle is None or request is None:
+            return
+        ip_address = self.ip_throttle.client_address(request)
+        if await self.ip_throttle.ais_blocked(ip_address):
+            logger.info("Login Prevented for user '%s'! Too many failed logins from %s",
+                        self.username, ip_address)
+            raise PermissionDenied("Too many failed logins from %s" % ip_address)
+        await self.ip_throttle.arecord_failure(ip_address)
+
+    def block_user_if_needed(self, count=None):
         if not self.is_login_failure_limit_enabled():
             return
-        if self.is_attempts_exceeded():
-            self._deactivate_user()
+        if self.is_attempts_exceeded(count):
             user = self._get_user()
+            self._deactivate_user(user)
             login_failure_limit_reached.send(sender=user.__class__, user=user)
             logger.info("Login Prevented for user '%s'! Maximum failed logins %d reached!",
                         self.username, self.login_failure_limit)
@@ -65,29 +222,35 @@ class AuthFailedLoggerBackend(object):
     def is_login_failure_limit_enabled(self):
         return self.login_failure_limit > 0
 
-    def is_attempts_exceeded(self,):
-        count = self._get_count()
+    def is_attempts_exceeded(self, count=None):
+        if count is None:
+            count = self._get_count()
         if count and count >= self.login_failure_limit:
             return True
         return False
 
     def _get_count(self):
+        return self.lockout_policy.get_count(self.username)
+
+    def _get_user(self):
+        UserModel = get_user_model()
         try:
-            obj = LoginAttempt.objects.get(username=self.username)
-            return obj.count
-        except LoginAttempt.DoesNotExist:
+            return get_user_by_natural_key(self.username)
+        except UserModel.DoesNotExist:
+            logger.warning("User model for username %s not found" % self.username)
             return None
 
-    def _get_user(self):
+    async def _aget_user(self):
         UserModel = get_user_model()
         try:
-            return UserModel._default_manager.get_by_natural_key(self.username)
+            return await aget_user_by_natural_key(self.username)
         except UserModel.DoesNotExist:
             logger.warning("User model for username %s not found" % self.username)
             return None
 
-    def _deactivate_user(self):
-        user = self._get_user()
+    def _deactivate_user(self, user=None):
+        if user is None:
+            user = self._get_user()
         if user:
             user.is_active = False
             user.save(update_fields=["is_active"])
@@ -0,0 +1,51 @@
+"""
+Deactivating expired accounts without locking the user table for long.
+"""
+from django.db import transaction
+
+
+def deactivate_in_chunks(queryset, chunk_size=1000, on_deactivate=None, select=None):
+    """Deactivates the active users of queryset, chunk_size users at a time.
+
+    The users are walked in primary key order, each chunk starting after
+    the last primary key of the previous one. Each chunk is locked,
+    deactivated by a single statement and committed in its own
+    transaction, then yielded as a list of the deactivated users, so the
+    caller can notify them. The users already deactivated aren't selected
+    again by a run started after an interrupted one. Notifications that
+    must survive the interruption have to be recorded by on_deactivate,
+    as the users of a chunk committed but not notified aren't yielded
+    again.
+
+    select, if given, is called with each locked chunk and returns the
+    users to deactivate, for conditions that can't be checked in the
+    database. The users it leaves out stay active.
+
+    on_deactivate is called with the users of each chunk inside its
+    transaction, to record anything that should be committed with the
+    deactivation. Rows of another database (ex. USERAUDIT_DATABASE) need
+    an atomic block of their own there, opened by on_deactivate: they are
+    committed just before the deactivation, and left behind if committing
+    it fails."""
+    model = queryset.model
+    using = queryset.db
+    active = queryset.filter(is_active=True).order_by("pk")
+    last_pk = None
+    while True:
+        chunk = active if last_pk is None else active.filter(pk__gt=last_pk)
+        with transaction.atomic(using=using):
+            locked = list(chunk.select_for_update()[:chunk_size])
+            if not locked:
+                return
+            users = locked if select is None else list(select(locked))
+            if users:
+                model._base_manager.db_manager(using).filter(
+                    pk__in=[user.pk for user in users]).update(is_active=False)
+                if on_deactivate is not None:
+                    on_deactivate(users)
+        last_pk = locked[-1].pk
+        if not users:
+            continue
+        for user in users:
+            user.is_active = False
+        yield users
@@ -0,0 +1,166 @@
+"""
+Compact storage of the IP addresses of the login logs.
+
+By default the client IP address of a log is stored as a string in
+ip_address and the proxy chain as a comma separated string in
+forwarded_by. Looking up the logs of a network (e.g. 10.2.0.0/16) can't
+use an index on strings.
+
+With USERAUDIT_PACK_IP_ADDRESSES enabled the addresses of new log rows
+are stored in ip_address_packed and forwarded_by_packed instead, and the
+string columns are left empty:
+
+- ip_address_packed is a native inet on PostgreSQL, and the 16 bytes of
+  the address elsewhere (IPv4 addresses as IPv4-mapped IPv6 addresses).
+  Both sort in address order, so a network is a range of the index.
+- forwarded_by_packed holds the 16 bytes of each proxy address.
+
+Addresses that can't be parsed (e.g. "unknown" in X-Forwarded-For) are
+kept as strings.
+
+Settings::
+
+    # Store the IP addresses of new log rows in the packed columns.
+    USERAUDIT_PACK_IP_ADDRESSES = True
+
+The pack_ip_addresses management command converts the existing rows.
+"""
+import ipaddress
+
+from django.conf import settings
+from django.db import models, transaction
+
+
+ADDRESS_LENGTH = 16
+
+
+def is_enabled():
+    return getattr(settings, 'USERAUDIT_PACK_IP_ADDRESSES', False)
+
+
+def parse(value):
+    """Returns value as an IPv4Address or IPv6Address, or None if it isn't an IP address."""
+    if value is None or isinstance(value, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return value
+    try:
+        return ipaddress.ip_address(value.strip())
+    except ValueError:
+        return None
+
+
+def pack(address):
+    """The 16 bytes of address, IPv4 addresses are mapped to IPv6."""
+    address = parse(address)
+    if address.version == 4:
+        address = ipaddress.IPv6Address(b'\0' * 10 + b'\xff\xff' + address.packed)
+    return address.packed
+
+
+def unpack(data):
+    address = ipaddress.IPv6Address(bytes(data))
+    return address.ipv4_mapped or address
+
+
+def pack_list(addresses):
+    """Packs a list of addresses, or returns None if any of them isn't an IP address."""
+    parsed = [parse(address) for address in addresses]
+    if None in parsed:
+        return None
+    return b''.join(pack(address) for address in parsed)
+
+
+def unpack_list(data):
+    data = bytes(data)
+    return [unpack(data[i:i + ADDRESS_LENGTH]) for i in range(0, len(data), ADDRESS_LENGTH)]
+
+
+def network_range(network):
+    """Returns the first and last address of network, e.g. '10.2.0.0/16'."""
+    network = ipaddress.ip_network(network, strict=False)
+    return network[0], network[-1]
+
+
+class PackedIPAddressField(models.Field):
+    """An IP address stored as inet on PostgreSQL and as 16 bytes on the other databases.
+
+    Values are read back as strings, like from a GenericIPAddressField."""
+
+    description = "IP address (packed)"
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'inet'
+        if connection.vendor == 'mysql':
+            return 'varbinary(%d)' % ADDRESS_LENGTH
+        if connection.vendor == 'oracle':
+            return 'RAW(%d)' % ADDRESS_LENGTH
+        return 'blob'
+
+    def get_prep_value(self, value):
+        value = super(PackedIPAddressField, self).get_prep_value(value)
+        if value is None or value == '':
+            return None
+        address = parse(value)
+        if address is None:
+            raise ValueError("'%s' is not an IP address" % value)
+        return address
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        if connection.vendor == 'postgresql':
+            return str(value)
+        return connection.Database.Binary(pack(value))
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return str(unpack(value))
+        # inet is returned as a string by psycopg2 and as an ip_interface by psycopg 3
+        return str(getattr(value, 'ip', value))
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+
+def pack_ip_addresses(log_model, using='default', chunk_size=1000):
+    """Moves the IP addresses of the existing rows of log_model to the packed columns.
+
+    Returns the number of rows updated."""
+    rows = log_model.objects.using(using).filter(ip_address_packed__isnull=True, ip_address__isnull=False)
+    updated = 0
+    last_pk = None
+    while True:
+        chunk = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+        chunk = list(chunk.order_by('pk').values_list('pk', 'ip_address', 'forwarded_by')[:chunk_size])
+        if not chunk:
+            return updated
+        last_pk = chunk[-1][0]
+        with transaction.atomic(using=using):
+            for pk, ip_address, forwarded_by in chunk:
+                fields = pack_log_info(ip_address, forwarded_by)
+                if fields['ip_address'] is None or fields['forwarded_by'] is None:
+                    updated += log_model.objects.using(using).filter(pk=pk).update(**fields)
+
+
+def pack_log_info(ip_address, forwarded_by):
+    """Returns the values of the IP address columns of a log row, packing the addresses that can be packed."""
+    fields = {
+        'ip_address': ip_address,
+        'ip_address_packed': None,
+        'forwarded_by': forwarded_by,
+        'forwarded_by_packed': None,
+    }
+    address = parse(ip_address)
+    if address is not None:
+        fields['ip_address'], fields['ip_address_packed'] = None, str(address)
+    if forwarded_by:
+        packed = pack_list(forwarded_by.split(','))
+        if packed is not None:
+            fields['forwarded_by'], fields['forwarded_by_packed'] = None, packed
+    return fields
@@ -0,0 +1,269 @@
+"""
+Buffered writing of the LoginLog and FailedLoginLog tables.
+
+By default every login attempt is logged with an INSERT in the request.
+When buffering is enabled, log records are queued in memory instead and
+a background thread writes them in batches with bulk_create. Batches are
+written when the batch size is reached, when the flush interval has
+passed, and at process exit.
+
+Settings::
+
+    # Enables buffered writing of login logs.
+    USERAUDIT_LOG_BUFFERED = True
+    # Maximum number of records held in memory.
+    USERAUDIT_LOG_BUFFER_SIZE = 10000
+    # Number of records written by one bulk_create.
+    USERAUDIT_LOG_BATCH_SIZE = 500
+    # Maximum number of seconds a record stays in the buffer.
+    USERAUDIT_LOG_FLUSH_INTERVAL = 1.0
+    # What to do when the buffer is full:
+    #   "block" - wait until there is space in the buffer
+    #   "drop"  - discard the record, counting it in BufferedLogWriter.dropped
+    #   "sync"  - write the record immediately in the current thread
+    USERAUDIT_LOG_OVERFLOW = "block"
+
+Records written after the writer was closed (ex. at process exit) are
+written immediately in the current thread, whatever the policy.
+
+Call flush() to write all queued records, for example in tests.
+"""
+import atexit
+from collections import OrderedDict
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+
+from . import rollups, routers
+
+
+logger = logging.getLogger("django.security")
+
+BLOCK = 'block'
+DROP = 'drop'
+SYNC = 'sync'
+OVERFLOW_POLICIES = (BLOCK, DROP, SYNC)
+
+SETTINGS = (
+    'USERAUDIT_LOG_BUFFERED',
+    'USERAUDIT_LOG_BUFFER_SIZE',
+    'USERAUDIT_LOG_BATCH_SIZE',
+    'USERAUDIT_LOG_FLUSH_INTERVAL',
+    'USERAUDIT_LOG_OVERFLOW',
+)
+
+
+class BufferedLogWriter(object):
+
+    def __init__(self, buffer_size=10000, batch_size=500, flush_interval=1.0, overflow=BLOCK):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ImproperlyConfigured("USERAUDIT_LOG_OVERFLOW should be one of %s" % ", ".join(OVERFLOW_POLICIES))
+        if batch_size < 1 or buffer_size < batch_size:
+            raise ImproperlyConfigured("USERAUDIT_LOG_BATCH_SIZE should be between 1 and USERAUDIT_LOG_BUFFER_SIZE")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+
+    def write(self, record):
+        """Queues an unsaved model instance to be written later.
+
+        Once the writer is closed there is no thread left to write the
+        queue, so the record is written immediately instead."""
+        if self._stopping:
+            self._write_now(record)
+            return
+        self._ensure_started()
+        try:
+            self._put(record)
+        except queue.Full:
+            if self.overflow == SYNC or self._stopping:
+                self._write_now(record)
+            else:
+                self._drop(record)
+            return
+        if self._stopping:
+            # Closed while we were waiting for space in the buffer
+            self.flush()
+        elif self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def write_nowait(self, record):
+        """Queues the record like write(), but only if that can be done without blocking
+        or writing to the database, so that it can be called from async code.
+
+        Returns False if the record wasn't queued (or dropped), in which case
+        write() should be called instead, in a thread."""
+        self._ensure_started()
+        with self._lock:
+            # Checked under the lock, so that close() either sees the record in the queue or we see it stopping
+            if self._stopping:
+                return False
+            try:
+                self._queue.put(record, block=False)
+            except queue.Full:
+                if self.overflow != DROP:
+                    return False
+                full = True
+            else:
+                full = False
+        if full:
+            self._drop(record)
+        elif self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _drop(self, record):
+        with self._lock:
+            self.dropped += 1
+            dropped = self.dropped
+        logger.warning("Login log buffer is full, dropped %s record: %s (%d dropped so far)",
+                       type(record).__name__, record, dropped)
+
+    def _put(self, record):
+        if self.overflow != BLOCK:
+            self._queue.put(record, block=False)
+            return
+        # Waits in steps, so that a writer closed in the meantime doesn't leave us blocked forever
+        while True:
+            try:
+                self._queue.put(record, timeout=self.flush_interval)
+                return
+            except queue.Full:
+                if self._stopping:
+                    raise
+
+    def _write_now(self, record):
+        using = routers.db_for_write(type(record))
+        with transaction.atomic(using=using):
+            record.save(using=using)
+            if rollups.is_enabled():
+                rollups.count_logins([record])
+
+    def flush(self):
+        """Writes all queued records in the calling thread. Returns the number of records written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    return written
+                written += self._write_batch(batch)
+
+    def close(self):
+        """Stops the background thread and writes all queued records."""
+        with self._lock:
+            self._stopping = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._stopping or (self._thread is not None and self._pid == os.getpid()):
+                return
+            # Also (re)started in a child process after a fork, as threads don't survive forking
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='useraudit-log-writer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self.flush()
+                close_old_connections()
+        finally:
+            close_old_connections()
+
+    def _take_batch(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        by_model = OrderedDict()
+        for record in batch:
+            by_model.setdefault(type(record), []).append(record)
+        written = 0
+        for model, records in by_model.items():
+            try:
+                # The daily counts are updated with the batch, see useraudit.rollups
+                with transaction.atomic(using=routers.db_for_write(model)):
+                    model.objects.bulk_create(records)
+                    if rollups.is_enabled():
+                        rollups.count_logins(records)
+                written += len(records)
+            except Exception:
+                logger.exception("Couldn't write %d %s record(s)", len(records), model.__name__)
+        return written
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Returns the process wide writer, or None if buffering is not enabled."""
+    global _writer
+    if not getattr(settings, 'USERAUDIT_LOG_BUFFERED', False):
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = BufferedLogWriter(
+                    buffer_size=getattr(settings, 'USERAUDIT_LOG_BUFFER_SIZE', 10000),
+                    batch_size=getattr(settings, 'USERAUDIT_LOG_BATCH_SIZE', 500),
+                    flush_interval=getattr(settings, 'USERAUDIT_LOG_FLUSH_INTERVAL', 1.0),
+                    overflow=getattr(settings, 'USERAUDIT_LOG_OVERFLOW', BLOCK),
+                )
+    return _writer
+
+
+def flush():
+    """Writes all queued records. Returns the number of records written."""
+    writer = _writer
+    if writer is None:
+        return 0
+    return writer.flush()
+
+
+def close():
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+atexit.register(close)
+
+
+@receiver(setting_changed)
+def reset_writer(setting, **kwargs):
+    if setting in SETTINGS:
+        close()
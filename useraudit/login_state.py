@@ -0,0 +1,94 @@
+"""
+Markers of the users with no failed logins and no deactivation to clear.
+
+After a successful login, login_callback resets the failed login count
+of the user (and the failures counted by the lockout policy, ex. the
+buckets of the sliding window) and deletes their UserDeactivation rows. For clients that log
+in all the time there is almost never anything to reset or delete.
+
+Without a marker cache the reset is a conditional UPDATE that only
+writes if the count isn't 0 already, and the delete a single DELETE.
+With USERAUDIT_LOGIN_STATE_CACHE set, a "clean" marker is stored in the
+cache after clearing the state of a user, and removed whenever a failed
+login is counted or a UserDeactivation row is recorded for them. While
+the marker is there, logging the login is the only query of
+login_callback.
+
+The marker is set before the state is cleared and removed after a
+failure is counted, so a failure counted concurrently is never hidden
+by it. Markers expire after USERAUDIT_LOGIN_STATE_TIMEOUT seconds, in
+case rows were changed by other means (ex. in the admin).
+
+The cache should be shared by all processes.
+
+Settings::
+
+    # Alias of the cache (see CACHES) holding the markers. Not set by default.
+    USERAUDIT_LOGIN_STATE_CACHE = "default"
+    # Seconds a marker is trusted for.
+    USERAUDIT_LOGIN_STATE_TIMEOUT = 86400
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0, the async methods can't be used
+    sync_to_async = None
+
+
+class LoginStateCache(object):
+
+    def __init__(self, cache, timeout=86400):
+        self.cache = cache
+        self.timeout = timeout
+
+    def key(self, username):
+        # Hashed, because usernames may contain characters that aren't valid in cache keys
+        return 'useraudit:clean:%s' % hashlib.md5((username or '').encode('utf-8')).hexdigest()
+
+    def is_clean(self, username):
+        return bool(self.cache.get(self.key(username)))
+
+    def mark_clean(self, username):
+        self.cache.set(self.key(username), 1, timeout=self.timeout)
+
+    def mark_dirty(self, username):
+        self.cache.delete(self.key(username))
+
+    def mark_dirty_many(self, usernames):
+        self.cache.delete_many([self.key(username) for username in usernames])
+
+    async def ais_clean(self, username):
+        # The async cache API is available from Django 4.0
+        if not hasattr(self.cache, 'aget'):
+            return await sync_to_async(self.is_clean)(username)
+        return bool(await self.cache.aget(self.key(username)))
+
+    async def amark_clean(self, username):
+        if not hasattr(self.cache, 'aset'):
+            return await sync_to_async(self.mark_clean)(username)
+        await self.cache.aset(self.key(username), 1, timeout=self.timeout)
+
+
+def get_login_state_cache():
+    """Returns the LoginStateCache, or None if USERAUDIT_LOGIN_STATE_CACHE isn't set."""
+    alias = getattr(settings, 'USERAUDIT_LOGIN_STATE_CACHE', None)
+    if not alias:
+        return None
+    return LoginStateCache(caches[alias], timeout=getattr(settings, 'USERAUDIT_LOGIN_STATE_TIMEOUT', None) or 86400)
+
+
+def mark_dirty(username):
+    """Called whenever a failed login is counted or a deactivation is recorded for username."""
+    state_cache = get_login_state_cache()
+    if state_cache is not None:
+        state_cache.mark_dirty(username)
+
+
+def mark_dirty_many(usernames):
+    state_cache = get_login_state_cache()
+    if state_cache is not None:
+        state_cache.mark_dirty_many(usernames)
@@ -0,0 +1,175 @@
+"""
+Per authentication attempt cache of users looked up by natural key.
+
+A failed login goes through several backends and helpers that all need
+the same user. Inside a lookup scope each user is loaded only once. A
+scope lasts for one request (see RequestToThreadLocalMiddleware) or for
+one call of a backend's authenticate() when there is no request. The
+cache is held in a context variable, so it is private to the current
+thread or async task.
+
+Cached users are dropped whenever a user is saved or deleted. The
+receivers doing it are connected to the user model only: receivers of
+every model would keep Django from deleting the rows of other models (ex.
+the audit logs) with a single statement.
+
+Lookups can also load related objects (ex. the profile holding the
+password change date) in the same query, with select_related, and
+annotate the user (ex. with the groups of the expiry overrides they are
+in).
+"""
+from contextlib import contextmanager
+import contextvars
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.base_user import BaseUserManager
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0, aget_user_by_natural_key() can't be used
+    sync_to_async = None
+
+
+_users = contextvars.ContextVar('useraudit_users', default=None)
+
+
+def begin_scope():
+    """Starts caching lookups. Returns a token to be passed to end_scope()
+    or None if a scope is already active. Nested scopes share the outer cache."""
+    if _users.get() is not None:
+        return None
+    return _users.set({})
+
+
+def end_scope(token):
+    if token is None:
+        return
+    try:
+        _users.reset(token)
+    except ValueError:
+        # Token was created in a different context
+        _users.set(None)
+
+
+@contextmanager
+def lookup_scope():
+    token = begin_scope()
+    try:
+        yield
+    finally:
+        end_scope(token)
+
+
+def _uses_default_natural_key(manager):
+    return getattr(type(manager), 'get_by_natural_key', None) is BaseUserManager.get_by_natural_key
+
+
+def _lookup_queryset(manager, select_related=(), annotations=None):
+    queryset = manager.all()
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if annotations:
+        queryset = queryset.annotate(**annotations)
+    return queryset
+
+
+def _get_by_natural_key(UserModel, username, select_related=(), annotations=None):
+    manager = UserModel._default_manager
+    if (select_related or annotations) and _uses_default_natural_key(manager):
+        # The same query as BaseUserManager.get_by_natural_key(). A custom get_by_natural_key()
+        # is left alone, the related objects are loaded lazily and the annotations are missing.
+        return _lookup_queryset(manager, select_related, annotations).get(**{UserModel.USERNAME_FIELD: username})
+    return manager.get_by_natural_key(username)
+
+
+async def _aget_by_natural_key(UserModel, username, select_related=(), annotations=None):
+    manager = UserModel._default_manager
+    if (select_related or annotations) and _uses_default_natural_key(manager) and hasattr(manager, 'aget'):
+        return await _lookup_queryset(manager, select_related, annotations).aget(
+            **{UserModel.USERNAME_FIELD: username})
+    # aget_by_natural_key() is available from Django 5.0
+    aget_by_natural_key = getattr(manager, 'aget_by_natural_key', None)
+    if aget_by_natural_key is None or select_related or annotations:
+        return await sync_to_async(_get_by_natural_key)(UserModel, username, select_related, annotations)
+    return await aget_by_natural_key(username)
+
+
+def get_user_by_natural_key(username, select_related=(), annotations=None):
+    """Looks up the user, loading the select_related relations and the annotations in the same query if possible."""
+    UserModel = get_user_model()
+    users = _users.get()
+    if users is None:
+        return _get_by_natural_key(UserModel, username, select_related, annotations)
+
+    key = (UserModel._meta.label_lower, username)
+    if key not in users:
+        try:
+            users[key] = _get_by_natural_key(UserModel, username, select_related, annotations)
+        except UserModel.DoesNotExist:
+            users[key] = None
+    return _cached_user(users, key, username)
+
+
+async def aget_user_by_natural_key(username, select_related=(), annotations=None):
+    UserModel = get_user_model()
+    users = _users.get()
+    if users is None:
+        return await _aget_by_natural_key(UserModel, username, select_related, annotations)
+
+    key = (UserModel._meta.label_lower, username)
+    if key not in users:
+        try:
+            users[key] = await _aget_by_natural_key(UserModel, username, select_related, annotations)
+        except UserModel.DoesNotExist:
+            users[key] = None
+    return _cached_user(users, key, username)
+
+
+def _cached_user(users, key, username):
+    user = users[key]
+    if user is None:
+        raise get_user_model().DoesNotExist("User '%s' does not exist" % username)
+    return user
+
+
+def invalidate_user(sender, instance=None, **kwargs):
+    users = _users.get()
+    if not users:
+        return
+    label = sender._meta.label_lower
+    get_username = getattr(instance, 'get_username', None)
+    if get_username is None:
+        return
+    username = get_username()
+    stale = [key for key, user in users.items()
+             if key[0] == label and (key[1] == username or (user is not None and user.pk == instance.pk))]
+    for key in stale:
+        del users[key]
+
+
+# The user model invalidate_user is connected to
+_connected_model = None
+
+
+def connect_user_model(user_model):
+    global _connected_model
+    signals = ((post_save, 'useraudit.lookup.post_save'), (post_delete, 'useraudit.lookup.post_delete'))
+    if _connected_model is not None:
+        for signal, dispatch_uid in signals:
+            signal.disconnect(invalidate_user, sender=_connected_model, dispatch_uid=dispatch_uid)
+    for signal, dispatch_uid in signals:
+        signal.connect(invalidate_user, sender=user_model, dispatch_uid=dispatch_uid)
+    _connected_model = user_model
+
+
+connect_user_model(settings.AUTH_USER_MODEL)
+
+
+@receiver(setting_changed)
+def user_model_changed(setting, value, **kwargs):
+    if setting == 'AUTH_USER_MODEL':
+        connect_user_model(value)
@@ -1,32 +1,115 @@
+from itertools import islice
+import sys
+
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
 from django.db import transaction
 
+from ... import routers
+from ...backend import get_lockout_policy
+from ...models import LoginAttempt, LoginAttemptLogger, UserDeactivation
+from ...receivers import expiry_enabled
+
 
 class Command(BaseCommand):
     help = """
-       Activates an inactive user.
+       Activates inactive users.
+
+       The usernames are given as arguments, or read one per line from a
+       file (--file, "-" for stdin). They are processed in chunks: each
+       chunk is loaded by one query, and its users are reactivated, their
+       failed login counts reset and their deactivation records deleted by
+       a few statements in one transaction. The usernames that don't exist
+       are reported at the end, with an error. The users that exist are
+       activated anyway, whereas older versions didn't activate any user
+       if one of the usernames didn't exist.
     """
 
     def add_arguments(self, parser):
-        parser.add_argument('username', nargs='+', help='The user(s) to activate')
+        parser.add_argument('username', nargs='*', help='The user(s) to activate')
+        parser.add_argument('--file', '-f', dest='file',
+                            help='Read the usernames from this file, one per line ("-" for stdin)')
+        parser.add_argument('--chunk-size', type=int, default=1000, dest='chunk_size',
+                            help='Number of users activated by one statement')
 
-    def handle(self, **options):
-        users = map(self._load_user, options['username'])
-        with transaction.atomic():
-            for user in users:
-                self._activate_user(user)
+    def handle(self, username=(), file=None, chunk_size=1000, verbosity=1, **options):
+        self.verbosity = verbosity
+        if chunk_size < 1:
+            raise CommandError('--chunk-size should be at least 1')
+        if not username and not file:
+            raise CommandError('Give the usernames as arguments or with --file')
 
-    def _load_user(self, username):
-        UserModel = get_user_model()
-        try:
-            return UserModel.objects.get(username=username)
-        except UserModel.DoesNotExist:
-            raise CommandError('User "%s" does NOT exist' % username)
+        activated = already_active = 0
+        missing = []
+        usernames = self._usernames(username, file)
+        while True:
+            chunk = list(islice(usernames, chunk_size))
+            if not chunk:
+                break
+            found = self._activate_users(chunk)
+            for name in chunk:
+                if name not in found:
+                    missing.append(name)
+                elif found[name]:
+                    self._info('Ignoring already active user "%s"' % name)
+                    already_active += 1
+                else:
+                    activated += 1
+
+        self._info('%d user(s) activated, %d already active' % (activated, already_active))
+        if missing:
+            raise CommandError('%d user(s) do NOT exist: %s' % (
+                len(missing), ', '.join('"%s"' % name for name in missing)))
 
-    def _activate_user(self, user):
-        if user.is_active:
-            self.stdout.write('Ignoring already active user "%s"\n' % user.username)
+    def _usernames(self, usernames, path):
+        """The usernames given, without duplicates."""
+        seen = set()
+        for name in self._read_usernames(usernames, path):
+            if name not in seen:
+                seen.add(name)
+                yield name
+
+    def _read_usernames(self, usernames, path):
+        for name in usernames:
+            yield name
+        if path is None:
             return
-        user.is_active = True
-        user.save()
+        stream = sys.stdin if path == '-' else open(path)
+        try:
+            for line in stream:
+                name = line.strip()
+                if name:
+                    yield name
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    def _activate_users(self, usernames):
+        """Activates the inactive users of usernames. Returns whether each user found was already active."""
+        UserModel = get_user_model()
+        users = UserModel._default_manager.filter(**{'%s__in' % UserModel.USERNAME_FIELD: usernames})
+        with transaction.atomic(using=users.db), \
+                transaction.atomic(using=routers.db_for_write(LoginAttempt), savepoint=False):
+            found = dict(users.select_for_update().values_list(UserModel.USERNAME_FIELD, 'is_active'))
+            inactive = [name for name, is_active in found.items() if not is_active]
+            if inactive:
+                self._reactivate(UserModel, inactive)
+        return found
+
+    def _reactivate(self, UserModel, usernames):
+        # What saving each user would do (see the pre_save receivers of useraudit.backend and
+        # useraudit.password_expiry), with a few statements for all of them
+        values = {'is_active': True}
+        if expiry_enabled() and any(field.name == 'last_login' for field in UserModel._meta.concrete_fields):
+            # So that they aren't deactivated again on their next login
+            values['last_login'] = None
+        UserModel._default_manager.filter(**{'%s__in' % UserModel.USERNAME_FIELD: usernames}).update(**values)
+        LoginAttemptLogger().reset_many(usernames)
+        lockout_policy = get_lockout_policy()
+        for name in usernames:
+            lockout_policy.reset(name)
+        UserDeactivation.objects.filter(username__in=usernames).delete()
+
+    def _info(self, msg, verbosity=1):
+        if self.verbosity >= verbosity:
+            self.stdout.write(msg + '\n')
@@ -0,0 +1,127 @@
+from datetime import timedelta
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ... import models as m
+from ... import routers
+from ...archive import LOG_FIELDS, Segment, list_segments, write_segment
+from ...ip_storage import unpack_list
+from ...retention import delete_in_chunks
+
+ARCHIVABLE_MODELS = (m.LoginLog, m.FailedLoginLog)
+# LOG_FIELDS, with the user agent taken from the UserAgent table if normalized,
+# followed by the packed IP addresses (see archived_row)
+ARCHIVED_VALUES = LOG_FIELDS[:-1] + (Coalesce('user_agent', 'user_agent_ref__name'),
+                                     'ip_address_packed', 'forwarded_by_packed')
+
+
+def archived_row(values):
+    """The LOG_FIELDS of the ARCHIVED_VALUES of a row, with the packed IP addresses as strings."""
+    pk, timestamp, username, ip_address, forwarded_by, user_agent, ip_address_packed, forwarded_by_packed = values
+    if ip_address is None:
+        ip_address = ip_address_packed
+    if forwarded_by is None and forwarded_by_packed is not None:
+        forwarded_by = ",".join(str(address) for address in unpack_list(forwarded_by_packed))
+    return pk, timestamp, username, ip_address, forwarded_by, user_agent
+
+
+class Command(BaseCommand):
+    help = """
+       Moves old LoginLog and FailedLoginLog rows into segment files in
+       USERAUDIT_ARCHIVE_DIR (see useraudit.archive), then deletes them from
+       the database. Rows older than --days are archived, by default the
+       model's retention period in USERAUDIT_RETENTION_DAYS.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory", help="Archive directory, defaults to USERAUDIT_ARCHIVE_DIR")
+        parser.add_argument("--days", type=int, help="Archive rows older than this many days")
+        parser.add_argument("--model", action="append", dest="models", metavar="MODEL",
+                            help="Only archive this model (can be repeated)")
+        parser.add_argument("--segment-size", type=int, default=100000, dest="segment_size",
+                            help="Maximum number of rows in a segment file")
+        parser.add_argument("--chunk-size", type=int, default=1000, dest="chunk_size",
+                            help="Size of the range of primary keys deleted by one statement")
+        parser.add_argument("--sleep", type=float, default=0.0,
+                            help="Seconds to wait between deleted chunks")
+
+    def handle(self, directory=None, days=None, models=None, segment_size=100000, chunk_size=1000, sleep=0.0,
+               verbosity=1, **kwargs):
+        self.verbosity = verbosity
+        directory = directory or getattr(settings, "USERAUDIT_ARCHIVE_DIR", None)
+        if not directory:
+            raise CommandError("Set USERAUDIT_ARCHIVE_DIR or pass --directory")
+        if segment_size < 1 or chunk_size < 1:
+            raise CommandError("--segment-size and --chunk-size should be at least 1")
+        by_name = dict((model.__name__, model) for model in ARCHIVABLE_MODELS)
+        unknown = set(models or ()).difference(by_name)
+        if unknown:
+            raise CommandError("Unknown model(s): %s. Should be one of %s" % (
+                ", ".join(sorted(unknown)), ", ".join(sorted(by_name))))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        retention = getattr(settings, "USERAUDIT_RETENTION_DAYS", None) or {}
+        for name in sorted(models or by_name):
+            model_days = days or retention.get(name)
+            if not model_days:
+                self._info("%s: no --days and no retention period configured; skipping." % name)
+                continue
+            cutoff = timezone.now() - timedelta(days=model_days)
+            self._archive(by_name[name], directory, cutoff, segment_size, chunk_size, sleep)
+
+        self._info("Done")
+
+    def _archive(self, model, directory, cutoff, segment_size, chunk_size, sleep):
+        name = model.__name__
+        self._delete_archived_rows(model, directory, chunk_size)
+
+        old_rows = model.objects.filter(timestamp__lt=cutoff).order_by("pk")
+        archived = 0
+        last_pk = None
+        start = time.time()
+        while True:
+            rows = old_rows if last_pk is None else old_rows.filter(pk__gt=last_pk)
+            # iterator() streams the rows with a server-side cursor where the database supports it
+            rows = [archived_row(values) for values in
+                    rows.values_list(*ARCHIVED_VALUES)[:segment_size].iterator(chunk_size=2000)]
+            if not rows:
+                break
+            path = write_segment(directory, name, rows)
+            first_pk, last_pk = rows[0][0], rows[-1][0]
+            # The rows of the range older than cutoff are exactly the rows archived
+            delete_in_chunks(old_rows, first_pk, last_pk, chunk_size, sleep)
+            archived += len(rows)
+            self._info("%s: archived %d row(s) to %s" % (name, len(rows), path))
+
+        elapsed = time.time() - start
+        self._info("%s: %d row(s) archived in %.1fs (%.0f rows/sec)" % (
+            name, archived, elapsed, archived / elapsed if elapsed else archived))
+
+    def _delete_archived_rows(self, model, directory, chunk_size):
+        """Deletes the rows of the last segment still in the database, in case
+        the previous run was interrupted before deleting all of them."""
+        segments = list_segments(directory, model.__name__)
+        if not segments:
+            return
+        first_pk, last_pk, path = segments[-1]
+        if not model.objects.filter(pk__gte=first_pk, pk__lte=last_pk).exists():
+            return
+        with Segment(path) as segment:
+            pks = sorted(segment.pks())
+        deleted = 0
+        for i in range(0, len(pks), chunk_size):
+            with transaction.atomic(using=routers.db_for_write(model)):
+                deleted += model.objects.filter(pk__in=pks[i:i + chunk_size]).delete()[0]
+        if deleted:
+            self._info("%s: deleted %d row(s) already archived to %s" % (model.__name__, deleted, path))
+
+    def _info(self, msg):
+        if self.verbosity:
+            self.stdout.write(msg + "\n")
@@ -1,26 +1,65 @@
-from django.core.management.base import BaseCommand
+import time
+
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
 from django.core import mail
 from django.contrib.sites.shortcuts import get_current_site
-from ...password_expiry import ExpirySettings
+from django.db import transaction
+from django.utils import timezone
+from ... import routers
+from ...deactivation import deactivate_in_chunks
+from ...models import UserDeactivation, UserNotification, save_deactivations
+from ...notifications import MailDispatcher, discard_pending, mark_sent, pending_in_chunks, record_pending
+from ...password_expiry import get_expiry_policy
+from ...signals import accounts_have_expired
+
+KIND = UserNotification.ACCOUNT_EXPIRED
 
 
 class Command(BaseCommand):
     help = """
        Finds all users who haven't logged in recently enough and
-       deactivates them.
+       deactivates them. The candidates are selected in the database by
+       the shortest ACCOUNT_EXPIRY_DAYS, of the settings or of
+       USERAUDIT_EXPIRY_OVERRIDES, and only deactivated if their account
+       has expired under the expiry settings applying to them.
+
+       Users are deactivated in chunks, each one in a short transaction,
+       and notified after their chunk is committed. The notifications are
+       recorded as pending in the same transaction (or in a transaction of
+       USERAUDIT_DATABASE committed just before it), so an interrupted run
+       can be started again: the users it deactivated aren't selected
+       again, and the ones it didn't get to notify are notified first.
+
+       The e-mails are sent by a pool of threads, each reusing its mail
+       connection, and retried with backoff. Who was notified is recorded
+       in UserNotification, the e-mails not sent by a previous run (ex. the
+       mail server was down) are sent first.
+
+       The deactivations are recorded in UserDeactivation with the users
+       (like the notifications), and the accounts_have_expired signal is
+       sent once per chunk.
     """
 
     def add_arguments(self, parser):
         parser.add_argument("--no-email", "-e", help="Don't notify users by e-mail",
                             dest="email", action="store_false", default=True)
-
-    def handle(self, email=True, verbosity=1, **kwargs):
+        parser.add_argument("--chunk-size", type=int, default=1000, dest="chunk_size",
+                            help="Number of users deactivated by one statement")
+        parser.add_argument("--workers", type=int, default=4,
+                            help="Number of threads sending e-mails")
+        parser.add_argument("--retries", type=int, default=3,
+                            help="Number of times sending an e-mail is retried")
+
+    def handle(self, email=True, chunk_size=1000, workers=4, retries=3, verbosity=1, **kwargs):
         self.verbosity = verbosity
+        if chunk_size < 1:
+            raise CommandError("--chunk-size should be at least 1")
 
         UserModel = get_user_model()
-        exp = ExpirySettings.get()
-        oldest = exp.earliest_possible_login
+        policy = get_expiry_policy()
+        now = timezone.now()
+        oldest = policy.earliest_possible_login(now)
 
         if oldest is None:
             self._info("Account expiry not configured; nothing to do.")
@@ -28,30 +67,76 @@ class Command(BaseCommand):
 
         self._info("Checking for users who haven't logged in since %s" % oldest)
 
-        gone = UserModel.objects.filter(is_active=True, last_login__lt=oldest)
-
-        for username in gone.values_list(UserModel.USERNAME_FIELD, flat=True):
-            self._info("Deactiviting user: %s" % username)
-
-        messages = list(filter(None, (self._make_email(exp, user) for user in gone)))
-
-        count = gone.update(is_active=False)
-        if count:
-            self._info("%d account(s) expired" % count)
-
-        if email and messages:
-            self._info("Sending e-mails")
-            connection = mail.get_connection()
-            connection.send_messages(messages)
+        # The groups of the overrides are loaded with the users
+        gone = UserModel._default_manager.filter(last_login__lt=oldest).annotate(**policy.annotations)
+        # Resolved once, not for every e-mail
+        site = get_current_site(None) if email else None
+        dispatcher = MailDispatcher(workers=workers, retries=retries) if email else None
+
+        def is_stale(users):
+            return [user for user in users if policy.is_stale(user, now=now)]
+
+        def record_deactivations(users):
+            # Committed with the deactivation. The useraudit models may be in USERAUDIT_DATABASE,
+            # committed just before the users then. If committing the users fails, the next run
+            # discards the pending e-mails of the users still active, and records their
+            # deactivation again when they are deactivated.
+            with transaction.atomic(using=routers.db_for_write(UserDeactivation), savepoint=False):
+                save_deactivations([user.get_username() for user in users], UserDeactivation.ACCOUNT_EXPIRED)
+                if email:
+                    record_pending(KIND, [user.get_username() for user in users if getattr(user, "email", None)])
+
+        try:
+            if email:
+                self._send_pending(policy, site, dispatcher, chunk_size)
+
+            count = 0
+            start = time.time()
+            for users in deactivate_in_chunks(gone, chunk_size, record_deactivations, select=is_stale):
+                for user in users:
+                    self._info("Deactivating user: %s" % user.get_username())
+                count += len(users)
+                accounts_have_expired.send(sender=UserModel, users=users)
+                if email:
+                    self._notify(policy, site, dispatcher, users)
+                elapsed = time.time() - start
+                self._info("%d account(s) expired (%.0f rows/sec)" % (count, count / elapsed if elapsed else count))
+        finally:
+            if dispatcher is not None:
+                dispatcher.close()
+
+        if not count:
+            self._info("No accounts to expire")
 
         self._info("Done")
 
-    def _info(self, msg):
-        if self.verbosity:
+    def _send_pending(self, policy, site, dispatcher, chunk_size):
+        UserModel = get_user_model()
+        for usernames in pending_in_chunks(KIND, chunk_size):
+            users = list(UserModel._default_manager.filter(
+                is_active=False, **{"%s__in" % UserModel.USERNAME_FIELD: usernames}).annotate(
+                **policy.annotations))
+            # Reactivated or deleted since
+            discard_pending(KIND, set(usernames).difference(user.get_username() for user in users))
+            self._info("Sending %d e-mail(s) not sent by a previous run" % len(users))
+            self._notify(policy, site, dispatcher, users)
+
+    def _notify(self, policy, site, dispatcher, users):
+        to_send = [(user, msg) for user, msg in ((user, self._make_email(policy, site, user)) for user in users) if msg]
+        errors = dispatcher.send([msg for _, msg in to_send])
+        sent = []
+        for (user, _), error in zip(to_send, errors):
+            if error is None:
+                sent.append(user.get_username())
+            else:
+                self.stderr.write("Could not e-mail %s, will retry on the next run: %s\n" % (user, error))
+        mark_sent(KIND, sent)
+
+    def _info(self, msg, verbosity=1):
+        if self.verbosity >= verbosity:
             self.stdout.write(msg + "\n")
 
-    def _make_email(self, exp, user):
-        site = get_current_site(None)
+    def _make_email(self, policy, site, user):
         subject = "[%s] Your account has expired" % site.name
         to_email = getattr(user, "email", None)
         msg = """Dear {full_name},
@@ -69,7 +154,7 @@ your account reset.
 
 {site_name} System
         """.format(site_name=site.name,
-                   expiry_days=exp.account_expiry,
+                   expiry_days=policy.for_user(user).account_expiry,
                    last_login=user.last_login.strftime("%x"),
                    full_name=user.get_full_name())
 
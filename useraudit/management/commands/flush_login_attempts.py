@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from ...attempt_cache import get_attempt_cache
+from ...models import LoginAttempt, LoginAttemptLogger
+
+
+class Command(BaseCommand):
+    help = """
+       Writes the failed login counts kept in the cache back to the
+       LoginAttempt table. See USERAUDIT_LOGIN_ATTEMPT_CACHE.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, dest="chunk_size",
+                            help="Number of LoginAttempt rows reconciled at once")
+
+    def handle(self, chunk_size=1000, verbosity=1, **kwargs):
+        self.verbosity = verbosity
+
+        if get_attempt_cache() is None:
+            self._info("Login attempt cache not configured; nothing to do.")
+            return
+
+        login_attempt_logger = LoginAttemptLogger()
+        updated = 0
+        last_pk = 0
+        while True:
+            rows = list(LoginAttempt.objects.filter(pk__gt=last_pk).order_by('pk')
+                        .values_list('pk', 'username')[:chunk_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            updated += login_attempt_logger.flush_cached_counts([username for _, username in rows])
+
+        self._info("%d login attempt count(s) updated" % updated)
+
+    def _info(self, msg):
+        if self.verbosity:
+            self.stdout.write(msg + "\n")
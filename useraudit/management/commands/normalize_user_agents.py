@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ... import models as m
+from ... import routers
+from ...user_agents import normalize_user_agents
+
+
+class Command(BaseCommand):
+    help = """
+       Moves the user agents of the existing LoginLog and FailedLoginLog
+       rows to the UserAgent table. See USERAUDIT_NORMALIZE_USER_AGENTS.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, dest="chunk_size",
+                            help="Number of log rows updated in one transaction")
+
+    def handle(self, chunk_size=1000, verbosity=1, **kwargs):
+        for model in (m.LoginLog, m.FailedLoginLog):
+            updated = normalize_user_agents(model, m.UserAgent, routers.db_for_write(model), chunk_size)
+            if verbosity:
+                self.stdout.write("%s: %d row(s) updated\n" % (model.__name__, updated))
@@ -0,0 +1,140 @@
+from datetime import timedelta
+import time
+
+from django.core.exceptions import FieldError
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.contrib.sites.shortcuts import get_current_site
+from django.utils import timezone
+from ...models import UserNotification
+from ...notifications import MailDispatcher, last_sent, record_sent
+from ...password_expiry import get_expiry_policy
+
+KIND = UserNotification.PASSWORD_EXPIRY_WARNING
+
+
+class Command(BaseCommand):
+    help = """
+       E-mails the active users whose password will expire within
+       PASSWORD_EXPIRY_WARNING_DAYS.
+
+       The users are selected by their password change date in the
+       database, and processed in chunks. The warnings sent are recorded
+       in UserNotification, and a user is only warned once per password,
+       or again after --interval days if it is given.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=int, default=None,
+                            help="Warn the users again after this many days (default: once per password)")
+        parser.add_argument("--chunk-size", type=int, default=1000, dest="chunk_size",
+                            help="Number of users loaded by one query")
+        parser.add_argument("--workers", type=int, default=4,
+                            help="Number of threads sending e-mails")
+        parser.add_argument("--retries", type=int, default=3,
+                            help="Number of times sending an e-mail is retried")
+
+    def handle(self, interval=None, chunk_size=1000, workers=4, retries=3, verbosity=1, **kwargs):
+        self.verbosity = verbosity
+        if chunk_size < 1:
+            raise CommandError("--chunk-size should be at least 1")
+
+        UserModel = get_user_model()
+        policy = get_expiry_policy()
+        now = timezone.now()
+        window = policy.warning_window_filter(now)
+        if window is None:
+            self._info("Password expiry warnings not configured; nothing to do.")
+            return
+
+        try:
+            candidates = UserModel._default_manager.filter(window, is_active=True)
+        except FieldError as e:
+            raise CommandError("Invalid AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR: %s" % e)
+        candidates = candidates.select_related(*policy.select_related).order_by("pk")
+        if policy.group_names:
+            candidates = candidates.prefetch_related("groups")
+
+        # Resolved once, not for every e-mail
+        site = get_current_site(None)
+        count = warned = 0
+        start = time.time()
+        with MailDispatcher(workers=workers, retries=retries) as dispatcher:
+            for users in self._chunks(candidates, chunk_size):
+                count += len(users)
+                warned += self._warn(policy, now, interval, site, dispatcher, users)
+                elapsed = time.time() - start
+                self._info("%d user(s) checked, %d warned (%.0f rows/sec)" % (
+                    count, warned, count / elapsed if elapsed else count))
+
+        if not count:
+            self._info("No passwords about to expire")
+
+        self._info("Done")
+
+    def _chunks(self, queryset, chunk_size):
+        last_pk = None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            users = list(chunk[:chunk_size])
+            if not users:
+                return
+            last_pk = users[-1].pk
+            yield users
+
+    def _warn(self, policy, now, interval, site, dispatcher, users):
+        previous = last_sent(KIND, [user.get_username() for user in users])
+        to_send = []
+        for user in users:
+            status = policy.status(user, now=now)
+            if not status.warn or status.expired or status.days_left is None:
+                continue
+            last = previous.get(user.get_username())
+            if last is not None and self._already_warned(last, policy.password_change_date(user), now, interval):
+                continue
+            msg = self._make_email(site, user, status.days_left)
+            if msg:
+                to_send.append((user, msg))
+
+        errors = dispatcher.send([msg for _, msg in to_send])
+        sent = []
+        for (user, _), error in zip(to_send, errors):
+            if error is None:
+                self._info("Warned user: %s" % user.get_username(), verbosity=2)
+                sent.append(user.get_username())
+            else:
+                self.stderr.write("Could not e-mail %s, will retry on the next run: %s\n" % (user, error))
+        record_sent(KIND, sent)
+        return len(sent)
+
+    def _already_warned(self, last, change_date, now, interval):
+        if change_date is None or last < change_date:
+            # Warned about a previous password
+            return False
+        return interval is None or last > now - timedelta(days=interval)
+
+    def _info(self, msg, verbosity=1):
+        if self.verbosity >= verbosity:
+            self.stdout.write(msg + "\n")
+
+    def _make_email(self, site, user, days_left):
+        subject = "[%s] Your password will expire soon" % site.name
+        to_email = getattr(user, "email", None)
+        msg = """Dear {full_name},
+
+This is an automatic message from the {site_name} system.
+
+Your password will expire in {days_left} day(s). Please log in and change
+it before then, otherwise your account will be deactivated.
+
+{site_name} System
+        """.format(site_name=site.name,
+                   days_left=days_left,
+                   full_name=user.get_full_name())
+
+        if to_email:
+            return mail.EmailMessage(subject, msg, None, [to_email])
+        else:
+            self._info("Could not determine an e-mail address for %s" % user)
+            return None
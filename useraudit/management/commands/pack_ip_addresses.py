@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ... import models as m
+from ... import routers
+from ...ip_storage import pack_ip_addresses
+
+
+class Command(BaseCommand):
+    help = """
+       Moves the IP addresses of the existing LoginLog and FailedLoginLog
+       rows to the packed columns. See USERAUDIT_PACK_IP_ADDRESSES.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, dest="chunk_size",
+                            help="Number of log rows updated in one transaction")
+
+    def handle(self, chunk_size=1000, verbosity=1, **kwargs):
+        for model in (m.LoginLog, m.FailedLoginLog):
+            updated = pack_ip_addresses(model, routers.db_for_write(model), chunk_size)
+            if verbosity:
+                self.stdout.write("%s: %d row(s) updated\n" % (model.__name__, updated))
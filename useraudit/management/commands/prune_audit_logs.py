@@ -0,0 +1,80 @@
+from datetime import timedelta
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from ... import models as m
+from ...retention import delete_in_chunks
+
+PRUNABLE_MODELS = (m.LoginLog, m.FailedLoginLog, m.LoginAttempt, m.UserDeactivation)
+
+
+class Command(BaseCommand):
+    help = """
+       Deletes the audit rows older than their retention period, set by
+       model name in USERAUDIT_RETENTION_DAYS. Ex.
+       USERAUDIT_RETENTION_DAYS = {"LoginLog": 365, "FailedLoginLog": 90}.
+
+       Rows are deleted in short transactions, each one deleting a range of
+       primary keys. Every deleted chunk is committed, so an interrupted run
+       can simply be started again and continues with the rows left.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, dest="chunk_size",
+                            help="Size of the range of primary keys deleted by one statement")
+        parser.add_argument("--sleep", type=float, default=0.0,
+                            help="Seconds to wait between chunks, to let other transactions through")
+        parser.add_argument("--model", action="append", dest="models", metavar="MODEL",
+                            help="Only prune this model (can be repeated)")
+
+    def handle(self, chunk_size=1000, sleep=0.0, models=None, verbosity=1, **kwargs):
+        self.verbosity = verbosity
+        retention = getattr(settings, "USERAUDIT_RETENTION_DAYS", None) or {}
+        if chunk_size < 1:
+            raise CommandError("--chunk-size should be at least 1")
+
+        by_name = dict((model.__name__, model) for model in PRUNABLE_MODELS)
+        unknown = set(models or ()).union(retention).difference(by_name)
+        if unknown:
+            raise CommandError("Unknown model(s): %s. Should be one of %s" % (
+                ", ".join(sorted(unknown)), ", ".join(sorted(by_name))))
+
+        to_prune = [(by_name[name], days) for name, days in sorted(retention.items())
+                    if days and (not models or name in models)]
+        if not to_prune:
+            self._info("Retention not configured; nothing to do.")
+            return
+
+        for model, days in to_prune:
+            cutoff = timezone.now() - timedelta(days=days)
+            self._prune(model, cutoff, chunk_size, sleep)
+
+        self._info("Done")
+
+    def _prune(self, model, cutoff, chunk_size, sleep):
+        name = model.__name__
+        old_rows = model.objects.filter(timestamp__lt=cutoff)
+        bounds = old_rows.aggregate(first=Min("pk"), last=Max("pk"))
+        if bounds["first"] is None:
+            self._info("%s: no rows older than %s" % (name, cutoff))
+            return
+
+        self._info("%s: deleting rows older than %s" % (name, cutoff))
+
+        def progress(deleted, last_pk):
+            if self.verbosity > 1:
+                self._info("%s: %d row(s) deleted, up to id %d" % (name, deleted, last_pk))
+
+        start = time.time()
+        deleted = delete_in_chunks(old_rows, bounds["first"], bounds["last"], chunk_size, sleep, progress)
+        elapsed = time.time() - start
+        self._info("%s: %d row(s) deleted in %.1fs (%.0f rows/sec)" % (
+            name, deleted, elapsed, deleted / elapsed if elapsed else deleted))
+
+    def _info(self, msg):
+        if self.verbosity:
+            self.stdout.write(msg + "\n")
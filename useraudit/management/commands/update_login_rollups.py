@@ -0,0 +1,51 @@
+from datetime import timedelta
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import models as m
+from ... import rollups
+
+
+class Command(BaseCommand):
+    help = """
+       Adds the LoginLog and FailedLoginLog rows written since the last run
+       to the daily login counts (see useraudit.rollups). Rows are counted
+       in primary key order, one chunk per transaction, so an interrupted
+       run can simply be started again. The rows logged within the last
+       --lag-minutes are left for the next run, in case rows with lower
+       primary keys are still to be committed.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000, dest="chunk_size",
+                            help="Size of the range of primary keys counted in one transaction")
+        parser.add_argument("--lag-minutes", type=int, default=5, dest="lag_minutes",
+                            help="Leave the rows logged within this many minutes for the next run")
+
+    def handle(self, chunk_size=10000, lag_minutes=5, verbosity=1, **kwargs):
+        self.verbosity = verbosity
+        if chunk_size < 1:
+            raise CommandError("--chunk-size should be at least 1")
+        if lag_minutes < 0:
+            raise CommandError("--lag-minutes can't be negative")
+        if rollups.is_enabled():
+            raise CommandError("The daily login counts are updated on write (USERAUDIT_ROLLUP_ON_WRITE), "
+                               "running the command would count the logins twice.")
+
+        for model in (m.LoginLog, m.FailedLoginLog):
+            name = model.__name__
+
+            def progress(counted, last_pk):
+                if self.verbosity > 1:
+                    self._info("%s: %d row(s) counted, up to id %d" % (name, counted, last_pk))
+
+            start = time.time()
+            counted = rollups.update_rollups(model, chunk_size, progress, lag=timedelta(minutes=lag_minutes))
+            elapsed = time.time() - start
+            self._info("%s: %d row(s) counted in %.1fs (%.0f rows/sec)" % (
+                name, counted, elapsed, counted / elapsed if elapsed else counted))
+
+    def _info(self, msg):
+        if self.verbosity:
+            self.stdout.write(msg + "\n")
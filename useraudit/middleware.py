@@ -1,19 +1,65 @@
-import threading
-try:
-    from django.utils.deprecation import MiddlewareMixin
-except ImportError:
-    class MiddlewareMixin(object):
-        def __init__(self, *args, **kwargs):
-            pass
+import asyncio
+import contextvars
 
-thread_data = threading.local()
+from django.utils.deprecation import MiddlewareMixin
+
+from . import lookup
+
+# A context variable rather than a thread local, so that each async task
+# (and each greenlet, with contextvars aware gevent/eventlet) sees its own request.
+_request = contextvars.ContextVar('useraudit_request', default=None)
 
 
 def get_request():
-    return getattr(thread_data, 'request', None)
+    """Returns the request being processed in the current context, if any."""
+    return _request.get()
 
 
 class RequestToThreadLocalMiddleware(MiddlewareMixin):
+    """
+    Makes the request available to the authentication backends through
+    get_request() while it is being processed, and opens the lookup scope
+    for it (see useraudit.lookup).
+
+    Can be used as both a sync and an async middleware, so it doesn't
+    cause thread switches under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(getattr(self, 'get_response', None)):
+            return self.__acall__(request)
+        self.process_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            self._reset(request)
+
+    async def __acall__(self, request):
+        self.process_request(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            self._reset(request)
 
     def process_request(self, request):
-        thread_data.request = request
+        request._useraudit_request_token = _request.set(request)
+        request._useraudit_lookup_scope = lookup.begin_scope()
+
+    def process_response(self, request, response):
+        self._reset(request)
+        return response
+
+    def _reset(self, request):
+        lookup.end_scope(getattr(request, '_useraudit_lookup_scope', None))
+        request._useraudit_lookup_scope = None
+        token = getattr(request, '_useraudit_request_token', None)
+        if token is None:
+            return
+        request._useraudit_request_token = None
+        try:
+            _request.reset(token)
+        except ValueError:
+            # Token was created in a different context
+            _request.set(None)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def remove_duplicate_login_attempts(apps, schema_editor):
+    LoginAttempt = apps.get_model('useraudit', 'LoginAttempt')
+    attempts = LoginAttempt.objects.using(schema_editor.connection.alias)
+    duplicates = (attempts.exclude(username=None)
+                  .values('username')
+                  .annotate(rows=models.Count('id'), last_id=models.Max('id'), max_count=models.Max('count'))
+                  .filter(rows__gt=1))
+    for duplicate in duplicates:
+        attempts.filter(username=duplicate['username']).exclude(id=duplicate['last_id']).delete()
+        attempts.filter(id=duplicate['last_id']).update(count=duplicate['max_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('useraudit', '0007_typo'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_login_attempts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='loginattempt',
+            name='username',
+            field=models.CharField(max_length=255, null=True, blank=True, unique=True),
+        ),
+    ]
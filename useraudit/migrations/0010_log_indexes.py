@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('useraudit', '0009_log_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='failedloginlog',
+            index=models.Index(fields=['username', '-timestamp'], name='useraudit_failed_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='failedloginlog',
+            index=models.Index(fields=['ip_address', '-timestamp'], name='useraudit_failed_ip_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='failedloginlog',
+            index=models.Index(fields=['-timestamp'], name='useraudit_failed_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loginlog',
+            index=models.Index(fields=['username', '-timestamp'], name='useraudit_login_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loginlog',
+            index=models.Index(fields=['ip_address', '-timestamp'], name='useraudit_login_ip_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loginlog',
+            index=models.Index(fields=['-timestamp'], name='useraudit_login_ts_idx'),
+        ),
+    ]
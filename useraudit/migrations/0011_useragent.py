@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The user agents of the existing rows are moved by the normalize_user_agents command,
+# so that the data after migrating doesn't depend on the settings.
+
+def restore_user_agents(apps, schema_editor):
+    # Copies the user agents moved to UserAgent back into the user_agent columns
+    using = schema_editor.connection.alias
+    UserAgent = apps.get_model('useraudit', 'UserAgent')
+    for model_name in ('LoginLog', 'FailedLoginLog'):
+        log_model = apps.get_model('useraudit', model_name)
+        for user_agent in UserAgent.objects.using(using).iterator():
+            log_model.objects.using(using).filter(user_agent_ref=user_agent).update(
+                user_agent=user_agent.name, user_agent_ref=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('useraudit', '0010_log_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=40, unique=True)),
+                ('name', models.CharField(max_length=1000)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='failedloginlog',
+            name='user_agent_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='useraudit.useragent', verbose_name='user agent'),
+        ),
+        migrations.AddField(
+            model_name='loginlog',
+            name='user_agent_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='useraudit.useragent', verbose_name='user agent'),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, restore_user_agents),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import useraudit.ip_storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('useraudit', '0011_useragent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='failedloginlog',
+            name='forwarded_by_packed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='failedloginlog',
+            name='ip_address_packed',
+            field=useraudit.ip_storage.PackedIPAddressField(blank=True, editable=False, null=True, verbose_name='IP'),
+        ),
+        migrations.AddField(
+            model_name='loginlog',
+            name='forwarded_by_packed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='loginlog',
+            name='ip_address_packed',
+            field=useraudit.ip_storage.PackedIPAddressField(blank=True, editable=False, null=True, verbose_name='IP'),
+        ),
+        migrations.AddIndex(
+            model_name='failedloginlog',
+            index=models.Index(fields=['ip_address_packed', '-timestamp'], name='useraudit_failed_ipp_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loginlog',
+            index=models.Index(fields=['ip_address_packed', '-timestamp'], name='useraudit_login_ipp_ts_idx'),
+        ),
+    ]
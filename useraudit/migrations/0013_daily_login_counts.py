@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('useraudit', '0012_packed_ip_addresses'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyIPLoginCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('successes', models.PositiveIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('ip_address', models.CharField(max_length=40, verbose_name='IP')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyLoginCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('successes', models.PositiveIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyUserLoginCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('successes', models.PositiveIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('username', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_pk', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dailyuserlogincount',
+            index=models.Index(fields=['username', 'day'], name='useraudit_daily_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyuserlogincount',
+            constraint=models.UniqueConstraint(fields=('day', 'username'), name='useraudit_daily_user_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailylogincount',
+            constraint=models.UniqueConstraint(fields=('day',), name='useraudit_daily_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyiplogincount',
+            index=models.Index(fields=['ip_address', 'day'], name='useraudit_daily_ip_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyiplogincount',
+            constraint=models.UniqueConstraint(fields=('day', 'ip_address'), name='useraudit_daily_ip_uniq'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('useraudit', '0014_user_notifications'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usernotification',
+            name='kind',
+            field=models.CharField(choices=[('AE', 'Account expired'), ('PW', 'Password expiry warning')], max_length=2),
+        ),
+    ]
@@ -1,16 +1,42 @@
 from __future__ import unicode_literals
 import datetime
 import logging
-from django.db import models
-from django.contrib.auth.signals import user_logged_in
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from . import ip_storage, log_writer, login_state, rollups, routers, user_agents
+from .attempt_cache import get_attempt_cache
 from .signals import password_has_expired, account_has_expired, login_failure_limit_reached
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0, the async methods can't be used
+    sync_to_async = None
 
 
 logger = logging.getLogger('django.security')
 
+# The async ORM API (acreate, aupdate_or_create, afirst, adelete...) is available from Django 4.1.
+# Before that the async methods below run their sync counterparts in a thread.
+HAS_ASYNC_ORM = hasattr(models.QuerySet, 'acreate')
+
+
+class AuditManager(models.Manager):
+    """Queries USERAUDIT_DATABASE if it is set, see useraudit.routers."""
+
+    def get_queryset(self):
+        queryset = super(AuditManager, self).get_queryset()
+        database = routers.get_database()
+        if self._db is None and database is not None:
+            queryset = queryset.using(database)
+        return queryset
+
 
 class LoginAttempt(models.Model):
-    username = models.CharField(max_length=255, null=True, blank=True)
+    objects = AuditManager()
+
+    username = models.CharField(max_length=255, null=True, blank=True, unique=True)
     count = models.PositiveIntegerField(null=True, blank=True, default=0)
     timestamp = models.DateTimeField(auto_now_add=True)
 
@@ -18,17 +44,238 @@ class LoginAttempt(models.Model):
 class LoginAttemptLogger(object):
 
     def reset(self, username):
+        attempt_cache = get_attempt_cache()
+        if attempt_cache is not None:
+            attempt_cache.reset(username)
         defaults = {
             'count': 0,
             'timestamp': datetime.datetime.now()
         }
         LoginAttempt.objects.update_or_create(username=username, defaults=defaults)
 
+    def reset_many(self, usernames):
+        """Resets the counts of usernames with a single UPDATE. Users without a count have nothing to reset."""
+        attempt_cache = get_attempt_cache()
+        if attempt_cache is not None:
+            attempt_cache.reset_many(usernames)
+        LoginAttempt.objects.filter(username__in=list(usernames)).exclude(count=0).update(
+            count=0, timestamp=datetime.datetime.now())
+
+    async def areset(self, username):
+        if not HAS_ASYNC_ORM or get_attempt_cache() is not None:
+            return await sync_to_async(self.reset)(username)
+        defaults = {
+            'count': 0,
+            'timestamp': datetime.datetime.now()
+        }
+        await LoginAttempt.objects.aupdate_or_create(username=username, defaults=defaults)
+
+    def reset_if_needed(self, username):
+        """Resets the count if it isn't 0. Unlike reset() it doesn't write anything otherwise,
+        and doesn't create the LoginAttempt row if there is none."""
+        attempt_cache = get_attempt_cache()
+        if attempt_cache is not None:
+            if attempt_cache.get(username) == 0:
+                return
+            attempt_cache.reset(username)
+        attempts = LoginAttempt.objects.filter(username=username).exclude(count=0)
+        attempts.update(count=0, timestamp=datetime.datetime.now())
+
+    async def areset_if_needed(self, username):
+        if not HAS_ASYNC_ORM or get_attempt_cache() is not None:
+            return await sync_to_async(self.reset_if_needed)(username)
+        attempts = LoginAttempt.objects.filter(username=username).exclude(count=0)
+        await attempts.aupdate(count=0, timestamp=datetime.datetime.now())
+
+    def get_count(self, username):
+        attempt_cache = get_attempt_cache()
+        if attempt_cache is not None:
+            count = attempt_cache.get(username)
+            if count is not None:
+                return count
+        return LoginAttempt.objects.filter(username=username).values_list('count', flat=True).first()
+
+    async def aget_count(self, username):
+        if not HAS_ASYNC_ORM or get_attempt_cache() is not None:
+            return await sync_to_async(self.get_count)(username)
+        return await LoginAttempt.objects.filter(username=username).values_list('count', flat=True).afirst()
+
     def increment(self, username):
-        obj, created = LoginAttempt.objects.get_or_create(username=username)
-        obj.count += 1
-        obj.timestamp = datetime.datetime.now()
-        obj.save()
+        """Atomically increments the failed login counter and returns the new count."""
+        count = self._increment(username)
+        # After counting, see useraudit.login_state
+        login_state.mark_dirty(username)
+        return count
+
+    def _increment(self, username):
+        attempt_cache = get_attempt_cache()
+        if attempt_cache is None:
+            return self._increment_in_db(username)
+
+        count = attempt_cache.incr(username)
+        if count is None:
+            # Not cached yet, load the counter from the database including this attempt
+            count = self._increment_in_db(username)
+            if attempt_cache.load(username, count):
+                return count
+            count = attempt_cache.incr(username) or count
+        attempt_cache.mark_dirty(username)
+        if attempt_cache.is_flush_due():
+            self.flush_cached_counts()
+        return count
+
+    async def aincrement(self, username):
+        # Django has no async database cursors, so the upsert statement runs in a thread
+        return await sync_to_async(self.increment)(username)
+
+    def flush_cached_counts(self, usernames=None, batch_size=500):
+        """Writes the cached counts back to the LoginAttempt table.
+
+        Writes the counts changed by this process unless usernames are passed in.
+        The counts are written batch_size users at a time, with a few statements
+        per batch. Returns the number of rows written."""
+        attempt_cache = get_attempt_cache()
+        if attempt_cache is None:
+            return 0
+        if usernames is None:
+            usernames = attempt_cache.pop_dirty()
+        usernames = list(usernames)
+        written = 0
+        for start in range(0, len(usernames), batch_size):
+            written += self._write_back(attempt_cache, usernames[start:start + batch_size])
+        return written
+
+    def _write_back(self, attempt_cache, usernames):
+        cached_counts = attempt_cache.get_many(usernames)
+        if not cached_counts:
+            return 0
+        now = datetime.datetime.now()
+        changed = []
+        for attempt in LoginAttempt.objects.filter(username__in=list(cached_counts)).only('username', 'count'):
+            count = cached_counts.pop(attempt.username)
+            if attempt.count != count:
+                attempt.count = count
+                attempt.timestamp = now
+                changed.append(attempt)
+        LoginAttempt.objects.bulk_update(changed, ['count', 'timestamp'])
+        # The counters left have no row anymore (ex. pruned since they were loaded)
+        LoginAttempt.objects.bulk_create(
+            [LoginAttempt(username=username, count=count) for username, count in cached_counts.items()],
+            ignore_conflicts=True)
+        return len(changed) + len(cached_counts)
+
+    def _increment_in_db(self, username):
+        connection = connections[routers.db_for_write(LoginAttempt)]
+        now = datetime.datetime.now()
+        if self._can_upsert_returning(connection):
+            return self._upsert_returning(connection, username, now)
+        if connection.vendor == 'mysql':
+            return self._upsert_mysql(connection, username, now)
+        return self._update_or_insert(connection, username, now)
+
+    def _can_upsert_returning(self, connection):
+        if connection.vendor == 'postgresql':
+            return True
+        if connection.vendor == 'sqlite':
+            # RETURNING is supported from SQLite 3.35
+            return connection.Database.sqlite_version_info >= (3, 35, 0)
+        return False
+
+    def _sql_names(self, connection):
+        qn = connection.ops.quote_name
+        opts = LoginAttempt._meta
+        return {
+            'table': qn(opts.db_table),
+            'username': qn(opts.get_field('username').column),
+            'count': qn(opts.get_field('count').column),
+            'timestamp': qn(opts.get_field('timestamp').column),
+        }
+
+    def _db_timestamp(self, connection, now):
+        return LoginAttempt._meta.get_field('timestamp').get_db_prep_value(now, connection)
+
+    def _upsert_returning(self, connection, username, now):
+        sql = (
+            'INSERT INTO {table} ({username}, {count}, {timestamp}) VALUES (%s, 1, %s) '
+            'ON CONFLICT ({username}) DO UPDATE SET '
+            '{count} = COALESCE({table}.{count}, 0) + 1, {timestamp} = EXCLUDED.{timestamp} '
+            'RETURNING {count}'
+        ).format(**self._sql_names(connection))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [username, self._db_timestamp(connection, now)])
+            return cursor.fetchone()[0]
+
+    def _upsert_mysql(self, connection, username, now):
+        # LAST_INSERT_ID(expr) stores the incremented value for this connection,
+        # so it can be read back without touching the table again.
+        sql = (
+            'INSERT INTO {table} ({username}, {count}, {timestamp}) VALUES (%s, 1, %s) '
+            'ON DUPLICATE KEY UPDATE '
+            '{count} = LAST_INSERT_ID(COALESCE({count}, 0) + 1), {timestamp} = VALUES({timestamp})'
+        ).format(**self._sql_names(connection))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [username, self._db_timestamp(connection, now)])
+            # 1 affected row means a new row was inserted, 2 that an existing one was updated
+            if cursor.rowcount == 1:
+                return 1
+            cursor.execute('SELECT LAST_INSERT_ID()')
+            return cursor.fetchone()[0]
+
+    def _update_or_insert(self, connection, username, now):
+        attempts = LoginAttempt.objects.using(connection.alias).filter(username=username)
+        while True:
+            with transaction.atomic(using=connection.alias):
+                # The UPDATE keeps the row locked until the end of the transaction,
+                # so the count read back is the one we have just written.
+                if attempts.update(count=Coalesce(F('count'), 0) + 1, timestamp=now):
+                    return attempts.values_list('count', flat=True).get()
+            try:
+                with transaction.atomic(using=connection.alias):
+                    LoginAttempt.objects.using(connection.alias).create(username=username, count=1, timestamp=now)
+                    return 1
+            except IntegrityError:
+                # Another process inserted the row first, retry the UPDATE
+                pass
+
+
+class LogQuerySet(models.QuerySet):
+    """Queries on the login logs that are answered by the indexes of the log tables."""
+
+    def for_user(self, username):
+        return self.filter(username=username)
+
+    def for_ip(self, ip_address):
+        if ip_storage.is_enabled() and ip_storage.parse(ip_address) is not None:
+            # Rows written before the setting was enabled have the address in ip_address
+            return self.filter(Q(ip_address_packed=ip_address) | Q(ip_address=ip_address))
+        return self.filter(ip_address=ip_address)
+
+    def in_network(self, network):
+        """Logs from the addresses of network, e.g. '10.2.0.0/16', as a range of the packed addresses index.
+
+        Only finds the logs with packed addresses, see USERAUDIT_PACK_IP_ADDRESSES."""
+        return self.filter(ip_address_packed__range=ip_storage.network_range(network))
+
+    def between(self, start=None, end=None):
+        """Logs from start (inclusive) until end (exclusive). Either can be None for an open range."""
+        logs = self
+        if start is not None:
+            logs = logs.filter(timestamp__gte=start)
+        if end is not None:
+            logs = logs.filter(timestamp__lt=end)
+        return logs
+
+
+class UserAgent(models.Model):
+    """A distinct user agent, referenced by the logs when USERAUDIT_NORMALIZE_USER_AGENTS is set."""
+    objects = AuditManager()
+
+    # SHA-1 of the name, because the name is too long to be indexed on some databases
+    digest = models.CharField(max_length=40, unique=True)
+    name = models.CharField(max_length=1000)
+
+    def __str__(self):
+        return self.name
 
 
 class Log(models.Model):
@@ -36,14 +283,45 @@ class Log(models.Model):
         abstract = True
         ordering = ['-timestamp']
 
+    objects = AuditManager.from_queryset(LogQuerySet)()
+
     username = models.CharField(max_length=255, null=True, blank=True)
     ip_address = models.CharField(max_length=40, null=True, blank=True, verbose_name="IP")
     forwarded_by = models.CharField(max_length=1000, null=True, blank=True)
     user_agent = models.CharField(max_length=1000, null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set instead of ip_address and forwarded_by when IP addresses are packed, see useraudit.ip_storage
+    ip_address_packed = ip_storage.PackedIPAddressField(null=True, blank=True, editable=False, verbose_name="IP")
+    forwarded_by_packed = models.BinaryField(null=True, blank=True)
+    # Set instead of user_agent when user agents are normalized, see useraudit.user_agents
+    user_agent_ref = models.ForeignKey(UserAgent, null=True, blank=True, on_delete=models.PROTECT,
+                                       related_name='+', verbose_name="user agent")
+    # Not auto_now_add, because buffered logs are written later (see log_writer)
+    # and they should keep the time of the login.
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    @property
+    def ip(self):
+        """The client IP address, whether it is stored as a string or packed."""
+        if self.ip_address is None and self.ip_address_packed is not None:
+            return self.ip_address_packed
+        return self.ip_address
+
+    @property
+    def forwarded(self):
+        """The proxy chain as a comma separated string, whether it is stored as a string or packed."""
+        if self.forwarded_by is None and self.forwarded_by_packed is not None:
+            return ",".join(str(address) for address in ip_storage.unpack_list(self.forwarded_by_packed))
+        return self.forwarded_by
+
+    @property
+    def agent(self):
+        """The user agent, whether it is stored in the log row or in the UserAgent table."""
+        if self.user_agent is None and self.user_agent_ref_id is not None:
+            return self.user_agent_ref.name
+        return self.user_agent
 
     def __str__(self):
-        return '%s|%s|%s|%s|%s' % (self.username, self.ip_address, self.forwarded_by, self.user_agent, self.timestamp)
+        return '%s|%s|%s|%s|%s' % (self.username, self.ip, self.forwarded, self.agent, self.timestamp)
 
 
 class UserDeactivation(models.Model):
@@ -57,28 +335,178 @@ class UserDeactivation(models.Model):
         (TOO_MANY_FAILED_LOGINS, 'Too many failed login attempts'),
     )
 
+    objects = AuditManager()
+
     username = models.CharField(max_length=255)
     reason = models.CharField(max_length=2, blank=True, null=True, choices=DEACTIVATION_REASON_CHOICES)
     timestamp = models.DateTimeField(auto_now_add=True)
 
 
+class UserNotification(models.Model):
+    """An e-mail sent to a user by a management command.
+
+    Recorded as pending (sent is null) before the e-mail is sent, so that
+    the e-mails not sent by an interrupted run are sent by the next one."""
+    ACCOUNT_EXPIRED = 'AE'
+    PASSWORD_EXPIRY_WARNING = 'PW'
+
+    KIND_CHOICES = (
+        (ACCOUNT_EXPIRED, 'Account expired'),
+        (PASSWORD_EXPIRY_WARNING, 'Password expiry warning'),
+    )
+
+    objects = AuditManager()
+
+    username = models.CharField(max_length=255)
+    kind = models.CharField(max_length=2, choices=KIND_CHOICES)
+    timestamp = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'sent'], name='useraudit_notif_kind_idx'),
+            models.Index(fields=['username', 'kind'], name='useraudit_notif_user_idx'),
+        ]
+
+
+def log_indexes(prefix):
+    # Index names are limited to 30 characters and have to be unique in the database
+    return [
+        models.Index(fields=['username', '-timestamp'], name='%s_user_ts_idx' % prefix),
+        models.Index(fields=['ip_address', '-timestamp'], name='%s_ip_ts_idx' % prefix),
+        models.Index(fields=['ip_address_packed', '-timestamp'], name='%s_ipp_ts_idx' % prefix),
+        models.Index(fields=['-timestamp'], name='%s_ts_idx' % prefix),
+    ]
+
+
 class FailedLoginLog(Log):
-    pass
+    class Meta(Log.Meta):
+        indexes = log_indexes('useraudit_failed')
 
 
 class LoginLog(Log):
-    pass
+    class Meta(Log.Meta):
+        indexes = log_indexes('useraudit_login')
+
+
+class LoginCountQuerySet(models.QuerySet):
+    """Queries on the daily login counts, see useraudit.rollups."""
+
+    def between(self, start=None, end=None):
+        """Counts of the days from start (inclusive) until end (exclusive). Either can be None for an open range."""
+        counts = self
+        if start is not None:
+            counts = counts.filter(day__gte=start)
+        if end is not None:
+            counts = counts.filter(day__lt=end)
+        return counts
+
+    def totals(self):
+        """Sums the counts of the days, grouped by the values() fields if any."""
+        return self.annotate(total_successes=Sum('successes'), total_failures=Sum('failures'))
+
+    def top(self, field, limit=10, failures=True):
+        """The limit values of field with the most failed (or successful) logins, as
+        (value, successes, failures) tuples, most logins first."""
+        order = '-total_failures' if failures else '-total_successes'
+        rows = self.values(field).totals().order_by(order, field)[:limit]
+        return [(row[field], row['total_successes'], row['total_failures']) for row in rows]
+
+
+class LoginCount(models.Model):
+    class Meta:
+        abstract = True
+
+    objects = AuditManager.from_queryset(LoginCountQuerySet)()
+
+    day = models.DateField()
+    successes = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+
+
+class DailyLoginCount(LoginCount):
+    """Logins per day."""
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day'], name='useraudit_daily_uniq')]
+
+
+class DailyUserLoginCount(LoginCount):
+    """Logins per day and username."""
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'username'], name='useraudit_daily_user_uniq')]
+        indexes = [models.Index(fields=['username', 'day'], name='useraudit_daily_user_idx')]
+
+    username = models.CharField(max_length=255)
+
+
+class DailyIPLoginCount(LoginCount):
+    """Logins per day and client IP address."""
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'ip_address'], name='useraudit_daily_ip_uniq')]
+        indexes = [models.Index(fields=['ip_address', 'day'], name='useraudit_daily_ip_idx')]
+
+    ip_address = models.CharField(max_length=40, verbose_name="IP")
+
+
+class RollupProgress(models.Model):
+    """The last log row counted in the daily login counts by the update_login_rollups command."""
+    objects = AuditManager()
+
+    name = models.CharField(max_length=100, unique=True)
+    last_pk = models.BigIntegerField(default=0)
 
 
 class LoginLogger(object):
 
     def log_failed_login(self, username, request):
         fields = self.extract_log_info(username, request)
-        FailedLoginLog.objects.create(**fields)
+        self._save(FailedLoginLog(**fields))
 
     def log_login(self, username, request):
         fields = self.extract_log_info(username, request)
-        LoginLog.objects.create(**fields)
+        self._save(LoginLog(**fields))
+
+    async def alog_failed_login(self, username, request):
+        fields = self.extract_log_info(username, request)
+        await self._asave(FailedLoginLog(**fields))
+
+    async def alog_login(self, username, request):
+        fields = self.extract_log_info(username, request)
+        await self._asave(LoginLog(**fields))
+
+    def _save(self, log):
+        if user_agents.is_enabled() and log.user_agent is not None:
+            log.user_agent_ref_id = user_agents.get_user_agent_id(log.user_agent)
+            log.user_agent = None
+        writer = log_writer.get_writer()
+        if writer is not None:
+            # Also counted by the writer in the daily counts
+            writer.write(log)
+            return
+        using = routers.db_for_write(type(log))
+        log.save(using=using)
+        if rollups.is_enabled():
+            # Counted after the commit, so that the daily counts aren't locked until the end of the request
+            transaction.on_commit(lambda: rollups.count_logins([log]), using=using)
+
+    async def _asave(self, log):
+        if user_agents.is_enabled() and log.user_agent is not None:
+            log.user_agent_ref_id = await user_agents.aget_user_agent_id(log.user_agent)
+            log.user_agent = None
+        writer = log_writer.get_writer()
+        if writer is not None:
+            if not writer.write_nowait(log):
+                # The write has to wait for space in the buffer or save the record itself
+                await sync_to_async(writer.write)(log)
+            return
+        if hasattr(log, 'asave'):
+            # Django 4.2+
+            await log.asave(using=routers.db_for_write(type(log)))
+        else:
+            await sync_to_async(log.save)(using=routers.db_for_write(type(log)))
+        if rollups.is_enabled():
+            # Not in a transaction, async code runs in autocommit mode
+            await sync_to_async(rollups.count_logins)([log])
 
     def extract_log_info(self, username, request):
         USER_AGENT_MAX_LENGTH = Log._meta.get_field('user_agent').max_length
@@ -95,12 +523,15 @@ class LoginLogger(object):
                            USER_AGENT_MAX_LENGTH, user_agent)
             user_agent = user_agent[:USER_AGENT_MAX_LENGTH]
 
-        return {
+        fields = {
             'username': username,
             'ip_address': ip_address,
             'user_agent': user_agent,
             'forwarded_by': ",".join(proxies or [])
         }
+        if ip_storage.is_enabled():
+            fields.update(ip_storage.pack_log_info(fields['ip_address'], fields['forwarded_by']))
+        return fields
 
     def extract_ip_address(self, request):
         client_ip = request.META.get('REMOTE_ADDR')
@@ -120,15 +551,53 @@ login_logger = LoginLogger()
 login_attempt_logger = LoginAttemptLogger()
 
 
+# Receivers of user_logged_in, one of them is connected when the app is ready (see useraudit.receivers)
 def login_callback(sender, user, request, **kwargs):
     username = user.get_username()
     login_logger.log_login(username, request)
-    login_attempt_logger.reset(username)
+    clear_login_state(username)
+
+
+async def alogin_callback(sender, user, request, **kwargs):
+    username = user.get_username()
+    await login_logger.alog_login(username, request)
+    await aclear_login_state(username)
+
+
+def _reset_lockout_policy(username):
+    # Imported here, useraudit.backend imports this module
+    from .backend import get_lockout_policy
+    get_lockout_policy().reset(username)
+
+
+def clear_login_state(username):
+    """Resets the failed login count and the lockout policy and deletes the deactivations of
+    username, skipping it all if they are known to be clean (see useraudit.login_state)."""
+    state_cache = login_state.get_login_state_cache()
+    if state_cache is not None:
+        if state_cache.is_clean(username):
+            return
+        # Marked before clearing, so that a failure counted meanwhile unmarks it again
+        state_cache.mark_clean(username)
+    login_attempt_logger.reset_if_needed(username)
+    _reset_lockout_policy(username)
     UserDeactivation.objects.filter(username=username).delete()
 
 
-# User logged in Django signal
-user_logged_in.connect(login_callback)
+async def aclear_login_state(username):
+    state_cache = login_state.get_login_state_cache()
+    if state_cache is not None:
+        if await state_cache.ais_clean(username):
+            return
+        await state_cache.amark_clean(username)
+    await login_attempt_logger.areset_if_needed(username)
+    # The policies use the synchronous cache API
+    await sync_to_async(_reset_lockout_policy)(username)
+    deactivations = UserDeactivation.objects.filter(username=username)
+    if HAS_ASYNC_ORM:
+        await deactivations.adelete()
+    else:
+        await sync_to_async(deactivations.delete)()
 
 
 def save_login_deactivation(reason):
@@ -136,9 +605,18 @@ def save_login_deactivation(reason):
         username = user.get_username()
         UserDeactivation.objects.filter(username=username).delete()
         UserDeactivation.objects.create(username=username, reason=reason)
+        login_state.mark_dirty(username)
     return callback
 
 
+def save_deactivations(usernames, reason):
+    """Records the deactivation of many users with a few statements (ex. a chunk of expired accounts)."""
+    usernames = list(usernames)
+    UserDeactivation.objects.filter(username__in=usernames).delete()
+    UserDeactivation.objects.bulk_create([UserDeactivation(username=username, reason=reason) for username in usernames])
+    login_state.mark_dirty_many(usernames)
+
+
 password_expired_callback = save_login_deactivation(UserDeactivation.PASSWORD_EXPIRED)
 account_expired_callback = save_login_deactivation(UserDeactivation.ACCOUNT_EXPIRED)
 login_failure_limit_reached_callback = save_login_deactivation(UserDeactivation.TOO_MANY_FAILED_LOGINS)
@@ -147,9 +625,3 @@ login_failure_limit_reached_callback = save_login_deactivation(UserDeactivation.
 password_has_expired.connect(password_expired_callback)
 account_has_expired.connect(account_expired_callback)
 login_failure_limit_reached.connect(login_failure_limit_reached_callback)
-
-
-# Import password expiry module so that the signal is registered.
-# The password expiry feature won't be active unless the necessary
-# settings are present.
-from . import password_expiry  # noqa
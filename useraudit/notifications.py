@@ -0,0 +1,140 @@
+"""
+Sending the e-mails of the management commands, and recording who was notified.
+
+MailDispatcher sends the messages from a bounded pool of threads. Each
+thread opens its own mail connection once and reuses it for all its
+messages, so one slow server response only holds up one thread. A message
+that fails is retried with exponential backoff on a new connection, and
+the error is returned if it still fails after the last retry.
+
+The commands record a pending UserNotification for each user before the
+e-mail is sent (ex. in the transaction deactivating them), and mark it
+sent once it was. The notifications still pending after an interrupted
+run, or a failure, are sent by the next run.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from django.core import mail
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import UserNotification
+
+
+class MailDispatcher(object):
+
+    def __init__(self, workers=4, retries=3, backoff=1.0, get_connection=None, sleep=time.sleep):
+        self.workers = max(1, workers)
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.get_connection = get_connection or mail.get_connection
+        self.sleep = sleep
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self.get_connection(fail_silently=False)
+            connection.open()
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is None:
+            return
+        with self._lock:
+            self._connections.remove(connection)
+        try:
+            connection.close()
+        except Exception:
+            # Closing a broken connection may fail too, a new one is opened anyway
+            pass
+
+    def send_one(self, message):
+        """Sends message, returns None if it was sent or the error of the last attempt."""
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                self._connection().send_messages([message])
+                return None
+            except Exception as e:
+                error = e
+                self._drop_connection()
+        return error
+
+    def send(self, messages):
+        """Sends messages concurrently. Returns the errors (None for the messages sent), in the same order."""
+        if self.workers == 1:
+            return [self.send_one(message) for message in messages]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return list(self._executor.map(self.send_one, messages))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+def record_pending(kind, usernames):
+    """Records the notifications about to be sent to usernames."""
+    UserNotification.objects.bulk_create([UserNotification(username=username, kind=kind) for username in usernames])
+
+
+def record_sent(kind, usernames):
+    """Records the notifications sent to usernames, for the notifications that aren't recorded as pending first."""
+    now = timezone.now()
+    UserNotification.objects.bulk_create([UserNotification(username=username, kind=kind, sent=now)
+                                          for username in usernames])
+
+
+def last_sent(kind, usernames):
+    """Returns when the last notification of kind was sent to each of usernames that was ever notified."""
+    return dict(UserNotification.objects.filter(kind=kind, username__in=list(usernames), sent__isnull=False).values(
+        'username').annotate(last=Max('sent')).values_list('username', 'last'))
+
+
+def mark_sent(kind, usernames):
+    UserNotification.objects.filter(kind=kind, sent__isnull=True, username__in=list(usernames)).update(
+        sent=timezone.now())
+
+
+def pending_in_chunks(kind, chunk_size=1000):
+    """Yields the usernames with pending notifications of kind, chunk_size usernames at a time."""
+    pending = UserNotification.objects.filter(kind=kind, sent__isnull=True).order_by('pk')
+    last_pk = 0
+    while True:
+        rows = list(pending.filter(pk__gt=last_pk).values_list('pk', 'username')[:chunk_size])
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        yield sorted(set(username for _, username in rows))
+
+
+def discard_pending(kind, usernames):
+    """Drops the pending notifications of usernames that shouldn't be sent anymore."""
+    UserNotification.objects.filter(kind=kind, sent__isnull=True, username__in=list(usernames)).delete()
@@ -81,9 +81,9 @@ How to use:
 
 7. Add code to your frontend to nag the user if their password is due
    to expire. Otherwise one day they will be unable to login and they
-   won't know why.
-
-   todo: add an automatic process for e-mailing users before password expiry
+   won't know why. The notify_password_expiry management command
+   e-mails the users whose password is about to expire, run it daily
+   from a cron job.
 
 8. In your deployment scripts, include a daily cronjob to run the
    disable_inactive_users management command. This will let users know
@@ -96,21 +96,37 @@ from functools import reduce
 from datetime import timedelta
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.exceptions import PermissionDenied
-from django.db.models.signals import pre_save
+from django.core.exceptions import FieldDoesNotExist, PermissionDenied
+from django.core.signals import setting_changed
+from django.db.models import Exists, OuterRef, Q
 from django.dispatch import receiver
 from django.utils import timezone
 import logging
 from .backend import AuthFailedLoggerBackend
+from .lookup import aget_user_by_natural_key, get_user_by_natural_key, lookup_scope
+from .middleware import get_request
+from .models import sync_to_async
 from .signals import password_has_expired, password_will_expire_warning, account_has_expired
+from .throttle import get_ip_throttle
+from .tracking import is_reactivated, password_changed
 
 logger = logging.getLogger("django.security")
 
+EXPIRY_SETTINGS = (
+    "AUTH_USER_MODEL",
+    "PASSWORD_EXPIRY_DAYS",
+    "PASSWORD_EXPIRY_WARNING_DAYS",
+    "AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR",
+    "AUTH_USER_MODEL_PASSWORD_ATTR",
+    "ACCOUNT_EXPIRY_DAYS",
+    "USERAUDIT_EXPIRY_OVERRIDES",
+)
+
 __all__ = ["AccountExpiryBackend"]
 
 
-@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
-def user_pre_save(sender, instance=None, raw=False, **kwargs):
+# Connected by useraudit.receivers if AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR or ACCOUNT_EXPIRY_DAYS is set
+def user_pre_save(sender, instance=None, raw=False, update_fields=None, **kwargs):
     user = instance
     attrs = ExpirySettings.get()
     # We're saving the password change date only for existing users
@@ -122,19 +138,17 @@ def user_pre_save(sender, instance=None, raw=False, **kwargs):
     if is_new_user or raw:
         return
     if attrs.date_changed:
-        update_date_changed(user, attrs.date_changed)
+        update_date_changed(user, attrs.date_changed, update_fields)
 
     # User has been re-activated. Ensure the last_login is set to None so
     # that the user isn't inactivated on next login by the AccountExpiryBackend
-    current_user = sender.objects.get(pk=user.pk)
-    if not current_user.is_active and user.is_active:
+    if is_reactivated(user, update_fields):
         user.last_login = None
 
 
-def update_date_changed(user, date_changed_attr):
+def update_date_changed(user, date_changed_attr, update_fields=None):
     def did_password_change(user):
-        current_user = get_user_model().objects.get(pk=user.pk)
-        return current_user.password != user.password
+        return password_changed(user, update_fields)
 
     def save_profile_password_change_date(user, date):
         parts = date_changed_attr.split('.')
@@ -155,38 +169,19 @@ def update_date_changed(user, date_changed_attr):
 
 
 def should_warn_about_password_expiry(user):
-    warn_in_days = ExpirySettings.get().num_warning_days or 0
-    days_left = days_to_password_expiry(user) or 0
-    return warn_in_days > 0 and days_left <= warn_in_days
+    return get_expiry_policy().status(user).warn
 
 
 def days_to_password_expiry(user):
-    earliest = ExpirySettings.get().earliest_possible_password_change
-    if earliest:
-        change_date = get_password_change_date(user)
-        if change_date:
-            return (change_date - earliest).days
+    return get_expiry_policy().status(user).days_left
 
 
 def is_password_expired(user):
-    days = days_to_password_expiry(user)
-    return days is not None and days < 0
+    return get_expiry_policy().status(user).expired
 
 
 def get_password_change_date(user):
-    attr = ExpirySettings.get().date_changed
-    if attr:
-        val = user
-        if isinstance(attr, str):
-            for part in attr.split("."):
-                if hasattr(val, part):
-                    val = getattr(val, part)
-                else:
-                    logger.warning("User model does not have a %s attribute" % attr)
-                    return None
-            return val
-        else:
-            logger.warning("Password change attr in settings is not a string")
+    return get_expiry_policy().password_change_date(user)
 
 
 def get_user_last_login(user):
@@ -198,11 +193,7 @@ def get_user_last_login(user):
 
 
 def is_account_expired(user):
-    earliest = ExpirySettings.get().earliest_possible_login
-    if earliest:
-        last_login = get_user_last_login(user)
-        return last_login and last_login < earliest
-    return False
+    return get_expiry_policy().status(user).stale
 
 
 class ExpirySettings(namedtuple("ExpirySettings",
@@ -229,53 +220,349 @@ class ExpirySettings(namedtuple("ExpirySettings",
         return None
 
 
+# The result of checking a user against the expiry policy:
+# expired - the password has expired
+# stale - the account has expired (the user hasn't logged in for too long)
+# days_left - days until the password expires, None if it doesn't
+# warn - the user should be warned about their password expiring
+ExpiryStatus = namedtuple("ExpiryStatus", ["expired", "stale", "days_left", "warn"])
+
+
+class ExpiryPolicy(object):
+    """
+    The expiry settings, compiled once (see get_expiry_policy()).
+
+    USERAUDIT_EXPIRY_OVERRIDES can give other PASSWORD_EXPIRY_DAYS,
+    PASSWORD_EXPIRY_WARNING_DAYS or ACCOUNT_EXPIRY_DAYS to some users,
+    ex. a shorter password expiry for staff::
+
+        USERAUDIT_EXPIRY_OVERRIDES = {
+            "is_staff": {"PASSWORD_EXPIRY_DAYS": 30},
+            "group:contractors": {"ACCOUNT_EXPIRY_DAYS": 14},
+        }
+
+    The keys are either the name of a user attribute, matching the users
+    for which it is true, or "group:" followed by the name of a group.
+    The first matching override is used. Whether the user is in each of
+    the groups is annotated on the user by the backend's lookup, so that
+    checking them doesn't need a query. Otherwise the group names of the
+    user are loaded once per check, and not at all if the groups were
+    prefetched.
+
+    If AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR is a dotted path through
+    one-to-one or foreign key relations (ex. "myprofile.password_change_date")
+    select_related is the path of the relations, so the backend can load
+    them together with the user.
+    """
+    def __init__(self, num_days=0, num_warning_days=0, date_changed=None, account_expiry=0, overrides=(),
+                 select_related=()):
+        self.num_days = num_days or 0
+        self.num_warning_days = num_warning_days or 0
+        self.date_changed = date_changed
+        self.date_changed_parts = tuple(date_changed.split(".")) if isinstance(date_changed, str) else ()
+        self.account_expiry = account_expiry or 0
+        self.overrides = list(overrides)
+        self.group_names = set(selector[len("group:"):] for selector, _ in self.overrides
+                               if selector.startswith("group:"))
+        # The name of the annotation telling whether the user is in each group, by group name
+        self.group_attrs = dict((name, "useraudit_group_%d" % i) for i, name in enumerate(sorted(self.group_names)))
+        self.select_related = tuple(select_related)
+        self.annotations = {}
+
+    @classmethod
+    def from_settings(cls):
+        exp = ExpirySettings.get()
+        overrides = []
+        for selector, values in (getattr(settings, "USERAUDIT_EXPIRY_OVERRIDES", None) or {}).items():
+            overrides.append((selector, cls(
+                num_days=values.get("PASSWORD_EXPIRY_DAYS", exp.num_days),
+                num_warning_days=values.get("PASSWORD_EXPIRY_WARNING_DAYS", exp.num_warning_days),
+                date_changed=exp.date_changed,
+                account_expiry=values.get("ACCOUNT_EXPIRY_DAYS", exp.account_expiry))))
+        UserModel = get_user_model()
+        select_related = _related_path(UserModel, exp.date_changed)
+        policy = cls(exp.num_days, exp.num_warning_days, exp.date_changed, exp.account_expiry, overrides,
+                     select_related=[select_related] if select_related else ())
+        policy.annotations = _group_annotations(UserModel, policy.group_attrs)
+        return policy
+
+    def can_check_in_memory(self, user):
+        """False if checking user may need a query (groups or password change date on a profile not loaded)."""
+        if self.group_names and self._loaded_groups(user) is None:
+            return False
+        obj = user
+        for part in self.date_changed_parts[:-1]:
+            fields_cache = obj._state.fields_cache if hasattr(obj, "_state") else {}
+            if part not in fields_cache:
+                return False
+            obj = fields_cache[part]
+            if obj is None:
+                # There is no related object, nothing else to load
+                return True
+        return True
+
+    def warning_window_filter(self, now=None):
+        """A Q object matching the users whose password change date is inside the warning window of
+        this policy or of one of its overrides, None if no password expiry warning is configured.
+
+        It only selects candidates: which policy applies to a user isn't known in the database, so
+        whether they should be warned is still decided by status()."""
+        if not self.date_changed_parts:
+            return None
+        now = now or timezone.now()
+        lookup = "__".join(self.date_changed_parts)
+        windows = None
+        for policy in [self] + [policy for _, policy in self.overrides]:
+            if policy.num_days > 0 and policy.num_warning_days > 0:
+                earliest = now - timedelta(days=policy.num_days)
+                window = Q(**{lookup + "__gte": earliest,
+                              lookup + "__lt": earliest + timedelta(days=policy.num_warning_days + 1)})
+                windows = window if windows is None else windows | window
+        return windows
+
+    def earliest_possible_login(self, now=None):
+        """The last login before which the account of a user may have expired under this policy
+        or one of its overrides (the shortest account expiry), None if none has account expiry.
+
+        The window of each policy starts there or earlier, so it only selects candidates:
+        whether their account has expired is still decided by is_stale()."""
+        expiries = [policy.account_expiry for policy in [self] + [policy for _, policy in self.overrides]
+                    if policy.account_expiry > 0]
+        if not expiries:
+            return None
+        return (now or timezone.now()) - timedelta(days=min(expiries))
+
+    def for_user(self, user):
+        """The policy applying to user."""
+        user_groups = None
+        for selector, policy in self.overrides:
+            if selector.startswith("group:"):
+                if user_groups is None:
+                    user_groups = self._user_groups(user)
+                if selector[len("group:"):] in user_groups:
+                    return policy
+            elif getattr(user, selector, False):
+                return policy
+        return self
+
+    def _user_groups(self, user):
+        if not hasattr(user, "groups"):
+            return set()
+        groups = self._loaded_groups(user)
+        if groups is not None:
+            return groups
+        return set(user.groups.filter(name__in=self.group_names).values_list("name", flat=True))
+
+    def _loaded_groups(self, user):
+        """The names of the override groups user is in, None if they would have to be loaded."""
+        if all(attr in user.__dict__ for attr in self.group_attrs.values()):
+            return set(name for name, attr in self.group_attrs.items() if user.__dict__[attr])
+        if "groups" in getattr(user, "_prefetched_objects_cache", {}):
+            return set(group.name for group in user.groups.all())
+        return None
+
+    def password_change_date(self, user):
+        if not self.date_changed:
+            return None
+        if not self.date_changed_parts:
+            logger.warning("Password change attr in settings is not a string")
+            return None
+        val = user
+        for part in self.date_changed_parts:
+            if hasattr(val, part):
+                val = getattr(val, part)
+            else:
+                logger.warning("User model does not have a %s attribute" % self.date_changed)
+                return None
+        return val
+
+    def status(self, user, now=None):
+        """Checks user against the policy applying to them, returns an ExpiryStatus."""
+        policy = self.for_user(user)
+        now = now or timezone.now()
+        days_left = None
+        if policy.num_days > 0:
+            change_date = self.password_change_date(user)
+            if change_date:
+                days_left = (change_date - (now - timedelta(days=policy.num_days))).days
+        return ExpiryStatus(
+            expired=days_left is not None and days_left < 0,
+            stale=self._is_stale(policy, user, now),
+            days_left=days_left,
+            warn=policy.num_warning_days > 0 and (days_left or 0) <= policy.num_warning_days)
+
+    def is_stale(self, user, now=None):
+        """True if the account of user has expired, the stale part of status() without the password checks."""
+        return self._is_stale(self.for_user(user), user, now or timezone.now())
+
+    def _is_stale(self, policy, user, now):
+        if policy.account_expiry <= 0:
+            return False
+        last_login = get_user_last_login(user)
+        return bool(last_login and last_login < now - timedelta(days=policy.account_expiry))
+
+
+def _related_path(model, date_changed):
+    """The select_related path of the relations in date_changed, None if there are none or they can't be."""
+    if not isinstance(date_changed, str) or "." not in date_changed:
+        return None
+    parts = date_changed.split(".")[:-1]
+    for part in parts:
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if not (field.is_relation and (field.one_to_one or field.many_to_one)) or field.related_model is None:
+            return None
+        model = field.related_model
+    return "__".join(parts)
+
+
+def _group_annotations(model, group_attrs):
+    """Exists() annotations telling whether the user is in each group, none if the model has no groups."""
+    try:
+        field = model._meta.get_field("groups")
+    except FieldDoesNotExist:
+        return {}
+    if not field.many_to_many:
+        return {}
+    groups = field.related_model._default_manager
+    return dict((attr, Exists(groups.filter(**{field.related_query_name(): OuterRef("pk"), "name": name})))
+                for name, attr in group_attrs.items())
+
+
+_expiry_policy = None
+
+
+def get_expiry_policy():
+    """Returns the ExpiryPolicy compiled from the settings, rebuilt when they change."""
+    global _expiry_policy
+    if _expiry_policy is None:
+        _expiry_policy = ExpiryPolicy.from_settings()
+    return _expiry_policy
+
+
+@receiver(setting_changed)
+def reset_expiry_policy(setting, **kwargs):
+    global _expiry_policy
+    if setting in EXPIRY_SETTINGS:
+        _expiry_policy = None
+
+
 class AccountExpiryBackend(object):
     """
     This backend doesn't authenticate, it just prevents authentication
     of a user whose account password has expired.
     """
     def authenticate(self, request=None, username=None, password=None, **kwargs):
+        with lookup_scope():
+            return self._authenticate(request, username, password, **kwargs)
+
+    def _authenticate(self, request=None, username=None, password=None, **kwargs):
+        if request is None:
+            request = get_request()
+        # Refuse throttled clients before the users are looked up by this and the next backends
+        if self._is_ip_throttled(request):
+            self._prevent_login(request, username, "Too many failed logins from the client's IP address",
+                                count_failure=False)
+
         user = self._lookup_user(username, password, **kwargs)
 
         if user:
-            # Prevent authentication of inactive users (if the user
-            # model supports it). Django only checks is_active at the
-            # login view level.
-            if hasattr(user, "is_active") and not user.is_active:
-                self._prevent_login(username, "Account is not active")
-
-            if is_password_expired(user):
-                logger.info("Password expired! Disabling user account: %s" % user)
-                user.is_active = False
-                user.save()
-                password_has_expired.send(sender=user.__class__, user=user)
-                self._prevent_login(username, "Password has expired")
-
-            if is_account_expired(user):
-                logger.info("Disabling stale user account: %s" % user)
-                user.is_active = False
-                user.save()
-                account_has_expired.send(sender=user.__class__, user=user)
-                self._prevent_login(username, "Account has expired")
-
-            if should_warn_about_password_expiry(user):
-                days_left = days_to_password_expiry(user)
-                logger.info("User's '%s' password will expire in %d days", user, days_left)
-                password_will_expire_warning.send(sender=user.__class__, user=user, days_left=days_left)
+            self._check_user(request, username, user)
 
         # pass on to next handler
         return None
 
-    def _prevent_login(self, username, msg="User login prevented"):
-        def is_failed_login_logger_configured():
-            auth_backends = getattr(settings, 'AUTHENTICATION_BACKENDS', [])
-            return 'useraudit.backend.AuthFailedLoggerBackend' in auth_backends
+    async def aauthenticate(self, request=None, username=None, password=None, **kwargs):
+        with lookup_scope():
+            if request is None:
+                request = get_request()
+            if await self._ais_ip_throttled(request):
+                await self._aprevent_login(request, username, "Too many failed logins from the client's IP address",
+                                           count_failure=False)
+
+            user = await self._alookup_user(username, password, **kwargs)
+
+            if user:
+                if hasattr(user, "is_active") and not user.is_active:
+                    await self._aprevent_login(request, username, "Account is not active")
+                # Users that aren't refused or warned are checked without leaving the event loop
+                status = None
+                policy = get_expiry_policy()
+                if policy.can_check_in_memory(user):
+                    status = policy.status(user)
+                    if not (status.expired or status.stale or status.warn):
+                        return None
+                await sync_to_async(self._check_user)(request, username, user, status)
 
+        # pass on to next handler
+        return None
+
+    def _check_user(self, request, username, user, status=None):
+        # Prevent authentication of inactive users (if the user
+        # model supports it). Django only checks is_active at the
+        # login view level.
+        if hasattr(user, "is_active") and not user.is_active:
+            self._prevent_login(request, username, "Account is not active")
+
+        status = status or get_expiry_policy().status(user)
+        if status.expired:
+            logger.info("Password expired! Disabling user account: %s" % user)
+            user.is_active = False
+            user.save()
+            password_has_expired.send(sender=user.__class__, user=user)
+            self._prevent_login(request, username, "Password has expired")
+
+        if status.stale:
+            logger.info("Disabling stale user account: %s" % user)
+            user.is_active = False
+            user.save()
+            account_has_expired.send(sender=user.__class__, user=user)
+            self._prevent_login(request, username, "Account has expired")
+
+        if status.warn:
+            logger.info("User's '%s' password will expire in %d days", user, status.days_left)
+            password_will_expire_warning.send(sender=user.__class__, user=user, days_left=status.days_left)
+
+    def _is_failed_login_logger_configured(self):
+        auth_backends = getattr(settings, 'AUTHENTICATION_BACKENDS', [])
+        return 'useraudit.backend.AuthFailedLoggerBackend' in auth_backends
+
+    def _prevent_login(self, request, username, msg="User login prevented", count_failure=True):
+        """Refuses the login, counting it as a failed login of username if count_failure is True.
+
+        Logins refused because the client is throttled aren't counted: the failed logins of any
+        user could be driven up (and the user locked out) from a throttled address."""
         logger.info("Login Prevented for user '%s'! %s", username, msg)
-        if is_failed_login_logger_configured():
-            AuthFailedLoggerBackend().authenticate(username=username)
+        if count_failure and self._is_failed_login_logger_configured():
+            AuthFailedLoggerBackend().authenticate(request, username=username)
         raise PermissionDenied(msg)
 
+    async def _aprevent_login(self, request, username, msg="User login prevented", count_failure=True):
+        logger.info("Login Prevented for user '%s'! %s", username, msg)
+        if count_failure and self._is_failed_login_logger_configured():
+            await AuthFailedLoggerBackend().aauthenticate(request, username=username)
+        raise PermissionDenied(msg)
+
+    def _is_ip_throttled(self, request):
+        ip_throttle = get_ip_throttle()
+        if request is None:
+            request = get_request()
+        if ip_throttle is None or request is None:
+            return False
+        ip_address = ip_throttle.client_address(request)
+        return ip_throttle.is_blocked(ip_address)
+
+    async def _ais_ip_throttled(self, request):
+        ip_throttle = get_ip_throttle()
+        if request is None:
+            request = get_request()
+        if ip_throttle is None or request is None:
+            return False
+        ip_address = ip_throttle.client_address(request)
+        return await ip_throttle.ais_blocked(ip_address)
+
     def _lookup_user(self, username=None, password=None, **kwargs):
         # This is the same procedure as in
         # django.contrib.auth.backends.ModelBackend, except without
@@ -285,6 +572,19 @@ class AccountExpiryBackend(object):
         if username is None:
             username = kwargs.get(UserModel.USERNAME_FIELD)
         try:
-            return UserModel._default_manager.get_by_natural_key(username)
+            policy = get_expiry_policy()
+            return get_user_by_natural_key(username, select_related=policy.select_related,
+                                           annotations=policy.annotations)
+        except UserModel.DoesNotExist:
+            return None
+
+    async def _alookup_user(self, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        try:
+            policy = get_expiry_policy()
+            return await aget_user_by_natural_key(username, select_related=policy.select_related,
+                                                  annotations=policy.annotations)
         except UserModel.DoesNotExist:
             return None
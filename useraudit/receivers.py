@@ -0,0 +1,104 @@
+"""
+Connecting the pre_save receivers of the user model the settings need.
+
+The pre_save receivers of the lockout and expiry features may load the
+user being saved from the database (see tracking). They are connected
+when the app is ready:
+
+- useraudit.backend.user_pre_save resets the failed login count of
+  reactivated users. It is always connected, the failures are counted
+  even if LOGIN_FAILURE_LIMIT isn't set, and setting it later mustn't
+  lock out users with counts from before their reactivation,
+- useraudit.password_expiry.user_pre_save records password changes in
+  AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR and clears the last login
+  of reactivated users, it is needed if the date attribute or
+  ACCOUNT_EXPIRY_DAYS is set.
+
+The date attribute is enough to connect the expiry receiver, so the
+password change dates stay current while PASSWORD_EXPIRY_DAYS is unset.
+
+Successful logins are recorded by useraudit.models.login_callback, or
+by its async counterpart alogin_callback if USERAUDIT_ASYNC_LOGIN_CALLBACK
+is set. Django only awaits async receivers from 5.0, older versions
+would drop the coroutine without recording the login.
+
+They are rewired whenever one of these settings or AUTH_USER_MODEL
+changes (ex. override_settings in tests).
+"""
+import django
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+def always():
+    return True
+
+
+def expiry_enabled():
+    return bool(getattr(settings, 'AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR', None) or
+                getattr(settings, 'ACCOUNT_EXPIRY_DAYS', None))
+
+
+# Dotted path of each receiver, also used as its dispatch_uid, and whether the settings need it
+RECEIVERS = (
+    ('useraudit.backend.user_pre_save', always),
+    ('useraudit.password_expiry.user_pre_save', expiry_enabled),
+)
+
+WIRING_SETTINGS = (
+    'AUTH_USER_MODEL',
+    'ACCOUNT_EXPIRY_DAYS',
+    'AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR',
+    'USERAUDIT_ASYNC_LOGIN_CALLBACK',
+)
+
+LOGIN_CALLBACK_UID = 'useraudit.models.login_callback'
+
+# The user model each receiver is connected to, by path
+_connected = {}
+
+
+def connect_receivers():
+    """(Re)connects the receivers needed by the current settings, and disconnects the others."""
+    user_model = settings.AUTH_USER_MODEL
+    for path, is_needed in RECEIVERS:
+        user_pre_save = import_string(path)
+        sender = _connected.pop(path, None)
+        if sender is not None:
+            pre_save.disconnect(user_pre_save, sender=sender, dispatch_uid=path)
+        if is_needed():
+            pre_save.connect(user_pre_save, sender=user_model, dispatch_uid=path)
+            _connected[path] = user_model
+    connect_login_callback()
+
+
+def async_login_callback_enabled():
+    if not getattr(settings, 'USERAUDIT_ASYNC_LOGIN_CALLBACK', False):
+        return False
+    if django.VERSION < (5, 0):
+        raise ImproperlyConfigured(
+            'USERAUDIT_ASYNC_LOGIN_CALLBACK needs Django 5.0+, older versions don\'t await async receivers')
+    return True
+
+
+def connect_login_callback():
+    from .models import alogin_callback, login_callback
+    callback = alogin_callback if async_login_callback_enabled() else login_callback
+    user_logged_in.disconnect(dispatch_uid=LOGIN_CALLBACK_UID)
+    user_logged_in.connect(callback, dispatch_uid=LOGIN_CALLBACK_UID)
+
+
+def connected_receivers():
+    """The paths of the receivers currently connected."""
+    return sorted(_connected)
+
+
+@receiver(setting_changed)
+def wiring_setting_changed(setting, **kwargs):
+    if setting in WIRING_SETTINGS:
+        connect_receivers()
@@ -0,0 +1,28 @@
+"""
+Deleting old audit rows without locking the tables for long.
+"""
+import time
+
+from django.db import transaction
+
+
+def delete_in_chunks(queryset, first_pk, last_pk, chunk_size=1000, sleep=0.0, progress=None):
+    """Deletes the rows of queryset with primary keys from first_pk to last_pk.
+
+    Each range of chunk_size primary keys is deleted by a single statement in
+    its own transaction, waiting sleep seconds between chunks. progress is
+    called after each chunk with the number of rows deleted so far and the
+    last primary key of the chunk. Returns the number of rows deleted."""
+    deleted = 0
+    low = first_pk
+    while low <= last_pk:
+        high = min(low + chunk_size, last_pk + 1)
+        with transaction.atomic(using=queryset.db):
+            count, _ = queryset.filter(pk__gte=low, pk__lt=high).delete()
+        deleted += count
+        low = high
+        if progress is not None:
+            progress(deleted, high - 1)
+        if sleep and low <= last_pk:
+            time.sleep(sleep)
+    return deleted
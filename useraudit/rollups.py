@@ -0,0 +1,153 @@
+"""
+Daily login counts.
+
+Counting the failed logins per user per day, or the IP addresses with
+the most failures this week, from the login logs means aggregating over
+the whole log tables. The rollup tables keep the number of successful
+and failed logins per day (DailyLoginCount), per day and username
+(DailyUserLoginCount) and per day and client IP address
+(DailyIPLoginCount), so these questions are answered from a few rows:
+
+    week = DailyIPLoginCount.objects.between(today - timedelta(days=7), today)
+    week.top('ip_address', limit=10)
+    DailyUserLoginCount.objects.filter(username='john').between(start, end)
+
+The counts are maintained either:
+
+- when the logs are written, with USERAUDIT_ROLLUP_ON_WRITE = True.
+  With buffered logging (see useraudit.log_writer) each batch written is
+  aggregated and counted in the transaction inserting it, so the counts
+  are updated once per batch and dropped records aren't counted.
+  Otherwise each login is counted once the transaction logging it is
+  committed, so the busy DailyLoginCount row isn't kept locked until the
+  end of the request. That costs three more statements per login.
+- or by the update_login_rollups management command, run from a cron job.
+  It counts the log rows added since its last run, by primary key, and
+  commits the counts with its progress, so a row is never counted twice.
+  Primary keys are assigned before the rows are committed, so a row with
+  a lower key than the last one counted could still be committed later
+  (ex. by a long request transaction or a buffered batch). Only the rows
+  up to the last one older than a safety lag (5 minutes by default) are
+  counted, the newer ones are left for the next run.
+
+Use one or the other. The command refuses to run while the counts are
+maintained on write.
+
+Days are in the current time zone when USE_TZ is enabled.
+"""
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import routers
+
+
+ROLLUP_MODELS = ('DailyLoginCount', 'DailyUserLoginCount', 'DailyIPLoginCount')
+
+
+def is_enabled():
+    return getattr(settings, 'USERAUDIT_ROLLUP_ON_WRITE', False)
+
+
+def day_of(timestamp):
+    if timezone.is_aware(timestamp):
+        return timezone.localtime(timestamp).date()
+    return timestamp.date()
+
+
+def add_counts(model, day, successes=0, failures=0, using=None, **key):
+    """Adds successes and failures to the counts of model for day and key (username or ip_address)."""
+    using = using or routers.db_for_write(model)
+    counts = model.objects.using(using).filter(day=day, **key)
+    while True:
+        if counts.update(successes=F('successes') + successes, failures=F('failures') + failures):
+            return
+        try:
+            with transaction.atomic(using=using):
+                model.objects.using(using).create(day=day, successes=successes, failures=failures, **key)
+                return
+        except IntegrityError:
+            # Another process inserted the row first, retry the UPDATE
+            pass
+
+
+def count_logins(logs):
+    """Adds log rows, just written, to the daily counts.
+
+    The rows are aggregated first, so that each count is updated once. The counts
+    are updated in a consistent order, so concurrent writers don't deadlock."""
+    by_day, by_user, by_ip = {}, {}, {}
+    for log in logs:
+        success = log._meta.model_name == 'loginlog'
+        day = day_of(log.timestamp)
+        for counts, key in ((by_day, ()), (by_user, (log.username or '',)), (by_ip, (log.ip or '',))):
+            successes, failures = counts.get((day,) + key, (0, 0))
+            counts[(day,) + key] = (successes + success, failures + (not success))
+    DailyLoginCount, DailyUserLoginCount, DailyIPLoginCount = [
+        apps.get_model('useraudit', name) for name in ROLLUP_MODELS]
+    with transaction.atomic(using=routers.db_for_write(DailyLoginCount)):
+        for (day,), (successes, failures) in sorted(by_day.items()):
+            add_counts(DailyLoginCount, day, successes, failures)
+        for (day, username), (successes, failures) in sorted(by_user.items()):
+            add_counts(DailyUserLoginCount, day, successes, failures, username=username)
+        for (day, ip_address), (successes, failures) in sorted(by_ip.items()):
+            add_counts(DailyIPLoginCount, day, successes, failures, ip_address=ip_address)
+
+
+DEFAULT_LAG = timedelta(minutes=5)
+
+
+def update_rollups(log_model, chunk_size=10000, progress=None, lag=DEFAULT_LAG):
+    """Counts the rows of log_model added since the last update, chunk_size rows per transaction.
+
+    Only counts up to the last row logged more than lag ago, the rows with lower
+    primary keys are all committed by then. Each chunk is aggregated by the database
+    and committed with the new position, so an interrupted update continues where it
+    stopped. Returns the number of rows counted."""
+    using = routers.db_for_write(log_model)
+    DailyLoginCount, DailyUserLoginCount, DailyIPLoginCount = [
+        apps.get_model('useraudit', name) for name in ROLLUP_MODELS]
+    RollupProgress = apps.get_model('useraudit', 'RollupProgress')
+    counted_field = 'successes' if log_model._meta.model_name == 'loginlog' else 'failures'
+
+    state = RollupProgress.objects.using(using).get_or_create(name=log_model.__name__)[0]
+    # Walks the primary key index back from the newest rows, only the rows logged within lag are read
+    last_pk = log_model.objects.using(using).filter(timestamp__lt=timezone.now() - lag).order_by(
+        '-pk').values_list('pk', flat=True).first()
+    counted = 0
+    while last_pk is not None and state.last_pk < last_pk:
+        high = min(state.last_pk + chunk_size, last_pk)
+        rows = log_model.objects.using(using).filter(pk__gt=state.last_pk, pk__lte=high).annotate(
+            rollup_day=TruncDate('timestamp')).order_by()
+        by_day = rows.values('rollup_day').annotate(n=Count('pk'))
+        by_user = rows.values('rollup_day', 'username').annotate(n=Count('pk'))
+        by_ip = rows.values('rollup_day', 'ip_address', 'ip_address_packed').annotate(n=Count('pk'))
+        with transaction.atomic(using=using):
+            for row in by_day:
+                counted += row['n']
+                add_counts(DailyLoginCount, row['rollup_day'], using=using, **{counted_field: row['n']})
+            for row in by_user:
+                add_counts(DailyUserLoginCount, row['rollup_day'], username=row['username'] or '', using=using,
+                           **{counted_field: row['n']})
+            for row in _merge_ip_addresses(by_ip):
+                add_counts(DailyIPLoginCount, row['rollup_day'], ip_address=row['ip_address'], using=using,
+                           **{counted_field: row['n']})
+            state.last_pk = high
+            state.save(using=using, update_fields=['last_pk'])
+        if progress is not None:
+            progress(counted, high)
+    return counted
+
+
+def _merge_ip_addresses(rows):
+    """Merges the counts of the addresses stored as strings and packed, see useraudit.ip_storage."""
+    merged = {}
+    for row in rows:
+        key = (row['rollup_day'], row['ip_address'] or row['ip_address_packed'] or '')
+        merged[key] = merged.get(key, 0) + row['n']
+    return [{'rollup_day': day, 'ip_address': ip_address, 'n': n} for (day, ip_address), n in merged.items()]
@@ -0,0 +1,59 @@
+"""
+Keeping the useraudit tables in a dedicated database.
+
+By default the audit rows are written through the default database, in
+the transaction of the request: they compete with the application's
+tables and are lost if the transaction is rolled back. Set
+USERAUDIT_DATABASE to the alias of another database (see DATABASES) to
+read and write all the useraudit models there.
+
+The useraudit code uses the alias explicitly. Install the router too so
+that migrate creates the useraudit tables in that database only, and the
+admin and other apps' queries on the useraudit models go there as well.
+
+Settings::
+
+    USERAUDIT_DATABASE = 'audit'
+    DATABASE_ROUTERS = ['useraudit.routers.UserAuditRouter']
+
+Then migrate the audit database with ``manage.py migrate --database=audit``.
+"""
+from django.conf import settings
+from django.db import router
+
+
+APP_LABEL = 'useraudit'
+
+
+def get_database():
+    """The alias of USERAUDIT_DATABASE, or None if it isn't set."""
+    return getattr(settings, 'USERAUDIT_DATABASE', None) or None
+
+
+def db_for_write(model):
+    """The database the rows of model are written to."""
+    return get_database() or router.db_for_write(model)
+
+
+class UserAuditRouter(object):
+    """Routes the useraudit models to USERAUDIT_DATABASE, if it is set."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == APP_LABEL:
+            return get_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == APP_LABEL:
+            return get_database()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.app_label == APP_LABEL and obj2._meta.app_label == APP_LABEL:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == APP_LABEL and get_database() is not None:
+            return db == get_database()
+        return None
@@ -1,6 +1,12 @@
 from django.dispatch import Signal
 
-password_will_expire_warning = Signal(providing_args=["user", "days_left"])
-password_has_expired = Signal(providing_args=["user"])
-account_has_expired = Signal(providing_args=["user"])
-login_failure_limit_reached = Signal(providing_args=["user"])
+# Sent with user and days_left
+password_will_expire_warning = Signal()
+# Sent with user
+password_has_expired = Signal()
+# Sent with user
+account_has_expired = Signal()
+# Sent with users, once per chunk of accounts deactivated by the disable_inactive_users command
+accounts_have_expired = Signal()
+# Sent with user
+login_failure_limit_reached = Signal()
@@ -16,7 +16,20 @@ DATABASES = {
         'PASSWORD': '',                          # Not used with sqlite3.
         'HOST': '',                              # Set to empty string for localhost. Not used with sqlite3.
         'PORT': '',                              # Set to empty string for default. Not used with sqlite3.
-    }
+        # A file based test database, so that tests can write to it from several threads.
+        # The default in-memory test database fails with "database table is locked" instead.
+        'TEST': {
+            'NAME': 'test_db.sqlite3',
+        },
+    },
+    # Used by the tests of USERAUDIT_DATABASE
+    'audit': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'audit.sqlite3',
+        'TEST': {
+            'NAME': 'test_audit.sqlite3',
+        },
+    },
 }
 
 # Local time zone for this installation. Choices can be found here:
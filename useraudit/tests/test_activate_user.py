@@ -0,0 +1,80 @@
+from datetime import timedelta
+from io import StringIO
+import os
+import sys
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core import management
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .. import models as m
+
+
+class ActivateUserTest(TestCase):
+
+    def setUp(self):
+        for name in ('john', 'jane', 'jim'):
+            User.objects.create_user(username=name, password='sue', is_active=False)
+            m.LoginAttemptLogger().increment(name)
+            m.UserDeactivation.objects.create(username=name, reason=m.UserDeactivation.TOO_MANY_FAILED_LOGINS)
+        User.objects.create_user(username='active', password='sue')
+
+    def activate(self, *args, **kwargs):
+        out = StringIO()
+        management.call_command('activate_user', *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def assertActivated(self, *usernames):
+        self.assertEquals(sorted(User.objects.filter(is_active=True).values_list('username', flat=True)),
+                          sorted(usernames + ('active',)))
+        for name in usernames:
+            self.assertEquals(m.LoginAttemptLogger().get_count(name), 0)
+        self.assertFalse(m.UserDeactivation.objects.filter(username__in=usernames).exists())
+
+    def test_activate_users(self):
+        out = self.activate('john', 'jane', 'active')
+        self.assertActivated('john', 'jane')
+        self.assertEquals(m.LoginAttemptLogger().get_count('jim'), 1)
+        self.assertIn('2 user(s) activated, 1 already active', out)
+        self.assertIn('Ignoring already active user "active"', out)
+
+    def test_queries_per_chunk(self):
+        # Loading the chunk, the UPDATE of the users and of the counts and the DELETE,
+        # in a transaction (a savepoint in the test)
+        with self.assertNumQueries(2 * (4 + 2)):
+            self.activate('john', 'jane', 'jim', chunk_size=2)
+        self.assertActivated('john', 'jane', 'jim')
+
+    def test_usernames_from_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('john\n\njane\njohn\n')
+        self.addCleanup(os.remove, f.name)
+        self.activate(file=f.name, chunk_size=1)
+        self.assertActivated('john', 'jane')
+
+    def test_usernames_from_stdin(self):
+        stdin = sys.stdin
+        sys.stdin = StringIO('jim\njane\n')
+        try:
+            self.activate(file='-')
+        finally:
+            sys.stdin = stdin
+        self.assertActivated('jim', 'jane')
+
+    def test_missing_users_are_reported_together(self):
+        with self.assertRaisesRegex(CommandError, '2 user\\(s\\) do NOT exist: "nobody", "noone"'):
+            self.activate('nobody', 'john', 'noone', chunk_size=1)
+        self.assertActivated('john')
+
+    @override_settings(ACCOUNT_EXPIRY_DAYS=10)
+    def test_last_login_is_cleared_with_account_expiry(self):
+        User.objects.filter(username='john').update(last_login=timezone.now() - timedelta(days=100))
+        self.activate('john')
+        self.assertIsNone(User.objects.get(username='john').last_login)
+
+    def test_usernames_required(self):
+        with self.assertRaises(CommandError):
+            self.activate()
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+
+from django.core import management
+from django.test import TestCase, override_settings
+
+from .. import models as m
+from ..archive import Archive, Segment, list_segments, write_segment
+
+NOW = datetime(2020, 6, 1, 12, 0)
+
+
+class SegmentTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rows = [(pk, NOW - timedelta(hours=pk), 'user%d' % (pk % 3), '10.0.0.%d' % (pk % 2), None,
+                 'Agent é' if pk % 2 else None)
+                for pk in range(1, 11)]
+        self.path = write_segment(self.directory, 'FailedLoginLog', rows)
+        self.segment = Segment(self.path)
+
+    def tearDown(self):
+        self.segment.close()
+        shutil.rmtree(self.directory)
+
+    def test_segment_is_named_after_pk_range(self):
+        self.assertEquals(os.path.basename(self.path), 'failedloginlog-000000000001-000000000010.seg')
+        self.assertEquals(list_segments(self.directory, 'FailedLoginLog'), [(1, 10, self.path)])
+        self.assertEquals(list_segments(self.directory, 'LoginLog'), [])
+
+    def test_rows_round_trip_oldest_first(self):
+        logs = list(self.segment.query())
+        self.assertEquals(len(logs), 10)
+        self.assertEquals([log.pk for log in logs], list(range(10, 0, -1)))
+        log = logs[-1]
+        self.assertEquals(log.timestamp, NOW - timedelta(hours=1))
+        self.assertEquals((log.username, log.ip_address, log.forwarded_by, log.user_agent),
+                          ('user1', '10.0.0.1', None, 'Agent é'))
+
+    def test_strings_are_stored_once(self):
+        self.assertEquals(self.segment.string_count, 6)
+
+    def test_query_by_username_and_ip(self):
+        self.assertEquals([log.pk for log in self.segment.query(username='user1')], [10, 7, 4, 1])
+        self.assertEquals([log.pk for log in self.segment.query(username='user1', ip_address='10.0.0.0')], [10, 4])
+        self.assertEquals(list(self.segment.query(username='nobody')), [])
+
+    def test_query_by_time_range(self):
+        logs = self.segment.query(start=NOW - timedelta(hours=4), end=NOW - timedelta(hours=2))
+        self.assertEquals([log.pk for log in logs], [4, 3])
+        self.assertEquals(list(self.segment.query(start=NOW)), [])
+
+    def test_pks(self):
+        self.assertEquals(sorted(self.segment.pks()), list(range(1, 11)))
+
+
+@override_settings(USERAUDIT_RETENTION_DAYS={'FailedLoginLog': 30})
+class ArchiveAuditLogsTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for days in (100, 90, 80, 10):
+            m.FailedLoginLog.objects.create(username='user%d' % days, ip_address='10.0.0.1',
+                                            timestamp=datetime.now() - timedelta(days=days))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def archive(self, **options):
+        management.call_command('archive_audit_logs', directory=self.directory, verbosity=0, **options)
+
+    def archived(self, **query):
+        with Archive(self.directory, 'FailedLoginLog') as archive:
+            return sorted(log.username for log in archive.query(**query))
+
+    def test_old_rows_are_moved_to_segments(self):
+        self.archive(segment_size=2)
+        self.assertEquals(len(list_segments(self.directory, 'FailedLoginLog')), 2)
+        self.assertEquals(self.archived(), ['user100', 'user80', 'user90'])
+        self.assertEquals(list(m.FailedLoginLog.objects.values_list('username', flat=True)), ['user10'])
+
+    def test_models_without_retention_are_skipped(self):
+        m.LoginLog.objects.create(username='old', timestamp=datetime.now() - timedelta(days=100))
+        self.archive()
+        self.assertEquals(m.LoginLog.objects.count(), 1)
+
+    def test_days_option(self):
+        self.archive(days=85)
+        self.assertEquals(self.archived(), ['user100', 'user90'])
+
+    def test_archive_query_by_time(self):
+        self.archive()
+        self.assertEquals(self.archived(start=datetime.now() - timedelta(days=95)), ['user80', 'user90'])
+
+    def test_rows_left_by_interrupted_run_are_deleted(self):
+        rows = m.FailedLoginLog.objects.filter(username__in=['user100', 'user90']).order_by('pk')
+        write_segment(self.directory, 'FailedLoginLog',
+                      rows.values_list('pk', 'timestamp', 'username', 'ip_address', 'forwarded_by', 'user_agent'))
+        self.archive()
+        self.assertEquals(self.archived(), ['user100', 'user80', 'user90'])
+        self.assertEquals(m.FailedLoginLog.objects.count(), 1)
+
+    def test_normalized_user_agents_are_archived(self):
+        user_agent = m.UserAgent.objects.create(digest='x', name='Some user agent')
+        m.FailedLoginLog.objects.filter(username='user100').update(user_agent_ref=user_agent)
+        self.archive()
+        with Archive(self.directory, 'FailedLoginLog') as archive:
+            self.assertEquals([log.user_agent for log in archive.query(username='user100')], ['Some user agent'])
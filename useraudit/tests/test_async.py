@@ -0,0 +1,158 @@
+import asyncio
+import threading
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.client import RequestFactory
+
+from .. import log_writer
+from .. import models as m
+from ..backend import AuthFailedLoggerBackend
+from ..password_expiry import AccountExpiryBackend
+from .test_log_writer import ForegroundLogWriter
+
+
+def request(ip='192.168.1.2'):
+    return RequestFactory().post('/login', REMOTE_ADDR=ip, HTTP_USER_AGENT='Async client')
+
+
+class AsyncLoggerTest(TestCase):
+
+    async def test_alog_failed_login(self):
+        await m.LoginLogger().alog_failed_login('some_user', request())
+        log = await sync_to_async(m.FailedLoginLog.objects.get)()
+        self.assertEquals(log.username, 'some_user')
+        self.assertEquals(log.ip_address, '192.168.1.2')
+        self.assertEquals(log.user_agent, 'Async client')
+
+    async def test_alog_login(self):
+        await m.LoginLogger().alog_login('some_user', request())
+        self.assertEquals(await sync_to_async(m.LoginLog.objects.count)(), 1)
+
+    async def test_attempt_counter(self):
+        logger = m.LoginAttemptLogger()
+        await logger.aincrement('some_user')
+        self.assertEquals(await logger.aincrement('some_user'), 2)
+        self.assertEquals(await logger.aget_count('some_user'), 2)
+        await logger.areset('some_user')
+        self.assertEquals(await logger.aget_count('some_user'), 0)
+
+    async def test_alogin_callback(self):
+        user = await sync_to_async(User.objects.create_user)(username='john', password='sue')
+        await m.LoginAttemptLogger().aincrement('john')
+        await sync_to_async(m.UserDeactivation.objects.create)(username='john')
+        await m.alogin_callback(User, user, request())
+        self.assertEquals(await sync_to_async(m.LoginLog.objects.filter(username='john').count)(), 1)
+        self.assertEquals(await m.LoginAttemptLogger().aget_count('john'), 0)
+        self.assertFalse(await sync_to_async(m.UserDeactivation.objects.exists)())
+
+
+@override_settings(LOGIN_FAILURE_LIMIT=2)
+class AsyncBackendTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='john', password='sue')
+
+    async def test_failed_login_is_logged_and_counted(self):
+        self.assertIsNone(await AuthFailedLoggerBackend().aauthenticate(request(), username='john', password='x'))
+        self.assertEquals(await sync_to_async(m.FailedLoginLog.objects.count)(), 1)
+        self.assertEquals(await m.LoginAttemptLogger().aget_count('john'), 1)
+
+    async def test_unknown_user_is_not_counted(self):
+        await AuthFailedLoggerBackend().aauthenticate(request(), username='nobody', password='x')
+        self.assertEquals(await sync_to_async(m.FailedLoginLog.objects.count)(), 1)
+        self.assertIsNone(await m.LoginAttemptLogger().aget_count('nobody'))
+
+    async def test_user_is_blocked_at_limit(self):
+        await AuthFailedLoggerBackend().aauthenticate(request(), username='john', password='x')
+        with self.assertRaises(PermissionDenied):
+            await AuthFailedLoggerBackend().aauthenticate(request(), username='john', password='x')
+        user = await sync_to_async(User.objects.get)(username='john')
+        self.assertFalse(user.is_active)
+
+    async def test_expiry_backend_refuses_inactive_user(self):
+        await sync_to_async(User.objects.filter(username='john').update)(is_active=False)
+        with self.assertRaises(PermissionDenied):
+            await AccountExpiryBackend().aauthenticate(request(), username='john', password='sue')
+
+    async def test_expiry_backend_passes_active_user_on(self):
+        self.assertIsNone(await AccountExpiryBackend().aauthenticate(request(), username='john', password='sue'))
+
+    @override_settings(ACCOUNT_EXPIRY_DAYS=60,
+                       USERAUDIT_EXPIRY_OVERRIDES={'group:contractors': {'ACCOUNT_EXPIRY_DAYS': 7}})
+    async def test_expiry_backend_checks_group_overrides_in_memory(self):
+        user = await sync_to_async(User.objects.get)(username='john')
+        group = await sync_to_async(Group.objects.create)(name='contractors')
+        await sync_to_async(user.groups.add)(group)
+        # The groups are loaded with the user, checking them doesn't leave the event loop
+        with mock.patch.object(AccountExpiryBackend, '_check_user') as check_user:
+            self.assertIsNone(await AccountExpiryBackend().aauthenticate(request(), username='john', password='sue'))
+        self.assertFalse(check_user.called)
+
+    @override_settings(LOGIN_FAILURE_IP_LIMIT=1, AUTHENTICATION_BACKENDS=(
+        'useraudit.password_expiry.AccountExpiryBackend',
+        'useraudit.backend.AuthFailedLoggerBackend'))
+    async def test_expiry_backend_doesnt_count_throttled_logins(self):
+        await sync_to_async(cache.clear)()
+        await AuthFailedLoggerBackend().aauthenticate(request(), username='nobody', password='x')
+        with self.assertRaises(PermissionDenied):
+            await AccountExpiryBackend().aauthenticate(request(), username='john', password='sue')
+        self.assertIsNone(await m.LoginAttemptLogger().aget_count('john'))
+        self.assertEquals(await sync_to_async(m.FailedLoginLog.objects.count)(), 1)
+
+
+class AsyncBufferedLoggerTest(TransactionTestCase):
+
+    def full_writer(self, overflow):
+        writer = ForegroundLogWriter(buffer_size=1, batch_size=1, flush_interval=0.01, overflow=overflow)
+        writer.write(m.FailedLoginLog(username='other_user'))
+        return writer
+
+    async def alog_failed_login(self, writer):
+        with mock.patch.object(log_writer, 'get_writer', return_value=writer):
+            await m.LoginLogger().alog_failed_login('some_user', request())
+
+    async def test_record_is_queued(self):
+        writer = ForegroundLogWriter(buffer_size=2, batch_size=2)
+        await self.alog_failed_login(writer)
+        self.assertEquals(await sync_to_async(writer.flush)(), 1)
+        log = await sync_to_async(m.FailedLoginLog.objects.get)()
+        self.assertEquals(log.username, 'some_user')
+
+    async def test_drop_overflow_policy(self):
+        writer = self.full_writer(log_writer.DROP)
+        await self.alog_failed_login(writer)
+        self.assertEquals(writer.dropped, 1)
+        self.assertEquals(await sync_to_async(m.FailedLoginLog.objects.count)(), 0)
+
+    async def test_sync_overflow_policy(self):
+        writer = self.full_writer(log_writer.SYNC)
+        await self.alog_failed_login(writer)
+        log = await sync_to_async(m.FailedLoginLog.objects.get)()
+        self.assertEquals(log.username, 'some_user')
+
+    async def test_record_is_written_once_closed(self):
+        writer = ForegroundLogWriter()
+        writer.close()
+        await self.alog_failed_login(writer)
+        log = await sync_to_async(m.FailedLoginLog.objects.get)()
+        self.assertEquals(log.username, 'some_user')
+
+    async def test_block_overflow_policy_doesnt_block_the_event_loop(self):
+        writer = self.full_writer(log_writer.BLOCK)
+        # Releases the write in case it blocks the event loop, so that the test fails instead of hanging
+        timer = threading.Timer(5, writer.close)
+        timer.start()
+        try:
+            task = asyncio.ensure_future(self.alog_failed_login(writer))
+            await asyncio.sleep(0.1)
+            self.assertFalse(task.done(), 'Should wait for space in the buffer')
+            await asyncio.get_event_loop().run_in_executor(None, writer.close)
+            await task
+        finally:
+            timer.cancel()
+        self.assertEquals(await sync_to_async(m.FailedLoginLog.objects.count)(), 2)
@@ -0,0 +1,98 @@
+from django.contrib.auth.models import User
+from django.core import management
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase, override_settings
+
+from ..attempt_cache import get_attempt_cache
+from ..backend import AuthFailedLoggerBackend
+from .. import models as m
+
+
+@override_settings(USERAUDIT_LOGIN_ATTEMPT_CACHE='default', USERAUDIT_LOGIN_ATTEMPT_FLUSH_INTERVAL=3600)
+class CachedLoginAttemptLoggerTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.logger = m.LoginAttemptLogger()
+
+    def db_count(self, username='some_user'):
+        return m.LoginAttempt.objects.get(username=username).count
+
+    def test_first_increment_loads_counter_into_database(self):
+        self.assertEquals(self.logger.increment('some_user'), 1)
+        self.assertEquals(self.db_count(), 1)
+
+    def test_increments_are_counted_in_cache(self):
+        self.logger.increment('some_user')
+        with self.assertNumQueries(0):
+            self.assertEquals(self.logger.increment('some_user'), 2)
+            self.assertEquals(self.logger.increment('some_user'), 3)
+            self.assertEquals(self.logger.get_count('some_user'), 3)
+        self.assertEquals(self.db_count(), 1)
+
+    def test_flush_writes_counts_to_database(self):
+        for _ in range(3):
+            self.logger.increment('some_user')
+        self.assertEquals(self.logger.flush_cached_counts(), 1)
+        self.assertEquals(self.db_count(), 3)
+        self.assertEquals(self.logger.flush_cached_counts(), 0)
+
+    def test_flush_is_batched(self):
+        usernames = ['user%d' % i for i in range(5)]
+        for username in usernames:
+            self.logger.increment(username)
+            self.logger.increment(username)
+        # A SELECT and an UPDATE per batch of 2 users
+        with self.assertNumQueries(3 * 2):
+            self.assertEquals(self.logger.flush_cached_counts(batch_size=2), 5)
+        self.assertEquals([self.db_count(username) for username in usernames], [2] * 5)
+
+    def test_flush_recreates_deleted_rows(self):
+        self.logger.increment('some_user')
+        self.logger.increment('some_user')
+        m.LoginAttempt.objects.all().delete()
+        self.assertEquals(self.logger.flush_cached_counts(), 1)
+        self.assertEquals(self.db_count(), 2)
+
+    def test_counter_is_loaded_from_database(self):
+        m.LoginAttempt.objects.create(username='some_user', count=5)
+        self.assertEquals(self.logger.increment('some_user'), 6)
+        self.assertEquals(self.db_count(), 6)
+
+    def test_reset(self):
+        self.logger.increment('some_user')
+        self.logger.increment('some_user')
+        self.logger.reset('some_user')
+        self.assertEquals(self.logger.get_count('some_user'), 0)
+        self.assertEquals(self.db_count(), 0)
+        self.assertEquals(self.logger.increment('some_user'), 1)
+
+    @override_settings(USERAUDIT_LOGIN_ATTEMPT_FLUSH_INTERVAL=0)
+    def test_counts_are_written_back_when_flush_is_due(self):
+        self.logger.increment('some_user')
+        self.logger.increment('some_user')
+        self.assertEquals(self.db_count(), 2)
+
+    def test_command_writes_counts_to_database(self):
+        for username in ('some_user', 'other_user'):
+            for _ in range(3):
+                self.logger.increment(username)
+        # The command doesn't depend on the counts changed by this process
+        get_attempt_cache().pop_dirty()
+
+        management.call_command('flush_login_attempts', verbosity=0, chunk_size=1)
+
+        self.assertEquals(self.db_count('some_user'), 3)
+        self.assertEquals(self.db_count('other_user'), 3)
+
+    @override_settings(LOGIN_FAILURE_LIMIT=3)
+    def test_user_is_blocked_based_on_cached_count(self):
+        User.objects.create_user(username='some_user', password='some_pass')
+        backend = AuthFailedLoggerBackend()
+        backend.authenticate(username='some_user')
+        backend.authenticate(username='some_user')
+        self.assertEquals(self.db_count(), 1)
+        with self.assertRaises(PermissionDenied):
+            backend.authenticate(username='some_user')
+        self.assertFalse(User.objects.get(username='some_user').is_active)
@@ -0,0 +1,135 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail, management
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .. import models as m
+from .. import notifications
+from ..backend import AuthFailedLoggerBackend
+from ..routers import UserAuditRouter
+from .utils import simulate_login
+
+
+@override_settings(USERAUDIT_DATABASE='audit')
+class AuditDatabaseTest(TestCase):
+    databases = {'default', 'audit'}
+
+    def setUp(self):
+        User.objects.create_user(username='john', password='sue')
+
+    def assertInAuditDatabase(self, model, count=1):
+        self.assertEquals(model.objects.using('audit').count(), count)
+        self.assertEquals(model.objects.using('default').count(), 0)
+
+    def test_login_is_logged_to_audit_database(self):
+        AuthFailedLoggerBackend().authenticate(username='john', password='wrong')
+        simulate_login(username='john', password='sue', headers={})
+        self.assertInAuditDatabase(m.LoginLog)
+        self.assertEquals(m.LoginAttempt.objects.using('audit').get().count, 0)
+
+    def test_failed_login_is_logged_to_audit_database(self):
+        AuthFailedLoggerBackend().authenticate(username='john', password='wrong')
+        self.assertInAuditDatabase(m.FailedLoginLog)
+        self.assertEquals(m.LoginAttemptLogger().get_count('john'), 1)
+        self.assertInAuditDatabase(m.LoginAttempt)
+
+    @override_settings(LOGIN_FAILURE_LIMIT=1)
+    def test_deactivation_is_recorded_in_audit_database(self):
+        with self.assertRaises(PermissionDenied):
+            AuthFailedLoggerBackend().authenticate(username='john', password='wrong')
+        self.assertFalse(User.objects.get(username='john').is_active)
+        self.assertInAuditDatabase(m.UserDeactivation)
+
+    @override_settings(USERAUDIT_NORMALIZE_USER_AGENTS=True)
+    def test_user_agents_are_stored_in_audit_database(self):
+        simulate_login(username='john', password='sue', headers={'HTTP_USER_AGENT': 'Test client'})
+        self.assertInAuditDatabase(m.UserAgent)
+        self.assertEquals(m.LoginLog.objects.get().agent, 'Test client')
+
+    def test_log_survives_rollback_of_default_database(self):
+        try:
+            with transaction.atomic():
+                User.objects.create_user(username='jane', password='sue')
+                m.LoginLogger().log_failed_login('jane', None)
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertFalse(User.objects.filter(username='jane').exists())
+        self.assertInAuditDatabase(m.FailedLoginLog)
+
+    def test_explicit_database_is_kept(self):
+        m.LoginLog.objects.using('default').create(username='john')
+        self.assertEquals(m.LoginLog.objects.db_manager('default').count(), 1)
+        self.assertEquals(m.LoginLog.objects.count(), 0)
+
+
+class UserAuditRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = UserAuditRouter()
+
+    @override_settings(USERAUDIT_DATABASE='audit')
+    def test_useraudit_models_are_routed(self):
+        for model in (m.LoginLog, m.FailedLoginLog, m.LoginAttempt, m.UserDeactivation, m.UserAgent):
+            self.assertEquals(self.router.db_for_read(model), 'audit')
+            self.assertEquals(self.router.db_for_write(model), 'audit')
+        self.assertIsNone(self.router.db_for_write(User))
+
+    @override_settings(USERAUDIT_DATABASE='audit')
+    def test_useraudit_tables_are_only_migrated_in_audit_database(self):
+        self.assertTrue(self.router.allow_migrate('audit', 'useraudit'))
+        self.assertFalse(self.router.allow_migrate('default', 'useraudit'))
+        self.assertIsNone(self.router.allow_migrate('default', 'auth'))
+
+    def test_nothing_is_routed_by_default(self):
+        self.assertIsNone(self.router.db_for_read(m.LoginLog))
+        self.assertIsNone(self.router.allow_migrate('default', 'useraudit'))
+
+
+# The users and the audit rows are committed by separate transactions, not nested in the test's
+@override_settings(USERAUDIT_DATABASE='audit', ACCOUNT_EXPIRY_DAYS=5)
+class ExpiredAccountsAuditDatabaseTest(TransactionTestCase):
+    databases = {'default', 'audit'}
+
+    def setUp(self):
+        User.objects.create_user(username='john', password='sue', email='john@localhost',
+                                 last_login=timezone.now() - timedelta(days=6))
+
+    def expire(self):
+        management.call_command('disable_inactive_users', verbosity=0)
+
+    def test_notifications_are_recorded_in_audit_database(self):
+        self.expire()
+        self.assertFalse(User.objects.get(username='john').is_active)
+        self.assertEquals(len(mail.outbox), 1)
+        self.assertIsNotNone(m.UserNotification.objects.using('audit').get(username='john').sent)
+
+    def test_deactivations_are_recorded_in_audit_database(self):
+        self.expire()
+        self.assertEquals(m.UserDeactivation.objects.using('audit').get().reason, m.UserDeactivation.ACCOUNT_EXPIRED)
+        self.assertFalse(m.UserDeactivation.objects.using('default').exists())
+
+    def test_audit_rows_are_rolled_back_with_the_chunk(self):
+        def record_pending(kind, usernames):
+            notifications.record_pending(kind, usernames)
+            raise RuntimeError('crash')
+
+        with mock.patch('useraudit.management.commands.disable_inactive_users.record_pending', record_pending):
+            with self.assertRaises(RuntimeError):
+                self.expire()
+        self.assertTrue(User.objects.get(username='john').is_active)
+        self.assertFalse(m.UserNotification.objects.using('audit').exists())
+        self.assertFalse(m.UserDeactivation.objects.using('audit').exists())
+
+    def test_pending_notifications_of_users_still_active_are_discarded(self):
+        # Committed before the deactivation, which then failed
+        m.UserNotification.objects.using('audit').create(username='john', kind=m.UserNotification.ACCOUNT_EXPIRED)
+        User.objects.filter(username='john').update(last_login=timezone.now())
+        self.expire()
+        self.assertEquals(len(mail.outbox), 0)
+        self.assertFalse(m.UserNotification.objects.using('audit').exists())
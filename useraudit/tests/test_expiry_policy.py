@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import Group, User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..lookup import get_user_by_natural_key
+from ..password_expiry import ExpiryStatus, get_expiry_policy
+
+
+# auth.User has no password change date, date_joined stands in for it
+@override_settings(
+    AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR='date_joined',
+    PASSWORD_EXPIRY_DAYS=30,
+    PASSWORD_EXPIRY_WARNING_DAYS=5,
+    ACCOUNT_EXPIRY_DAYS=60,
+    USERAUDIT_EXPIRY_OVERRIDES={
+        'is_staff': {'PASSWORD_EXPIRY_DAYS': 10},
+        'group:contractors': {'ACCOUNT_EXPIRY_DAYS': 7, 'PASSWORD_EXPIRY_WARNING_DAYS': 0},
+    })
+class ExpiryPolicyTest(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.user = User.objects.create_user(username='john', password='sue')
+        self.set_dates(password_days_ago=20, login_days_ago=8)
+
+    def set_dates(self, password_days_ago, login_days_ago):
+        User.objects.filter(pk=self.user.pk).update(
+            date_joined=self.now - timedelta(days=password_days_ago, hours=1),
+            last_login=self.now - timedelta(days=login_days_ago))
+        self.user = User.objects.get(pk=self.user.pk)
+
+    def status(self, user=None):
+        return get_expiry_policy().status(user or self.user, now=self.now)
+
+    def test_policy_is_compiled_once(self):
+        self.assertIs(get_expiry_policy(), get_expiry_policy())
+
+    def test_policy_is_rebuilt_on_setting_changed(self):
+        policy = get_expiry_policy()
+        with self.settings(PASSWORD_EXPIRY_DAYS=90):
+            self.assertEquals(get_expiry_policy().num_days, 90)
+        self.assertIsNot(get_expiry_policy(), policy)
+        self.assertEquals(get_expiry_policy().num_days, 30)
+
+    def test_status(self):
+        self.assertEquals(self.status(), ExpiryStatus(expired=False, stale=False, days_left=9, warn=False))
+        self.set_dates(password_days_ago=27, login_days_ago=61)
+        self.assertEquals(self.status(), ExpiryStatus(expired=False, stale=True, days_left=2, warn=True))
+        self.set_dates(password_days_ago=31, login_days_ago=1)
+        self.assertEquals(self.status(), ExpiryStatus(expired=True, stale=False, days_left=-2, warn=True))
+
+    @override_settings(PASSWORD_EXPIRY_DAYS=None, ACCOUNT_EXPIRY_DAYS=None, PASSWORD_EXPIRY_WARNING_DAYS=None)
+    def test_nothing_expires_without_settings(self):
+        self.set_dates(password_days_ago=1000, login_days_ago=1000)
+        self.assertEquals(self.status(), ExpiryStatus(expired=False, stale=False, days_left=None, warn=False))
+
+    def test_attribute_override(self):
+        self.user.is_staff = True
+        self.assertTrue(self.status().expired)
+
+    def test_group_override(self):
+        self.user.groups.add(Group.objects.create(name='contractors'))
+        with self.assertNumQueries(1):
+            status = self.status()
+        self.assertTrue(status.stale)
+        self.set_dates(password_days_ago=27, login_days_ago=1)
+        self.assertFalse(self.status().warn)
+
+    def test_prefetched_groups_dont_need_a_query(self):
+        self.user.groups.add(Group.objects.create(name='contractors'))
+        user = User.objects.prefetch_related('groups').get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.status(user).stale)
+
+    def test_groups_are_annotated_by_the_lookup(self):
+        self.user.groups.add(Group.objects.create(name='contractors'))
+        policy = get_expiry_policy()
+        with self.assertNumQueries(1):
+            user = get_user_by_natural_key('john', annotations=policy.annotations)
+            self.assertTrue(policy.can_check_in_memory(user))
+            self.assertTrue(self.status(user).stale)
+        User.objects.create_user(username='jane', password='sue')
+        with self.assertNumQueries(1):
+            self.assertFalse(self.status(get_user_by_natural_key('jane', annotations=policy.annotations)).stale)
+
+    def test_group_overrides_cant_be_checked_in_memory_unless_loaded(self):
+        self.assertFalse(get_expiry_policy().can_check_in_memory(self.user))
+        user = User.objects.prefetch_related('groups').get(pk=self.user.pk)
+        self.assertTrue(get_expiry_policy().can_check_in_memory(user))
+        with self.settings(USERAUDIT_EXPIRY_OVERRIDES={'is_staff': {'PASSWORD_EXPIRY_DAYS': 10}}):
+            self.assertTrue(get_expiry_policy().can_check_in_memory(self.user))
+
+    def test_warning_window_filter(self):
+        User.objects.create_user(username='jane', password='sue')
+        User.objects.filter(username='jane').update(date_joined=self.now - timedelta(days=27, hours=1))
+        self.set_dates(password_days_ago=7, login_days_ago=1)
+        window = get_expiry_policy().warning_window_filter(self.now)
+        # jane is in the window of the base policy, john in the one of the staff override
+        self.assertEquals(sorted(User.objects.filter(window).values_list('username', flat=True)), ['jane', 'john'])
+        with self.settings(USERAUDIT_EXPIRY_OVERRIDES=None):
+            window = get_expiry_policy().warning_window_filter(self.now)
+            self.assertEquals(list(User.objects.filter(window).values_list('username', flat=True)), ['jane'])
+
+    def test_earliest_possible_login(self):
+        # The contractors' expiry is the shortest
+        self.assertEquals(get_expiry_policy().earliest_possible_login(self.now), self.now - timedelta(days=7))
+        with self.settings(ACCOUNT_EXPIRY_DAYS=None, USERAUDIT_EXPIRY_OVERRIDES=None):
+            self.assertIsNone(get_expiry_policy().earliest_possible_login(self.now))
+
+    def test_is_stale(self):
+        self.assertFalse(get_expiry_policy().is_stale(self.user, now=self.now))
+        self.user.groups.add(Group.objects.create(name='contractors'))
+        self.assertTrue(get_expiry_policy().is_stale(self.user, now=self.now))
+
+    @override_settings(PASSWORD_EXPIRY_WARNING_DAYS=None, USERAUDIT_EXPIRY_OVERRIDES=None)
+    def test_no_warning_window_without_warning_days(self):
+        self.assertIsNone(get_expiry_policy().warning_window_filter(self.now))
@@ -0,0 +1,100 @@
+import ipaddress
+import shutil
+import tempfile
+
+from django.core import management
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from .. import ip_storage
+from .. import models as m
+from ..archive import Archive
+
+
+def request(ip='10.2.3.4', forwarded_for=None):
+    headers = {'REMOTE_ADDR': '192.168.1.1'}
+    if forwarded_for is not None:
+        headers['HTTP_X_FORWARDED_FOR'] = forwarded_for
+    else:
+        headers['REMOTE_ADDR'] = ip
+    return RequestFactory().post('/login', **headers)
+
+
+class PackingTest(TestCase):
+
+    def test_ipv4_is_mapped_to_ipv6(self):
+        packed = ip_storage.pack('10.2.3.4')
+        self.assertEquals(len(packed), 16)
+        self.assertEquals(ip_storage.unpack(packed), ipaddress.ip_address('10.2.3.4'))
+
+    def test_ipv6(self):
+        self.assertEquals(ip_storage.unpack(ip_storage.pack('2001:db8::1')), ipaddress.ip_address('2001:db8::1'))
+
+    def test_packed_addresses_sort_in_address_order(self):
+        addresses = ['10.0.0.255', '10.0.1.0', '9.255.255.255', '2001:db8::1', '::1']
+        self.assertEquals(sorted(addresses, key=ip_storage.pack),
+                          ['::1', '9.255.255.255', '10.0.0.255', '10.0.1.0', '2001:db8::1'])
+
+    def test_list(self):
+        packed = ip_storage.pack_list(['10.0.0.1', '2001:db8::1'])
+        self.assertEquals([str(address) for address in ip_storage.unpack_list(packed)], ['10.0.0.1', '2001:db8::1'])
+
+    def test_list_with_invalid_address_isnt_packed(self):
+        self.assertIsNone(ip_storage.pack_list(['10.0.0.1', 'unknown']))
+
+
+@override_settings(USERAUDIT_PACK_IP_ADDRESSES=True)
+class PackedIPAddressesTest(TestCase):
+
+    def setUp(self):
+        self.logger = m.LoginLogger()
+
+    def test_addresses_are_packed(self):
+        self.logger.log_failed_login('john', request(forwarded_for='10.2.3.4, 10.0.0.1'))
+        log = m.FailedLoginLog.objects.get()
+        self.assertIsNone(log.ip_address)
+        self.assertIsNone(log.forwarded_by)
+        self.assertEquals(log.ip_address_packed, '10.2.3.4')
+        self.assertEquals(log.ip, '10.2.3.4')
+        self.assertEquals(log.forwarded, '192.168.1.1,10.0.0.1')
+
+    def test_invalid_addresses_are_kept_as_strings(self):
+        self.logger.log_failed_login('john', request(forwarded_for='unknown, 10.0.0.1'))
+        log = m.FailedLoginLog.objects.get()
+        self.assertEquals(log.ip_address, 'unknown')
+        self.assertIsNone(log.ip_address_packed)
+        self.assertEquals(log.forwarded, '192.168.1.1,10.0.0.1')
+
+    def test_in_network(self):
+        for ip in ('10.2.0.0', '10.2.3.4', '10.2.255.255', '10.3.0.0', '10.1.255.255', '2001:db8::1'):
+            self.logger.log_failed_login(ip, request(ip))
+        logs = m.FailedLoginLog.objects.in_network('10.2.0.0/16')
+        self.assertEquals(sorted(log.username for log in logs), ['10.2.0.0', '10.2.255.255', '10.2.3.4'])
+        self.assertEquals(m.FailedLoginLog.objects.in_network('2001:db8::/32').get().username, '2001:db8::1')
+        self.assertEquals(m.FailedLoginLog.objects.in_network('10.2.3.4').count(), 1)
+
+    def test_for_ip_finds_packed_and_string_addresses(self):
+        self.logger.log_login('john', request('10.2.3.4'))
+        m.LoginLog.objects.create(username='jane', ip_address='10.2.3.4')
+        self.assertEquals(m.LoginLog.objects.for_ip('10.2.3.4').count(), 2)
+
+    def test_pack_ip_addresses_command(self):
+        m.LoginLog.objects.create(username='john', ip_address='10.2.3.4', forwarded_by='10.0.0.1,10.0.0.2')
+        m.LoginLog.objects.create(username='jane', ip_address='unknown', forwarded_by='')
+        management.call_command('pack_ip_addresses', verbosity=0)
+        john = m.LoginLog.objects.get(username='john')
+        self.assertEquals((john.ip_address, john.ip_address_packed), (None, '10.2.3.4'))
+        self.assertEquals(john.forwarded, '10.0.0.1,10.0.0.2')
+        self.assertEquals(m.LoginLog.objects.get(username='jane').ip_address, 'unknown')
+        self.assertEquals(m.LoginLog.objects.in_network('10.2.0.0/16').count(), 1)
+
+    def test_packed_addresses_are_archived(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.logger.log_failed_login('john', request(forwarded_for='10.2.3.4'))
+        m.FailedLoginLog.objects.update(timestamp=m.FailedLoginLog.objects.get().timestamp.replace(year=2000))
+        management.call_command('archive_audit_logs', directory=directory, days=1, verbosity=0,
+                                models=['FailedLoginLog'])
+        with Archive(directory, 'FailedLoginLog') as archive:
+            log, = archive.query(ip_address='10.2.3.4')
+        self.assertEquals(log.forwarded_by, '192.168.1.1')
@@ -0,0 +1,154 @@
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from .. import models as m
+from ..backend import AuthFailedLoggerBackend
+from ..throttle import IPThrottle, get_ip_throttle
+
+
+class IPThrottleTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.throttle = IPThrottle(ip_limit=2, subnet_limit=3)
+
+    def test_blocked_after_ip_limit(self):
+        self.throttle.record_failure('192.168.1.2')
+        self.assertFalse(self.throttle.is_blocked('192.168.1.2'))
+        self.throttle.record_failure('192.168.1.2')
+        self.assertTrue(self.throttle.is_blocked('192.168.1.2'))
+        self.assertFalse(self.throttle.is_blocked('192.168.1.3'))
+
+    def test_blocked_after_subnet_limit(self):
+        for ip in ('192.168.1.2', '192.168.1.3', '192.168.1.4'):
+            self.throttle.record_failure(ip)
+        self.assertTrue(self.throttle.is_blocked('192.168.1.5'))
+        self.assertFalse(self.throttle.is_blocked('192.168.2.5'))
+
+    def test_ipv6_subnet(self):
+        for ip in ('2001:db8::1', '2001:db8::2', '2001:db8::3'):
+            self.throttle.record_failure(ip)
+        self.assertTrue(self.throttle.is_blocked('2001:db8::ffff'))
+        self.assertFalse(self.throttle.is_blocked('2001:db8:0:1::1'))
+
+    def test_invalid_address_is_ignored(self):
+        self.throttle.record_failure('unknown')
+        self.throttle.record_failure(None)
+        self.assertFalse(self.throttle.is_blocked('unknown'))
+
+    def test_reset(self):
+        self.throttle.record_failure('192.168.1.2')
+        self.throttle.record_failure('192.168.1.2')
+        self.throttle.reset('192.168.1.2')
+        self.assertFalse(self.throttle.is_blocked('192.168.1.2'))
+
+    def test_client_address_ignores_forwarded_for_by_default(self):
+        request = RequestFactory().post('/login', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.1.1.1')
+        self.assertEquals(self.throttle.client_address(request), '10.0.0.1')
+
+    def test_client_address_behind_trusted_proxies(self):
+        throttle = IPThrottle(ip_limit=2, trusted_proxies=2)
+        # The client prepended 6.6.6.6 itself, the two proxies appended 1.1.1.1 and 10.0.0.2
+        request = RequestFactory().post('/login', REMOTE_ADDR='10.0.0.1',
+                                        HTTP_X_FORWARDED_FOR='6.6.6.6, 1.1.1.1, 10.0.0.2')
+        self.assertEquals(throttle.client_address(request), '1.1.1.1')
+        # Less hops than trusted proxies
+        request = RequestFactory().post('/login', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.1.1.1')
+        self.assertEquals(throttle.client_address(request), '1.1.1.1')
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(get_ip_throttle())
+
+    @override_settings(LOGIN_FAILURE_SUBNET_LIMIT=10, LOGIN_FAILURE_IPV4_PREFIX=16)
+    def test_get_ip_throttle(self):
+        throttle = get_ip_throttle()
+        self.assertEquals(throttle.ip_limit, 0)
+        self.assertEquals(throttle.subnet_limit, 10)
+        self.assertEquals(throttle.prefixes[4], 16)
+
+
+@override_settings(LOGIN_FAILURE_IP_LIMIT=2)
+class IPThrottleBackendTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='john', password='sue')
+
+    def request(self, ip='192.168.1.2'):
+        return RequestFactory().post('/login', REMOTE_ADDR=ip)
+
+    def fail_login(self, username, ip='192.168.1.2'):
+        return AuthFailedLoggerBackend().authenticate(self.request(ip), username=username, password='wrong')
+
+    def test_ip_is_throttled_across_usernames(self):
+        self.fail_login('user1')
+        self.fail_login('user2')
+        with self.assertRaises(PermissionDenied):
+            self.fail_login('user3')
+        self.fail_login('user3', ip='192.168.1.3')
+        self.assertEquals(m.FailedLoginLog.objects.count(), 4)
+
+    def test_throttled_login_doesnt_load_user(self):
+        self.fail_login('user1')
+        self.fail_login('user2')
+        with self.assertNumQueries(1):  # The failed login log
+            with self.assertRaises(PermissionDenied):
+                self.fail_login('john')
+
+    def test_throttled_login_doesnt_count_against_user(self):
+        self.fail_login('user1')
+        self.fail_login('user2')
+        with self.assertRaises(PermissionDenied):
+            self.fail_login('john')
+        self.assertIsNone(m.LoginAttemptLogger().get_count('john'))
+
+    @override_settings(LOGIN_FAILURE_IP_TRUSTED_PROXIES=1)
+    def test_rotating_forwarded_for_doesnt_evade_throttle(self):
+        def fail_login(spoofed):
+            request = RequestFactory().post('/login', REMOTE_ADDR='10.0.0.1',
+                                            HTTP_X_FORWARDED_FOR='%s, 192.168.1.2' % spoofed)
+            AuthFailedLoggerBackend().authenticate(request, username='john', password='wrong')
+
+        fail_login('1.1.1.1')
+        fail_login('2.2.2.2')
+        with self.assertRaises(PermissionDenied):
+            fail_login('3.3.3.3')
+
+    @override_settings(AUTHENTICATION_BACKENDS=(
+        'useraudit.password_expiry.AccountExpiryBackend',
+        'django.contrib.auth.backends.ModelBackend',
+        'useraudit.backend.AuthFailedLoggerBackend'))
+    def test_expiry_backend_refuses_throttled_ip_before_other_backends(self):
+        self.fail_login('user1')
+        self.fail_login('user2')
+        self.assertIsNone(authenticate(self.request(), username='john', password='sue'))
+        # Refused without counting a failed login of john
+        self.assertEquals(m.FailedLoginLog.objects.count(), 2)
+        self.assertIsNone(m.LoginAttemptLogger().get_count('john'))
+
+    @override_settings(LOGIN_FAILURE_LIMIT=3, AUTHENTICATION_BACKENDS=(
+        'useraudit.password_expiry.AccountExpiryBackend',
+        'django.contrib.auth.backends.ModelBackend',
+        'useraudit.backend.AuthFailedLoggerBackend'))
+    def test_throttled_ip_cant_lock_out_users(self):
+        self.fail_login('user1')
+        self.fail_login('user2')
+        for _ in range(3):
+            self.assertIsNone(authenticate(self.request(), username='john', password='sue'))
+        self.assertIsNone(m.LoginAttemptLogger().get_count('john'))
+        self.assertTrue(User.objects.get(username='john').is_active)
+
+    @override_settings(AUTHENTICATION_BACKENDS=(
+        'useraudit.password_expiry.AccountExpiryBackend',
+        'django.contrib.auth.backends.ModelBackend',
+        'useraudit.backend.AuthFailedLoggerBackend'))
+    def test_expiry_backend_counts_refused_login_against_the_client(self):
+        User.objects.filter(username='john').update(is_active=False)
+        self.fail_login('user1')
+        self.assertIsNone(authenticate(self.request(), username='john', password='sue'))
+        # The refused login was counted against the address of the request
+        self.assertTrue(get_ip_throttle().is_blocked('192.168.1.2'))
@@ -0,0 +1,107 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase, override_settings
+
+from .. import backend
+from ..backend import (AuthFailedLoggerBackend, CumulativeLockoutPolicy, SlidingWindowLockoutPolicy,
+                       get_lockout_policy)
+from .utils import simulate_login
+
+NOW = 1500000000.0
+
+
+def minutes_later(minutes):
+    return mock.patch.object(backend.time, 'time', return_value=NOW + minutes * 60)
+
+
+class SlidingWindowLockoutPolicyTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.policy = SlidingWindowLockoutPolicy(3, window_minutes=10, buckets=10)
+
+    def test_failures_within_window_are_counted(self):
+        with minutes_later(0):
+            self.policy.record_failure('some_user', 1)
+        with minutes_later(5):
+            self.policy.record_failure('some_user', 2)
+        with minutes_later(9):
+            self.assertEquals(self.policy.record_failure('some_user', 3), 3)
+
+    def test_failures_outside_of_window_are_not_counted(self):
+        with minutes_later(0):
+            self.policy.record_failure('some_user', 1)
+            self.policy.record_failure('some_user', 2)
+        with minutes_later(11):
+            self.assertEquals(self.policy.record_failure('some_user', 3), 1)
+            self.assertEquals(self.policy.get_count('some_user'), 1)
+
+    def test_failures_are_counted_per_username(self):
+        with minutes_later(0):
+            self.policy.record_failure('some_user', 1)
+            self.assertEquals(self.policy.record_failure('other_user', 1), 1)
+
+    def test_reset(self):
+        with minutes_later(0):
+            self.policy.record_failure('some_user', 1)
+        with minutes_later(1):
+            self.policy.record_failure('some_user', 2)
+            self.policy.reset('some_user')
+            self.assertEquals(self.policy.get_count('some_user'), 0)
+
+
+class GetLockoutPolicyTest(TestCase):
+
+    def test_cumulative_by_default(self):
+        self.assertIsInstance(get_lockout_policy(), CumulativeLockoutPolicy)
+        self.assertNotIsInstance(get_lockout_policy(), SlidingWindowLockoutPolicy)
+
+    @override_settings(LOGIN_FAILURE_WINDOW_MINUTES=15)
+    def test_sliding_window_if_window_is_set(self):
+        policy = get_lockout_policy()
+        self.assertIsInstance(policy, SlidingWindowLockoutPolicy)
+        self.assertEquals(policy.window, 15 * 60)
+
+    @override_settings(LOGIN_FAILURE_POLICY='useraudit.backend.SlidingWindowLockoutPolicy', LOGIN_FAILURE_LIMIT=4)
+    def test_custom_policy(self):
+        policy = get_lockout_policy()
+        self.assertIsInstance(policy, SlidingWindowLockoutPolicy)
+        self.assertEquals(policy.limit, 4)
+
+
+@override_settings(LOGIN_FAILURE_LIMIT=2, LOGIN_FAILURE_WINDOW_MINUTES=10)
+class SlidingWindowLockoutTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='john', password='sue')
+
+    def fail_login(self):
+        AuthFailedLoggerBackend().authenticate(username='john', password='wrong')
+
+    def is_active(self):
+        return User.objects.get(username='john').is_active
+
+    def test_user_is_blocked_after_failures_within_window(self):
+        with minutes_later(0):
+            self.fail_login()
+        with minutes_later(3):
+            with self.assertRaises(PermissionDenied):
+                self.fail_login()
+        self.assertFalse(self.is_active())
+
+    def test_user_is_not_blocked_by_failures_spread_out(self):
+        for day in range(5):
+            with minutes_later(day * 24 * 60):
+                self.fail_login()
+        self.assertTrue(self.is_active())
+
+    def test_successful_login_resets_window(self):
+        with minutes_later(0):
+            self.fail_login()
+            simulate_login('john', 'sue', headers={'REMOTE_ADDR': '192.168.1.2'})
+            self.fail_login()
+        self.assertTrue(self.is_active())
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+
+from .. import models as m
+
+
+class LogQuerySetTest(TestCase):
+
+    def setUp(self):
+        self.now = datetime(2020, 1, 10, 12, 0)
+        for days, username, ip in ((0, 'john', '10.0.0.1'), (1, 'john', '10.0.0.2'),
+                                   (2, 'jane', '10.0.0.1'), (3, 'jane', '10.0.0.3')):
+            m.FailedLoginLog.objects.create(username=username, ip_address=ip,
+                                            timestamp=self.now - timedelta(days=days))
+
+    def test_for_user(self):
+        logs = m.FailedLoginLog.objects.for_user('john')
+        self.assertEquals([log.ip_address for log in logs], ['10.0.0.1', '10.0.0.2'])
+
+    def test_for_ip(self):
+        logs = m.FailedLoginLog.objects.for_ip('10.0.0.1')
+        self.assertEquals([log.username for log in logs], ['john', 'jane'])
+
+    def test_between(self):
+        logs = m.FailedLoginLog.objects.between(self.now - timedelta(days=2), self.now)
+        self.assertEquals([log.timestamp for log in logs],
+                          [self.now - timedelta(days=1), self.now - timedelta(days=2)])
+
+    def test_between_open_ended(self):
+        self.assertEquals(m.FailedLoginLog.objects.between(start=self.now - timedelta(days=1)).count(), 2)
+        self.assertEquals(m.FailedLoginLog.objects.between(end=self.now - timedelta(days=1)).count(), 2)
+
+    def test_queries_can_be_combined(self):
+        logs = m.FailedLoginLog.objects.for_ip('10.0.0.1').between(end=self.now).for_user('jane')
+        self.assertEquals(logs.count(), 1)
+
+    def test_login_log_has_the_same_queries(self):
+        m.LoginLog.objects.create(username='john', ip_address='10.0.0.1')
+        self.assertEquals(m.LoginLog.objects.for_user('john').for_ip('10.0.0.1').between().count(), 1)
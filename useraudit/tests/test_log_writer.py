@@ -0,0 +1,129 @@
+import threading
+
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from .. import log_writer
+from .. import models as m
+from .utils import is_recent, simulate_login
+
+
+class ForegroundLogWriter(log_writer.BufferedLogWriter):
+    """Doesn't start the background thread, so that tests can decide when to flush."""
+    def _ensure_started(self):
+        pass
+
+
+def failed_login(username='some_user'):
+    return m.FailedLoginLog(username=username)
+
+
+class BufferedLogWriterTest(TestCase):
+
+    def test_records_are_written_on_flush(self):
+        writer = ForegroundLogWriter(buffer_size=10, batch_size=2)
+        for i in range(5):
+            writer.write(failed_login('user%d' % i))
+        self.assertEquals(m.FailedLoginLog.objects.count(), 0)
+
+        self.assertEquals(writer.flush(), 5)
+        self.assertEquals(m.FailedLoginLog.objects.count(), 5)
+        self.assertEquals(writer.flush(), 0)
+
+    def test_different_models_are_written(self):
+        writer = ForegroundLogWriter(buffer_size=10, batch_size=10)
+        writer.write(failed_login())
+        writer.write(m.LoginLog(username='some_user'))
+        writer.write(failed_login())
+        writer.flush()
+        self.assertEquals(m.FailedLoginLog.objects.count(), 2)
+        self.assertEquals(m.LoginLog.objects.count(), 1)
+
+    def test_timestamp_is_time_of_write(self):
+        writer = ForegroundLogWriter(buffer_size=10, batch_size=10)
+        record = failed_login()
+        writer.write(record)
+        timestamp = record.timestamp
+        writer.flush()
+        self.assertEquals(m.FailedLoginLog.objects.get().timestamp, timestamp)
+
+    def test_drop_overflow_policy(self):
+        writer = ForegroundLogWriter(buffer_size=2, batch_size=2, overflow=log_writer.DROP)
+        for _ in range(5):
+            writer.write(failed_login())
+        self.assertEquals(writer.dropped, 3)
+        self.assertEquals(writer.flush(), 2)
+
+    def test_sync_overflow_policy(self):
+        writer = ForegroundLogWriter(buffer_size=2, batch_size=2, overflow=log_writer.SYNC)
+        for _ in range(5):
+            writer.write(failed_login())
+        self.assertEquals(m.FailedLoginLog.objects.count(), 3)
+        writer.flush()
+        self.assertEquals(m.FailedLoginLog.objects.count(), 5)
+        self.assertEquals(writer.dropped, 0)
+
+    def test_records_are_written_immediately_once_closed(self):
+        writer = ForegroundLogWriter(buffer_size=2, batch_size=2)
+        writer.close()
+        for _ in range(3):
+            # Would block forever on the full buffer if queued
+            writer.write(failed_login())
+        self.assertEquals(m.FailedLoginLog.objects.count(), 3)
+
+    def test_write_nowait_leaves_blocking_writes_to_the_caller(self):
+        writer = ForegroundLogWriter(buffer_size=1, batch_size=1)
+        self.assertTrue(writer.write_nowait(failed_login()))
+        self.assertFalse(writer.write_nowait(failed_login()))
+        writer.close()
+        self.assertFalse(writer.write_nowait(failed_login()))
+        self.assertEquals(m.FailedLoginLog.objects.count(), 1)
+
+    def test_write_nowait_drops_when_full(self):
+        writer = ForegroundLogWriter(buffer_size=1, batch_size=1, overflow=log_writer.DROP)
+        self.assertTrue(writer.write_nowait(failed_login()))
+        self.assertTrue(writer.write_nowait(failed_login()))
+        self.assertEquals(writer.dropped, 1)
+
+    def test_invalid_overflow_policy(self):
+        with self.assertRaises(log_writer.ImproperlyConfigured):
+            log_writer.BufferedLogWriter(overflow='ignore')
+
+
+@override_settings(USERAUDIT_LOG_BUFFERED=True, USERAUDIT_LOG_FLUSH_INTERVAL=3600, USERAUDIT_LOG_BATCH_SIZE=100)
+class BufferedLoginLoggerTest(TestCase):
+
+    def test_failed_login_is_buffered(self):
+        simulate_login('some_user', 'some_pass', headers={'REMOTE_ADDR': '192.168.1.2'})
+        self.assertEquals(m.FailedLoginLog.objects.count(), 0)
+
+        self.assertEquals(log_writer.flush(), 1)
+        log = m.FailedLoginLog.objects.get()
+        self.assertEquals(log.username, 'some_user')
+        self.assertEquals(log.ip_address, '192.168.1.2')
+        self.assertTrue(is_recent(log.timestamp), 'Should have logged it recently')
+
+    @override_settings(USERAUDIT_LOG_BUFFERED=False)
+    def test_not_buffered_when_disabled(self):
+        simulate_login('some_user', 'some_pass', headers={'REMOTE_ADDR': '192.168.1.2'})
+        self.assertEquals(m.FailedLoginLog.objects.count(), 1)
+
+
+class BackgroundLogWriterTest(TransactionTestCase):
+
+    def test_blocked_write_is_released_by_close(self):
+        writer = ForegroundLogWriter(buffer_size=1, batch_size=1, flush_interval=0.01)
+        writer.write(failed_login())
+        blocked = threading.Thread(target=writer.write, args=(failed_login(),))
+        blocked.start()
+        writer.close()
+        blocked.join(5)
+        self.assertFalse(blocked.is_alive(), 'Should not block once the writer is closed')
+        self.assertEquals(m.FailedLoginLog.objects.count(), 2)
+
+    def test_background_thread_writes_records(self):
+        writer = log_writer.BufferedLogWriter(buffer_size=4, batch_size=2, flush_interval=0.01)
+        for _ in range(50):
+            writer.write(failed_login())
+        writer.close()
+        self.assertEquals(m.FailedLoginLog.objects.count(), 50)
+        self.assertEquals(writer.dropped, 0)
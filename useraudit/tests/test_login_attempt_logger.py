@@ -0,0 +1,74 @@
+import threading
+
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+
+from .. import models as m
+
+
+class LoginAttemptLoggerTest(TestCase):
+
+    def setUp(self):
+        self.logger = m.LoginAttemptLogger()
+
+    def test_increment_creates_counter(self):
+        self.assertEquals(self.logger.increment('some_user'), 1)
+        self.assertEquals(m.LoginAttempt.objects.get(username='some_user').count, 1)
+
+    def test_increment_returns_new_count(self):
+        self.logger.increment('some_user')
+        self.logger.increment('some_user')
+        self.assertEquals(self.logger.increment('some_user'), 3)
+        self.assertEquals(m.LoginAttempt.objects.get(username='some_user').count, 3)
+
+    def test_increment_after_reset(self):
+        self.logger.increment('some_user')
+        self.logger.reset('some_user')
+        self.assertEquals(self.logger.increment('some_user'), 1)
+
+    def test_increment_is_per_username(self):
+        self.logger.increment('some_user')
+        self.assertEquals(self.logger.increment('other_user'), 1)
+
+    def test_fallback_increment(self):
+        self.logger._update_or_insert(connection, 'some_user', m.datetime.datetime.now())
+        count = self.logger._update_or_insert(connection, 'some_user', m.datetime.datetime.now())
+        self.assertEquals(count, 2)
+        self.assertEquals(m.LoginAttempt.objects.get(username='some_user').count, 2)
+
+
+class ConcurrentLoginAttemptLoggerTest(TransactionTestCase):
+    THREADS = 8
+    INCREMENTS_PER_THREAD = 25
+
+    def hammer(self, increment):
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(self.INCREMENTS_PER_THREAD):
+                    increment('some_user')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals(errors, [])
+        self.assertEquals(m.LoginAttempt.objects.get(username='some_user').count,
+                          self.THREADS * self.INCREMENTS_PER_THREAD)
+
+    def test_concurrent_increments_are_not_lost(self):
+        self.hammer(m.LoginAttemptLogger().increment)
+
+    def test_concurrent_fallback_increments_are_not_lost(self):
+        logger = m.LoginAttemptLogger()
+
+        def increment(username):
+            return logger._update_or_insert(connections['default'], username, m.datetime.datetime.now())
+
+        self.hammer(increment)
@@ -0,0 +1,89 @@
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from .. import models as m
+from ..backend import AuthFailedLoggerBackend, SlidingWindowLockoutPolicy
+from ..signals import account_has_expired
+
+
+class LoginCallbackTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='john', password='sue')
+
+    def login(self):
+        m.login_callback(User, self.user, None)
+
+    def test_nothing_is_written_if_there_is_nothing_to_clear(self):
+        # The log, a conditional UPDATE and a DELETE that don't match any rows
+        with self.assertNumQueries(3):
+            self.login()
+        self.assertFalse(m.LoginAttempt.objects.exists())
+
+    def test_failed_logins_are_reset(self):
+        m.login_attempt_logger.increment('john')
+        self.login()
+        self.assertEquals(m.login_attempt_logger.get_count('john'), 0)
+
+    def test_deactivations_are_deleted(self):
+        m.UserDeactivation.objects.create(username='john')
+        self.login()
+        self.assertFalse(m.UserDeactivation.objects.exists())
+
+    @override_settings(USERAUDIT_LOGIN_STATE_CACHE='default')
+    def test_clean_user_is_only_logged(self):
+        self.login()
+        with self.assertNumQueries(1):
+            self.login()
+        self.assertEquals(m.LoginLog.objects.count(), 2)
+
+    @override_settings(USERAUDIT_LOGIN_STATE_CACHE='default', LOGIN_FAILURE_LIMIT=3, LOGIN_FAILURE_WINDOW_MINUTES=10)
+    def test_clean_user_keeps_the_lockout_window(self):
+        self.login()
+        with mock.patch.object(SlidingWindowLockoutPolicy, 'reset') as reset:
+            self.login()
+            self.assertFalse(reset.called)
+            AuthFailedLoggerBackend().authenticate(username='john', password='wrong')
+            self.login()
+            reset.assert_called_once_with('john')
+
+    @override_settings(USERAUDIT_LOGIN_STATE_CACHE='default')
+    def test_failed_login_marks_user_dirty(self):
+        self.login()
+        m.login_attempt_logger.increment('john')
+        self.login()
+        self.assertEquals(m.login_attempt_logger.get_count('john'), 0)
+
+    @override_settings(USERAUDIT_LOGIN_STATE_CACHE='default')
+    def test_deactivation_marks_user_dirty(self):
+        self.login()
+        account_has_expired.send(sender=User, user=self.user)
+        self.login()
+        self.assertFalse(m.UserDeactivation.objects.exists())
+
+    @override_settings(USERAUDIT_LOGIN_STATE_CACHE='default')
+    def test_bulk_deactivation_marks_users_dirty(self):
+        self.login()
+        m.save_deactivations(['john', 'jane'], m.UserDeactivation.ACCOUNT_EXPIRED)
+        self.assertFalse(m.login_state.get_login_state_cache().is_clean('john'))
+        self.login()
+        self.assertEquals(list(m.UserDeactivation.objects.values_list('username', flat=True)), ['jane'])
+
+    @override_settings(USERAUDIT_LOGIN_STATE_CACHE='default', USERAUDIT_LOGIN_ATTEMPT_CACHE='default')
+    def test_with_attempt_cache(self):
+        m.login_attempt_logger.increment('john')
+        self.login()
+        self.assertEquals(m.login_attempt_logger.get_count('john'), 0)
+        self.assertEquals(m.LoginAttempt.objects.get(username='john').count, 0)
+
+    @override_settings(USERAUDIT_LOGIN_STATE_CACHE='default')
+    async def test_alogin_callback(self):
+        await sync_to_async(m.login_attempt_logger.increment)('john')
+        await m.alogin_callback(User, self.user, None)
+        self.assertEquals(await m.login_attempt_logger.aget_count('john'), 0)
+        self.assertTrue(await m.login_state.get_login_state_cache().ais_clean('john'))
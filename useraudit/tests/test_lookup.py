@@ -0,0 +1,124 @@
+import threading
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .. import models as m
+from ..backend import AuthFailedLoggerBackend
+from ..lookup import begin_scope, end_scope, get_user_by_natural_key, lookup_scope
+from .utils import simulate_login
+
+
+def username_selects(queries):
+    table = User._meta.db_table
+    where = 'WHERE "%s"."username" =' % table
+    return [q for q in queries if q['sql'].startswith('SELECT') and where in q['sql']]
+
+
+class LookupScopeTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='john', password='sue')
+
+    def test_user_is_loaded_once_in_scope(self):
+        with lookup_scope():
+            with self.assertNumQueries(1):
+                first = get_user_by_natural_key('john')
+                second = get_user_by_natural_key('john')
+        self.assertIs(first, second)
+
+    def test_missing_user_is_cached_in_scope(self):
+        with lookup_scope():
+            with self.assertNumQueries(1):
+                for _ in range(2):
+                    with self.assertRaises(User.DoesNotExist):
+                        get_user_by_natural_key('nobody')
+
+    def test_no_caching_outside_of_scope(self):
+        with self.assertNumQueries(2):
+            get_user_by_natural_key('john')
+            get_user_by_natural_key('john')
+
+    def test_nested_scopes_share_cache(self):
+        with lookup_scope():
+            get_user_by_natural_key('john')
+            with lookup_scope():
+                with self.assertNumQueries(0):
+                    get_user_by_natural_key('john')
+            with self.assertNumQueries(0):
+                get_user_by_natural_key('john')
+
+    def test_saving_user_invalidates_cache(self):
+        with lookup_scope():
+            get_user_by_natural_key('john')
+            User.objects.get(username='john').save()
+            with self.assertNumQueries(1):
+                get_user_by_natural_key('john')
+
+    def test_creating_user_invalidates_missing_user(self):
+        with lookup_scope():
+            with self.assertRaises(User.DoesNotExist):
+                get_user_by_natural_key('jane')
+            User.objects.create_user(username='jane', password='sue')
+            self.assertEquals(get_user_by_natural_key('jane').username, 'jane')
+
+    def test_saving_other_models_keeps_cache(self):
+        with lookup_scope():
+            get_user_by_natural_key('john')
+            m.LoginAttempt.objects.create(username='john', count=1)
+            with self.assertNumQueries(0):
+                get_user_by_natural_key('john')
+
+    def test_other_models_are_fast_deleted(self):
+        for name in ('john', 'jane', 'jim'):
+            m.LoginAttempt.objects.create(username=name)
+            m.FailedLoginLog.objects.create(username=name)
+        # One DELETE statement each, the rows aren't loaded to send post_delete
+        with self.assertNumQueries(2):
+            m.LoginAttempt.objects.all().delete()
+            m.FailedLoginLog.objects.all().delete()
+
+    @override_settings(AUTH_USER_MODEL='auth.User')
+    def test_cache_invalidation_follows_the_user_model(self):
+        with lookup_scope():
+            get_user_by_natural_key('john')
+            User.objects.get(username='john').save()
+            with self.assertNumQueries(1):
+                get_user_by_natural_key('john')
+
+    def test_scope_is_private_to_thread(self):
+        tokens_in_thread = []
+
+        def begin_scope_in_thread():
+            token = begin_scope()
+            tokens_in_thread.append(token)
+            end_scope(token)
+
+        with lookup_scope():
+            thread = threading.Thread(target=begin_scope_in_thread)
+            thread.start()
+            thread.join()
+            self.assertIsNone(begin_scope(), 'Scope should be active in this thread')
+        self.assertIsNotNone(tokens_in_thread[0], 'Scope should NOT be active in the other thread')
+
+
+class FailedLoginUserLookupTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='john', password='sue')
+
+    @override_settings(LOGIN_FAILURE_LIMIT=1)
+    def test_backend_loads_user_once_when_blocking(self):
+        with CaptureQueriesContext(connection) as ctx:
+            with self.assertRaises(Exception):
+                AuthFailedLoggerBackend().authenticate(username='john', password='wrong')
+        self.assertEquals(len(username_selects(ctx.captured_queries)), 1)
+        self.assertFalse(User.objects.get(username='john').is_active)
+
+    def test_failed_login_request_loads_user_once_in_backend(self):
+        with CaptureQueriesContext(connection) as ctx:
+            simulate_login('john', 'wrong', headers={'REMOTE_ADDR': '192.168.1.2'})
+        # One SELECT by ModelBackend and one by AuthFailedLoggerBackend
+        self.assertEquals(len(username_selects(ctx.captured_queries)), 2)
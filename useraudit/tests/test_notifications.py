@@ -0,0 +1,152 @@
+from io import StringIO
+import socketserver
+import threading
+
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.test import SimpleTestCase, TestCase
+
+from .. import models as m
+from ..notifications import MailDispatcher, discard_pending, mark_sent, pending_in_chunks, record_pending
+
+
+def messages(count):
+    return [mail.EmailMessage('Subject %d' % i, 'Body', None, ['user%d@localhost' % i]) for i in range(count)]
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept messages."""
+
+    def reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply(b'220 localhost')
+        data = None
+        for line in self.rfile:
+            if data is not None:
+                if line == b'.\r\n':
+                    with self.server.lock:
+                        self.server.messages.append(b''.join(data))
+                    data = None
+                    self.reply(b'250 OK')
+                else:
+                    data.append(line)
+                continue
+            command = line[:4].upper()
+            if command == b'DATA':
+                data = []
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self.reply(b'221 Bye')
+                return
+            else:
+                self.reply(b'250 OK')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+
+
+class FlakyBackend(BaseEmailBackend):
+    """Fails the first `failures` messages sent through any instance."""
+    failures = 0
+    opened = 0
+
+    def open(self):
+        FlakyBackend.opened += 1
+
+    def send_messages(self, email_messages):
+        if FlakyBackend.failures:
+            FlakyBackend.failures -= 1
+            raise IOError('Connection reset')
+        mail.outbox.extend(email_messages)
+        return len(email_messages)
+
+
+class MailDispatcherTest(SimpleTestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        FlakyBackend.failures = 0
+        FlakyBackend.opened = 0
+
+    def dispatcher(self, **kwargs):
+        kwargs.setdefault('sleep', self.sleeps.append)
+        return MailDispatcher(**kwargs)
+
+    def test_locmem_backend(self):
+        with self.dispatcher(workers=3) as dispatcher:
+            self.assertEquals(dispatcher.send(messages(10)), [None] * 10)
+            self.assertEquals(dispatcher.send(messages(2)), [None] * 2)
+        self.assertEquals(sorted(msg.subject for msg in mail.outbox),
+                          sorted(['Subject %d' % i for i in range(10)] + ['Subject 0', 'Subject 1']))
+
+    def test_console_backend(self):
+        stream = StringIO()
+
+        def get_connection(**kwargs):
+            return mail.get_connection('django.core.mail.backends.console.EmailBackend', stream=stream, **kwargs)
+
+        with self.dispatcher(workers=2, get_connection=get_connection) as dispatcher:
+            dispatcher.send(messages(3))
+        self.assertEquals(stream.getvalue().count('Subject: Subject'), 3)
+
+    def test_smtp_server(self):
+        server = SMTPServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        def get_connection(**kwargs):
+            return mail.get_connection('django.core.mail.backends.smtp.EmailBackend',
+                                       host='127.0.0.1', port=server.server_address[1], **kwargs)
+
+        with self.dispatcher(workers=2, get_connection=get_connection) as dispatcher:
+            self.assertEquals(dispatcher.send(messages(20)), [None] * 20)
+        self.assertEquals(len(server.messages), 20)
+        # Each thread reused its connection
+        self.assertLessEqual(server.connections, 2)
+
+    def test_failures_are_retried_with_backoff(self):
+        FlakyBackend.failures = 2
+
+        def get_connection(**kwargs):
+            return FlakyBackend(**kwargs)
+
+        with self.dispatcher(workers=1, retries=3, backoff=0.5, get_connection=get_connection) as dispatcher:
+            self.assertEquals(dispatcher.send(messages(1)), [None])
+        self.assertEquals(self.sleeps, [0.5, 1.0])
+        self.assertEquals(FlakyBackend.opened, 3)
+        self.assertEquals(len(mail.outbox), 1)
+
+    def test_error_is_returned_after_last_retry(self):
+        FlakyBackend.failures = 10
+
+        def get_connection(**kwargs):
+            return FlakyBackend(**kwargs)
+
+        with self.dispatcher(workers=1, retries=2, get_connection=get_connection) as dispatcher:
+            errors = dispatcher.send(messages(1))
+        self.assertIsInstance(errors[0], IOError)
+        self.assertEquals(len(self.sleeps), 2)
+
+
+class PendingNotificationTest(TestCase):
+
+    def test_pending_notifications(self):
+        record_pending(m.UserNotification.ACCOUNT_EXPIRED, ['john', 'jane', 'jim'])
+        mark_sent(m.UserNotification.ACCOUNT_EXPIRED, ['jane'])
+        discard_pending(m.UserNotification.ACCOUNT_EXPIRED, ['jim'])
+        self.assertEquals(list(pending_in_chunks(m.UserNotification.ACCOUNT_EXPIRED, chunk_size=1)), [['john']])
+        self.assertIsNotNone(m.UserNotification.objects.get(username='jane').sent)
+        self.assertFalse(m.UserNotification.objects.filter(username='jim').exists())
@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+from django.core import management
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .. import models as m
+
+
+def days_ago(days):
+    return timezone.now() - timedelta(days=days)
+
+
+class PruneAuditLogsTest(TestCase):
+
+    def setUp(self):
+        for days in (100, 50, 10, 1):
+            m.LoginLog.objects.create(username='user%d' % days, timestamp=days_ago(days))
+            m.FailedLoginLog.objects.create(username='user%d' % days, timestamp=days_ago(days))
+            m.UserDeactivation.objects.create(username='user%d' % days)
+        m.UserDeactivation.objects.update(timestamp=days_ago(100))
+
+    def prune(self, **options):
+        management.call_command('prune_audit_logs', verbosity=0, **options)
+
+    def usernames(self, model):
+        return sorted(model.objects.values_list('username', flat=True))
+
+    @override_settings(USERAUDIT_RETENTION_DAYS={'LoginLog': 30, 'FailedLoginLog': 5})
+    def test_old_rows_are_deleted(self):
+        self.prune()
+        self.assertEquals(self.usernames(m.LoginLog), ['user1', 'user10'])
+        self.assertEquals(self.usernames(m.FailedLoginLog), ['user1'])
+
+    @override_settings(USERAUDIT_RETENTION_DAYS={'LoginLog': 30})
+    def test_models_without_retention_are_kept(self):
+        self.prune()
+        self.assertEquals(m.FailedLoginLog.objects.count(), 4)
+        self.assertEquals(m.UserDeactivation.objects.count(), 4)
+
+    @override_settings(USERAUDIT_RETENTION_DAYS={'LoginLog': 30, 'UserDeactivation': 30})
+    def test_model_option(self):
+        self.prune(models=['UserDeactivation'])
+        self.assertEquals(m.LoginLog.objects.count(), 4)
+        self.assertEquals(m.UserDeactivation.objects.count(), 0)
+
+    @override_settings(USERAUDIT_RETENTION_DAYS={'LoginAttempt': 30})
+    def test_login_attempts(self):
+        m.LoginAttempt.objects.create(username='old', count=2)
+        m.LoginAttempt.objects.create(username='recent', count=1)
+        m.LoginAttempt.objects.filter(username='old').update(timestamp=days_ago(40))
+        self.prune()
+        self.assertEquals(self.usernames(m.LoginAttempt), ['recent'])
+
+    @override_settings(USERAUDIT_RETENTION_DAYS={'FailedLoginLog': 5})
+    def test_deletes_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.prune(chunk_size=1)
+        deletes = [q for q in queries if q['sql'].startswith('DELETE')]
+        # One statement per primary key in the range of old rows, nothing loaded into memory
+        self.assertEquals(len(deletes), 3)
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT "useraudit_failedloginlog"."id",')])
+        self.assertEquals(self.usernames(m.FailedLoginLog), ['user1'])
+
+    @override_settings(USERAUDIT_RETENTION_DAYS={'LoginLog': 30})
+    def test_running_again_continues_with_rows_left(self):
+        self.prune()
+        m.LoginLog.objects.create(username='user40', timestamp=days_ago(40))
+        self.prune()
+        self.assertEquals(self.usernames(m.LoginLog), ['user1', 'user10'])
+
+    @override_settings(USERAUDIT_RETENTION_DAYS={'LoginLogs': 30})
+    def test_unknown_model(self):
+        with self.assertRaises(CommandError):
+            self.prune()
@@ -0,0 +1,85 @@
+from unittest import skipIf, skipUnless
+
+import django
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+
+from .. import models as m
+from ..receivers import LOGIN_CALLBACK_UID, connected_receivers
+
+
+LOCKOUT = 'useraudit.backend.user_pre_save'
+EXPIRY = 'useraudit.password_expiry.user_pre_save'
+
+
+class ReceiverWiringTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='john', password='sue')
+
+    def save(self):
+        user = User.objects.get(username='john')
+        user.first_name = 'John'
+        user.save()
+
+    def test_only_lockout_receiver_connected_by_default(self):
+        self.assertEquals(connected_receivers(), [LOCKOUT])
+
+    @override_settings(ACCOUNT_EXPIRY_DAYS=10)
+    def test_expiry_receiver(self):
+        self.assertEquals(connected_receivers(), [LOCKOUT, EXPIRY])
+
+    @override_settings(AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR='password_change_date')
+    def test_password_change_date_connects_expiry_receiver(self):
+        self.assertEquals(connected_receivers(), [LOCKOUT, EXPIRY])
+
+    def test_receivers_are_disconnected_after_override(self):
+        with self.settings(LOGIN_FAILURE_LIMIT=3, ACCOUNT_EXPIRY_DAYS=10):
+            self.assertEquals(connected_receivers(), [LOCKOUT, EXPIRY])
+        self.assertEquals(connected_receivers(), [LOCKOUT])
+
+    def test_save_by_default(self):
+        # Loading the user, the saved is_active of the lockout receiver and the UPDATE
+        with self.assertNumQueries(3):
+            self.save()
+
+    @override_settings(LOGIN_FAILURE_LIMIT=3, ACCOUNT_EXPIRY_DAYS=10)
+    def test_save_with_receivers(self):
+        # The saved password and is_active are loaded once, shared by both receivers
+        with self.assertNumQueries(3):
+            self.save()
+
+    def test_reactivation_without_lockout(self):
+        m.LoginAttemptLogger().increment('john')
+        User.objects.filter(username='john').update(is_active=False)
+        user = User.objects.get(username='john')
+        user.is_active = True
+        user.save()
+        # Enabling LOGIN_FAILURE_LIMIT later mustn't count the failures from before the reactivation
+        self.assertEquals(m.LoginAttemptLogger().get_count('john'), 0)
+
+
+class LoginCallbackWiringTest(TestCase):
+
+    def connected_callback(self):
+        callbacks = [entry[1]() for entry in user_logged_in.receivers if entry[0][0] == LOGIN_CALLBACK_UID]
+        self.assertEquals(len(callbacks), 1)
+        return callbacks[0]
+
+    def test_sync_callback_by_default(self):
+        self.assertIs(self.connected_callback(), m.login_callback)
+
+    @skipUnless(django.VERSION >= (5, 0), 'Django 5.0+')
+    def test_async_callback(self):
+        with self.settings(USERAUDIT_ASYNC_LOGIN_CALLBACK=True):
+            self.assertIs(self.connected_callback(), m.alogin_callback)
+        self.assertIs(self.connected_callback(), m.login_callback)
+
+    @skipIf(django.VERSION >= (5, 0), 'Django < 5.0')
+    def test_async_callback_needs_django_5(self):
+        with self.assertRaises(ImproperlyConfigured):
+            with self.settings(USERAUDIT_ASYNC_LOGIN_CALLBACK=True):
+                pass
+        self.assertIs(self.connected_callback(), m.login_callback)
@@ -1,13 +1,46 @@
+import asyncio
+
+from django.http import HttpResponse
 from django.test import TestCase
+from django.test.client import RequestFactory
 
-from useraudit.middleware import get_request
+from useraudit.middleware import RequestToThreadLocalMiddleware, get_request
 
 
 class RequestToThreadLocalMiddlewareTest(TestCase):
 
-    def test_request_is_saved(self):
-        self.client.get('', X_TEST='middleware test')
+    def test_request_is_available_while_processed(self):
+        response = self.client.get('/test_request_available/')
+        self.assertEquals(response.status_code, 200)
+
+    def test_request_is_released_after_response(self):
+        self.client.get('/test_request_available/')
+        self.assertIsNone(get_request())
+
+    def test_request_is_released_if_view_raises(self):
+        def view(request):
+            raise ValueError()
+
+        middleware = RequestToThreadLocalMiddleware(view)
+        with self.assertRaises(ValueError):
+            middleware(RequestFactory().get('/'))
+        self.assertIsNone(get_request())
+
+    def test_async_requests_see_their_own_request(self):
+        seen = {}
+
+        async def view(request):
+            await asyncio.sleep(0)
+            seen[request.path] = get_request()
+            return HttpResponse('OK')
+
+        middleware = RequestToThreadLocalMiddleware(view)
+        requests = [RequestFactory().get('/%d' % i) for i in range(5)]
+
+        async def run():
+            await asyncio.gather(*[middleware(request) for request in requests])
+            return get_request()
 
-        request = get_request()
-        self.assertTrue(request is not None)
-        self.assertEquals(request.META['X_TEST'], 'middleware test')
+        self.assertIsNone(asyncio.run(run()))
+        for request in requests:
+            self.assertIs(seen[request.path], request)
@@ -0,0 +1,158 @@
+from datetime import date, datetime, timedelta
+
+from django.core import management
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from .. import log_writer
+from .. import models as m
+from .test_log_writer import ForegroundLogWriter
+
+
+def request(ip='10.0.0.1'):
+    return RequestFactory().post('/login', REMOTE_ADDR=ip)
+
+
+def counts(model, **key):
+    return [(count.day, count.successes, count.failures) for count in model.objects.filter(**key).order_by('day')]
+
+
+# The logins are counted once the transaction logging them is committed
+@override_settings(USERAUDIT_ROLLUP_ON_WRITE=True)
+class RollupOnWriteTest(TransactionTestCase):
+
+    def setUp(self):
+        self.logger = m.LoginLogger()
+        self.today = datetime.now().date()
+
+    def test_logins_are_counted(self):
+        self.logger.log_login('john', request())
+        self.logger.log_failed_login('john', request())
+        self.logger.log_failed_login('jane', request('10.0.0.2'))
+        self.assertEquals(counts(m.DailyLoginCount), [(self.today, 1, 2)])
+        self.assertEquals(counts(m.DailyUserLoginCount, username='john'), [(self.today, 1, 1)])
+        self.assertEquals(counts(m.DailyIPLoginCount, ip_address='10.0.0.2'), [(self.today, 0, 1)])
+
+    def test_failed_login_without_username_or_request(self):
+        self.logger.log_failed_login(None, None)
+        self.assertEquals(counts(m.DailyUserLoginCount, username=''), [(self.today, 0, 1)])
+        self.assertEquals(counts(m.DailyIPLoginCount, ip_address=''), [(self.today, 0, 1)])
+
+    @override_settings(USERAUDIT_PACK_IP_ADDRESSES=True)
+    def test_packed_addresses_are_counted_as_strings(self):
+        self.logger.log_failed_login('john', request('10.0.0.2'))
+        self.assertEquals(counts(m.DailyIPLoginCount, ip_address='10.0.0.2'), [(self.today, 0, 1)])
+
+    def test_command_refuses_to_count_twice(self):
+        with self.assertRaises(CommandError):
+            management.call_command('update_login_rollups', verbosity=0)
+
+
+@override_settings(USERAUDIT_ROLLUP_ON_WRITE=True)
+class BufferedRollupTest(TestCase):
+
+    def setUp(self):
+        self.today = datetime.now().date()
+
+    def test_batch_is_counted_once(self):
+        writer = ForegroundLogWriter(buffer_size=10, batch_size=10)
+        for username in ('john', 'john', 'jane'):
+            writer.write(m.FailedLoginLog(username=username, ip_address='10.0.0.1'))
+        with CaptureQueriesContext(connection) as queries:
+            writer.flush()
+        # One UPDATE per day, day and username and day and address, not per record
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "useraudit_daily')]
+        self.assertEquals(len(updates), 1 + 2 + 1)
+        self.assertEquals(counts(m.DailyLoginCount), [(self.today, 0, 3)])
+        self.assertEquals(counts(m.DailyUserLoginCount, username='john'), [(self.today, 0, 2)])
+        self.assertEquals(counts(m.DailyIPLoginCount, ip_address='10.0.0.1'), [(self.today, 0, 3)])
+
+    def test_dropped_records_arent_counted(self):
+        writer = ForegroundLogWriter(buffer_size=1, batch_size=1, overflow=log_writer.DROP)
+        writer.write(m.FailedLoginLog(username='john'))
+        writer.write(m.FailedLoginLog(username='john'))
+        self.assertEquals(counts(m.DailyLoginCount), [])
+        writer.flush()
+        self.assertEquals(counts(m.DailyLoginCount), [(self.today, 0, 1)])
+
+    @override_settings(USERAUDIT_LOG_BUFFERED=True, USERAUDIT_LOG_FLUSH_INTERVAL=3600)
+    def test_logins_are_counted_when_written(self):
+        m.LoginLogger().log_login('john', request())
+        self.assertEquals(counts(m.DailyLoginCount), [])
+        log_writer.flush()
+        self.assertEquals(counts(m.DailyLoginCount), [(self.today, 1, 0)])
+
+
+class RollupCommandTest(TestCase):
+
+    def setUp(self):
+        self.day = datetime(2020, 1, 10, 12, 0)
+
+    def log(self, model, days_ago=0, username='john', ip='10.0.0.1'):
+        model.objects.create(username=username, ip_address=ip, timestamp=self.day - timedelta(days=days_ago))
+
+    def update(self, chunk_size=2):
+        management.call_command('update_login_rollups', chunk_size=chunk_size, verbosity=0)
+
+    def test_logs_are_counted_per_day(self):
+        self.log(m.LoginLog)
+        self.log(m.FailedLoginLog)
+        self.log(m.FailedLoginLog, username='jane', ip='10.0.0.2')
+        self.log(m.FailedLoginLog, days_ago=1)
+        self.update()
+        self.assertEquals(counts(m.DailyLoginCount), [(date(2020, 1, 9), 0, 1), (date(2020, 1, 10), 1, 2)])
+        self.assertEquals(counts(m.DailyUserLoginCount, username='jane'), [(date(2020, 1, 10), 0, 1)])
+        self.assertEquals(counts(m.DailyIPLoginCount, ip_address='10.0.0.1'),
+                          [(date(2020, 1, 9), 0, 1), (date(2020, 1, 10), 1, 1)])
+
+    def test_only_new_rows_are_counted(self):
+        self.log(m.FailedLoginLog)
+        self.update()
+        self.update()
+        self.assertEquals(counts(m.DailyLoginCount), [(date(2020, 1, 10), 0, 1)])
+        self.log(m.FailedLoginLog)
+        self.update()
+        self.assertEquals(counts(m.DailyLoginCount), [(date(2020, 1, 10), 0, 2)])
+        self.assertEquals(m.RollupProgress.objects.get(name='FailedLoginLog').last_pk,
+                          m.FailedLoginLog.objects.latest('pk').pk)
+
+    def test_recent_rows_are_left_for_the_next_run(self):
+        self.log(m.FailedLoginLog)
+        # A row with a lower id could still be committed after this one
+        m.FailedLoginLog.objects.create(username='john', timestamp=datetime.now())
+        self.update()
+        self.assertEquals(counts(m.DailyLoginCount), [(date(2020, 1, 10), 0, 1)])
+        self.assertEquals(m.RollupProgress.objects.get(name='FailedLoginLog').last_pk,
+                          m.FailedLoginLog.objects.earliest('pk').pk)
+        management.call_command('update_login_rollups', lag_minutes=0, verbosity=0)
+        self.assertEquals(m.DailyLoginCount.objects.get(day=datetime.now().date()).failures, 1)
+
+    def test_string_and_packed_addresses_are_merged(self):
+        self.log(m.FailedLoginLog)
+        m.FailedLoginLog.objects.create(username='john', ip_address_packed='10.0.0.1', timestamp=self.day)
+        self.update(chunk_size=10)
+        self.assertEquals(counts(m.DailyIPLoginCount, ip_address='10.0.0.1'), [(date(2020, 1, 10), 0, 2)])
+
+
+class LoginCountQueryTest(TestCase):
+
+    def setUp(self):
+        for day, ip, failures in ((1, '10.0.0.1', 5), (2, '10.0.0.1', 1), (2, '10.0.0.2', 3), (3, '10.0.0.3', 10)):
+            m.DailyIPLoginCount.objects.create(day=date(2020, 1, day), ip_address=ip, failures=failures, successes=1)
+
+    def test_between(self):
+        self.assertEquals(m.DailyIPLoginCount.objects.between(date(2020, 1, 2), date(2020, 1, 3)).count(), 2)
+        self.assertEquals(m.DailyIPLoginCount.objects.between(start=date(2020, 1, 2)).count(), 3)
+
+    def test_top(self):
+        week = m.DailyIPLoginCount.objects.between(date(2020, 1, 1), date(2020, 1, 3))
+        self.assertEquals(week.top('ip_address', limit=2), [('10.0.0.1', 2, 6), ('10.0.0.2', 1, 3)])
+        self.assertEquals(m.DailyIPLoginCount.objects.top('ip_address', limit=1, failures=False),
+                          [('10.0.0.1', 2, 6)])
+
+    def test_totals(self):
+        totals = m.DailyIPLoginCount.objects.filter(ip_address='10.0.0.1').values('ip_address').totals().get()
+        self.assertEquals((totals['total_successes'], totals['total_failures']), (2, 6))
@@ -0,0 +1,93 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from .. import models as m
+from ..tracking import is_reactivated, password_changed
+
+
+class TrackingTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='john', password='sue')
+
+    def load(self, **kwargs):
+        return User.objects.get(username='john', **kwargs)
+
+    def test_changed_password_is_detected_without_query(self):
+        user = self.load()
+        user.set_password('new')
+        with self.assertNumQueries(0):
+            self.assertTrue(password_changed(user))
+
+    def test_unchanged_fields_are_checked_in_database(self):
+        user = self.load()
+        with self.assertNumQueries(1):
+            self.assertFalse(password_changed(user))
+            self.assertFalse(is_reactivated(user))
+
+    def test_fields_not_saved_are_not_checked(self):
+        user = self.load()
+        user.set_password('new')
+        with self.assertNumQueries(0):
+            self.assertFalse(password_changed(user, update_fields=['last_login']))
+            self.assertFalse(is_reactivated(user, update_fields=['last_login']))
+
+    def test_reactivation_is_detected_without_query(self):
+        User.objects.filter(username='john').update(is_active=False)
+        user = self.load()
+        user.is_active = True
+        with self.assertNumQueries(0):
+            self.assertTrue(is_reactivated(user))
+
+    def test_deactivation_is_detected_without_query(self):
+        user = self.load()
+        user.is_active = False
+        with self.assertNumQueries(0):
+            self.assertFalse(is_reactivated(user))
+
+    def test_reactivation_of_stale_instance_is_detected(self):
+        user = self.load()
+        User.objects.filter(username='john').update(is_active=False)
+        self.assertTrue(is_reactivated(user))
+
+    def test_new_instance_isnt_checked_in_database(self):
+        user = User(username='jane', password='sue')
+        with self.assertNumQueries(0):
+            self.assertFalse(password_changed(user))
+
+    def test_instance_not_loaded_is_checked_in_database(self):
+        user = User(pk=self.load().pk, username='john', password='other')
+        self.assertTrue(password_changed(user))
+
+    def test_deferred_password_is_checked_in_database(self):
+        user = User.objects.only('username').get(username='john')
+        user.password = 'other'
+        self.assertTrue(password_changed(user))
+
+    def test_values_are_recorded_on_save(self):
+        user = self.load()
+        user.set_password('new')
+        user.save()
+        with self.assertNumQueries(1):
+            self.assertFalse(password_changed(user))
+
+    def test_unsaved_changes_are_kept_by_partial_save(self):
+        user = self.load()
+        user.set_password('new')
+        user.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            self.assertTrue(password_changed(user))
+
+    def test_last_login_update_doesnt_load_user(self):
+        user = self.load()
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+
+    @override_settings(LOGIN_FAILURE_LIMIT=3)
+    def test_reactivation_resets_failed_logins(self):
+        m.LoginAttemptLogger().increment('john')
+        User.objects.filter(username='john').update(is_active=False)
+        user = self.load()
+        user.is_active = True
+        user.save()
+        self.assertEquals(m.LoginAttemptLogger().get_count('john'), 0)
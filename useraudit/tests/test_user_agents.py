@@ -0,0 +1,82 @@
+from unittest import skipUnless
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core import management
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from .. import models as m
+from .. import user_agents
+
+
+def request(user_agent='Some user agent'):
+    return RequestFactory().post('/login', REMOTE_ADDR='192.168.1.2', HTTP_USER_AGENT=user_agent)
+
+
+@override_settings(USERAUDIT_NORMALIZE_USER_AGENTS=True)
+class NormalizedUserAgentTest(TestCase):
+
+    def setUp(self):
+        # The ids cached by other tests are of rolled back rows
+        user_agents.clear_cache()
+        self.logger = m.LoginLogger()
+
+    def test_user_agent_is_referenced(self):
+        self.logger.log_failed_login('john', request())
+        log = m.FailedLoginLog.objects.get()
+        self.assertIsNone(log.user_agent)
+        self.assertEquals(log.user_agent_ref.name, 'Some user agent')
+        self.assertEquals(log.agent, 'Some user agent')
+
+    def test_user_agent_is_stored_once(self):
+        self.logger.log_failed_login('john', request())
+        self.logger.log_login('john', request())
+        self.logger.log_login('jane', request('Other user agent'))
+        self.assertEquals(m.UserAgent.objects.count(), 2)
+
+    @skipUnless(hasattr(TestCase, 'captureOnCommitCallbacks'), 'Django 3.2+')
+    def test_known_user_agent_is_resolved_without_query(self):
+        self.logger.log_login('john', request())
+        # The id is cached when the transaction is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            user_agents.clear_cache()
+            self.logger.log_login('john', request())
+        with self.assertNumQueries(1):
+            self.logger.log_login('john', request())
+
+    def test_cache_is_bounded(self):
+        cache = user_agents.LRUCache(size=2)
+        for i in range(3):
+            cache.put('agent%d' % i, i)
+        self.assertIsNone(cache.get('agent0'))
+        self.assertEquals(cache.get('agent2'), 2)
+
+    async def test_async_log(self):
+        await self.logger.alog_failed_login('john', request())
+        log = await sync_to_async(m.FailedLoginLog.objects.select_related('user_agent_ref').get)()
+        self.assertEquals(log.agent, 'Some user agent')
+
+    def test_admin_shows_user_agent(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.logger.log_failed_login('john', request())
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/admin/useraudit/failedloginlog/')
+        self.assertContains(response, 'Some user agent')
+
+
+class NormalizeUserAgentsCommandTest(TestCase):
+
+    def test_existing_user_agents_are_moved(self):
+        for username in ('john', 'jane'):
+            m.FailedLoginLog.objects.create(username=username, user_agent='Some user agent')
+        m.LoginLog.objects.create(username='john', user_agent='Other user agent')
+        m.LoginLog.objects.create(username='john')
+
+        management.call_command('normalize_user_agents', verbosity=0, chunk_size=1)
+
+        self.assertEquals(m.UserAgent.objects.count(), 2)
+        self.assertFalse(m.FailedLoginLog.objects.exclude(user_agent=None).exists())
+        self.assertEquals(sorted(log.agent for log in m.FailedLoginLog.objects.all()),
+                          ['Some user agent', 'Some user agent'])
+        self.assertEquals(sorted(str(log.agent) for log in m.LoginLog.objects.all()), ['None', 'Other user agent'])
@@ -26,7 +26,7 @@ def simulate_login(username, password, headers=None):
     try:
         user = authenticate(request, username=username, password=password)
     except TypeError:
-        middleware.thread_data.request = request
+        middleware._request.set(request)
         user = authenticate(username=username, password=password)
     if user:
         login(request, user)
@@ -0,0 +1,138 @@
+"""
+Failed login throttling by client IP address and subnet.
+
+The lockout of AuthFailedLoggerBackend counts failures per username, so
+a single client trying many different usernames never reaches it. The
+throttle counts failed logins per client IP address and per subnet
+(/24 for IPv4 and /64 for IPv6 by default) in Django's cache. Once the
+address or its subnet has reached its limit, logins from it are refused
+before any user is loaded, until the counters expire.
+
+Each counter expires LOGIN_FAILURE_IP_WINDOW_MINUTES after the first
+failure it counted. Checking an address is one cache get_many, counting
+a failure is one add or incr per counter.
+
+The client sets the start of X-Forwarded-For itself, so the address
+that is throttled is the one the proxies in front of the application
+saw: LOGIN_FAILURE_IP_TRUSTED_PROXIES hops from the right of
+X-Forwarded-For followed by REMOTE_ADDR. Without trusted proxies it is
+REMOTE_ADDR and the header is ignored. Clients can't evade the throttle,
+or get another address throttled, by rotating the header.
+
+Settings::
+
+    # Failed logins allowed from one IP address. None or 0 disables the limit.
+    LOGIN_FAILURE_IP_LIMIT = 100
+    # Failed logins allowed from one subnet. None or 0 disables the limit.
+    LOGIN_FAILURE_SUBNET_LIMIT = 1000
+    # How long the failures are counted for.
+    LOGIN_FAILURE_IP_WINDOW_MINUTES = 60
+    # Prefix lengths of the subnets.
+    LOGIN_FAILURE_IPV4_PREFIX = 24
+    LOGIN_FAILURE_IPV6_PREFIX = 64
+    # Alias of the cache (see CACHES) holding the counters.
+    LOGIN_FAILURE_IP_CACHE = "default"
+    # Number of reverse proxies in front of the application appending to X-Forwarded-For.
+    LOGIN_FAILURE_IP_TRUSTED_PROXIES = 0
+"""
+import ipaddress
+
+from django.conf import settings
+from django.core.cache import caches
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0, the async methods can't be used
+    sync_to_async = None
+
+
+class IPThrottle(object):
+
+    def __init__(self, ip_limit=0, subnet_limit=0, window_minutes=60, ipv4_prefix=24, ipv6_prefix=64,
+                 cache_alias='default', trusted_proxies=0):
+        self.ip_limit = ip_limit
+        self.subnet_limit = subnet_limit
+        self.timeout = window_minutes * 60
+        self.prefixes = {4: ipv4_prefix, 6: ipv6_prefix}
+        self.cache = caches[cache_alias]
+        self.trusted_proxies = trusted_proxies
+
+    def client_address(self, request):
+        """Returns the address of the request's client, as seen by the nearest untrusted hop."""
+        hops = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if self.trusted_proxies else []
+        hops = [hop.strip() for hop in hops if hop.strip()]
+        hops.append(request.META.get('REMOTE_ADDR'))
+        # Each trusted proxy appended the address it received the request from
+        return hops[max(0, len(hops) - 1 - self.trusted_proxies)]
+
+    def is_blocked(self, ip_address):
+        """Returns True if the address or its subnet has reached its limit."""
+        keys = self._keys(ip_address)
+        if not keys:
+            return False
+        counts = self.cache.get_many(list(keys))
+        return any(counts.get(key, 0) >= limit for key, limit in keys.items())
+
+    def record_failure(self, ip_address):
+        for key in self._keys(ip_address):
+            if not self.cache.add(key, 1, timeout=self.timeout):
+                try:
+                    self.cache.incr(key)
+                except ValueError:
+                    # Expired in the meantime
+                    self.cache.add(key, 1, timeout=self.timeout)
+
+    async def ais_blocked(self, ip_address):
+        # The async cache API is available from Django 4.0
+        if not hasattr(self.cache, 'aget_many'):
+            return await sync_to_async(self.is_blocked)(ip_address)
+        keys = self._keys(ip_address)
+        if not keys:
+            return False
+        counts = await self.cache.aget_many(list(keys))
+        return any(counts.get(key, 0) >= limit for key, limit in keys.items())
+
+    async def arecord_failure(self, ip_address):
+        if not hasattr(self.cache, 'aincr'):
+            return await sync_to_async(self.record_failure)(ip_address)
+        for key in self._keys(ip_address):
+            if not await self.cache.aadd(key, 1, timeout=self.timeout):
+                try:
+                    await self.cache.aincr(key)
+                except ValueError:
+                    await self.cache.aadd(key, 1, timeout=self.timeout)
+
+    def reset(self, ip_address):
+        self.cache.delete_many(list(self._keys(ip_address)))
+
+    def _keys(self, ip_address):
+        """Returns the cache keys of the enabled counters mapped to their limits."""
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return {}
+        keys = {}
+        if self.ip_limit:
+            keys['useraudit:ip:%s' % address.compressed] = self.ip_limit
+        if self.subnet_limit:
+            subnet = ipaddress.ip_network((address, self.prefixes[address.version]), strict=False)
+            keys['useraudit:subnet:%s' % subnet.compressed] = self.subnet_limit
+        return keys
+
+
+def get_ip_throttle():
+    """Returns the IPThrottle, or None if neither LOGIN_FAILURE_IP_LIMIT nor
+    LOGIN_FAILURE_SUBNET_LIMIT is set."""
+    ip_limit = getattr(settings, 'LOGIN_FAILURE_IP_LIMIT', None) or 0
+    subnet_limit = getattr(settings, 'LOGIN_FAILURE_SUBNET_LIMIT', None) or 0
+    if not ip_limit and not subnet_limit:
+        return None
+    return IPThrottle(
+        ip_limit=ip_limit,
+        subnet_limit=subnet_limit,
+        window_minutes=getattr(settings, 'LOGIN_FAILURE_IP_WINDOW_MINUTES', None) or 60,
+        ipv4_prefix=getattr(settings, 'LOGIN_FAILURE_IPV4_PREFIX', None) or 24,
+        ipv6_prefix=getattr(settings, 'LOGIN_FAILURE_IPV6_PREFIX', None) or 64,
+        cache_alias=getattr(settings, 'LOGIN_FAILURE_IP_CACHE', None) or 'default',
+        trusted_proxies=getattr(settings, 'LOGIN_FAILURE_IP_TRUSTED_PROXIES', None) or 0,
+    )
@@ -0,0 +1,115 @@
+"""
+Detecting password changes and reactivations without loading the user.
+
+The pre_save receivers of the user model need to know whether the
+password has changed, or the user is being reactivated. Each of them
+used to load the user from the database on every save.
+
+The values of password and is_active are now recorded when a user is
+loaded (post_init) and after each save (post_save), and the receivers
+use them to answer without a query when they can:
+
+- saves with update_fields that don't include the field (ex. the
+  last_login update at login) can't change it,
+- a field that differs from its recorded value has changed,
+- a user who is saved inactive isn't reactivated.
+
+The saved value is only loaded when the in-memory values can't tell:
+the field looks unchanged but the instance could be stale (the row
+changed since it was loaded, ex. a user deactivated meanwhile, and
+refresh_from_db() doesn't record the values again either), or the
+instance wasn't loaded from the database. It is loaded once per save and
+shared by the receivers.
+"""
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+
+
+TRACKED_FIELDS = ('password', 'is_active')
+# Values recorded on post_init and post_save, and values loaded from the database during a save
+ATTR = '_useraudit_original'
+LOADED_ATTR = '_useraudit_loaded'
+NOT_RECORDED = object()
+
+
+def _tracked_fields(model):
+    attnames = set(field.attname for field in model._meta.concrete_fields)
+    return [name for name in TRACKED_FIELDS if name in attnames]
+
+
+def record_original_values(sender, instance, update_fields=None, **kwargs):
+    # Deferred fields aren't in __dict__, reading them would load them
+    names = [name for name in _tracked_fields(sender) if name in instance.__dict__]
+    values = {}
+    if update_fields is not None:
+        # The fields not saved may have unsaved changes, keep the values recorded for them
+        values.update(instance.__dict__.get(LOADED_ATTR) or instance.__dict__.get(ATTR) or {})
+        names = [name for name in names if name in update_fields]
+    values.update((name, instance.__dict__[name]) for name in names)
+    instance.__dict__[ATTR] = values
+    instance.__dict__.pop(LOADED_ATTR, None)
+
+
+def _recorded_value(instance, name):
+    if instance._state.adding:
+        # Recorded when it was built, not loaded
+        return NOT_RECORDED
+    return (instance.__dict__.get(ATTR) or {}).get(name, NOT_RECORDED)
+
+
+def _saved_value(instance, name):
+    """The value of field name in the database, or NOT_RECORDED if the row doesn't exist."""
+    values = instance.__dict__.get(LOADED_ATTR)
+    if values is None:
+        if instance.pk is None:
+            return NOT_RECORDED
+        model = type(instance)
+        values = model._base_manager.db_manager(instance._state.db).filter(pk=instance.pk).values(
+            *_tracked_fields(model)).first()
+        if values is None:
+            return NOT_RECORDED
+        # Also used by the other receivers of this save
+        instance.__dict__[LOADED_ATTR] = values
+    return values.get(name, NOT_RECORDED)
+
+
+def _is_saved(name, update_fields):
+    return update_fields is None or name in update_fields
+
+
+def password_changed(user, update_fields=None):
+    """True if saving user changes their password."""
+    if 'password' not in _tracked_fields(type(user)) or not _is_saved('password', update_fields):
+        return False
+    recorded = _recorded_value(user, 'password')
+    if recorded is not NOT_RECORDED and recorded != user.password:
+        return True
+    saved = _saved_value(user, 'password')
+    return saved is not NOT_RECORDED and saved != user.password
+
+
+def is_reactivated(user, update_fields=None):
+    """True if saving user makes an inactive user active again."""
+    if 'is_active' not in _tracked_fields(type(user)) or not _is_saved('is_active', update_fields):
+        return False
+    if not user.is_active:
+        return False
+    if _recorded_value(user, 'is_active') is False:
+        return True
+    return _saved_value(user, 'is_active') is False
+
+
+def connect_user_model(user_model):
+    post_init.connect(record_original_values, sender=user_model, dispatch_uid='useraudit.tracking.post_init')
+    post_save.connect(record_original_values, sender=user_model, dispatch_uid='useraudit.tracking.post_save')
+
+
+connect_user_model(settings.AUTH_USER_MODEL)
+
+
+@receiver(setting_changed)
+def user_model_changed(setting, value, **kwargs):
+    if setting == 'AUTH_USER_MODEL':
+        connect_user_model(value)
@@ -1,8 +1,8 @@
-from django.conf.urls import url
+from django.urls import re_path
 from .views import reactivate_user
 
 app_name = "useraudit"
 
 urlpatterns = [
-    url(r'reactivate/(?P<user_id>\d+)[/]?$', reactivate_user, name="reactivate_user"),
+    re_path(r'reactivate/(?P<user_id>\d+)[/]?$', reactivate_user, name="reactivate_user"),
 ]
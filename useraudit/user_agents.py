@@ -0,0 +1,142 @@
+"""
+Deduplicated storage of the user agents of the login logs.
+
+Most of the size of the log tables is the user agent column, although
+there are only a few distinct user agents. With
+USERAUDIT_NORMALIZE_USER_AGENTS enabled, each distinct user agent is
+stored once in the UserAgent table and the logs reference it, leaving
+their user_agent column empty.
+
+The ids of recently used user agents are kept in an in-process LRU
+cache, so logging a login rarely needs a query to resolve the user agent.
+
+Settings::
+
+    # Store the user agents of new log rows in the UserAgent table.
+    USERAUDIT_NORMALIZE_USER_AGENTS = True
+    # Number of user agent ids cached by each process.
+    USERAUDIT_USER_AGENT_CACHE_SIZE = 1000
+
+The user agents of the rows logged before the setting was enabled are
+moved with the normalize_user_agents management command.
+"""
+from collections import OrderedDict
+import hashlib
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0, aget_user_agent_id() can't be used
+    sync_to_async = None
+
+from . import routers
+
+
+SETTINGS = (
+    'USERAUDIT_NORMALIZE_USER_AGENTS',
+    'USERAUDIT_USER_AGENT_CACHE_SIZE',
+)
+
+
+class LRUCache(object):
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def _cache_size():
+    return getattr(settings, 'USERAUDIT_USER_AGENT_CACHE_SIZE', None) or 1000
+
+
+_cache = LRUCache(_cache_size())
+
+
+def is_enabled():
+    return getattr(settings, 'USERAUDIT_NORMALIZE_USER_AGENTS', False)
+
+
+def digest(user_agent):
+    return hashlib.sha1(user_agent.encode('utf-8')).hexdigest()
+
+
+def get_user_agent_id(user_agent):
+    """Returns the id of the UserAgent row of user_agent, creating the row if needed."""
+    if user_agent is None:
+        return None
+    user_agent_id = _cache.get(user_agent)
+    if user_agent_id is None:
+        UserAgent = apps.get_model('useraudit', 'UserAgent')
+        user_agent_id = UserAgent.objects.get_or_create(digest=digest(user_agent), defaults={'name': user_agent})[0].pk
+        # Cached only once committed, a row created by a transaction that is rolled back doesn't exist
+        transaction.on_commit(lambda: _cache.put(user_agent, user_agent_id), using=routers.db_for_write(UserAgent))
+    return user_agent_id
+
+
+async def aget_user_agent_id(user_agent):
+    if user_agent is None:
+        return None
+    user_agent_id = _cache.get(user_agent)
+    if user_agent_id is None:
+        user_agent_id = await sync_to_async(get_user_agent_id)(user_agent)
+    return user_agent_id
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def normalize_user_agents(log_model, user_agent_model, using='default', chunk_size=1000):
+    """Moves the user agents of the existing rows of log_model to user_agent_model.
+
+    Returns the number of rows updated."""
+    rows = log_model.objects.using(using).filter(user_agent__isnull=False)
+    updated = 0
+    last_pk = None
+    while True:
+        chunk = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+        chunk = list(chunk.order_by('pk').values_list('pk', 'user_agent')[:chunk_size])
+        if not chunk:
+            return updated
+        last_pk = chunk[-1][0]
+        by_user_agent = {}
+        for pk, user_agent in chunk:
+            by_user_agent.setdefault(user_agent, []).append(pk)
+        with transaction.atomic(using=using):
+            for user_agent, pks in by_user_agent.items():
+                user_agent_row = user_agent_model.objects.using(using).get_or_create(
+                    digest=digest(user_agent), defaults={'name': user_agent})[0]
+                updated += log_model.objects.using(using).filter(pk__in=pks).update(
+                    user_agent_ref=user_agent_row, user_agent=None)
+
+
+@receiver(setting_changed)
+def reset_cache(setting, **kwargs):
+    if setting in SETTINGS:
+        _cache.size = _cache_size()
+        _cache.clear()
@@ -1,41 +1,27 @@
 from datetime import timedelta
-from django.conf import settings
+from asgiref.sync import async_to_sync
 from django.contrib.auth import authenticate
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
 from django.core import mail
 from django.core import management
+from django.core.exceptions import PermissionDenied
 from django.core.handlers.base import BaseHandler
 from django.dispatch import receiver
 from django.test import TestCase, override_settings
-from django.db.models.signals import pre_save
-from django.test.signals import setting_changed
 from django.test import Client
 from django.utils import timezone
+from io import StringIO
 import re
 import unittest
+from unittest import mock
 
 from useraudit_testapp.models import MyUser, MyProfile
 import useraudit_testapp.urls
 import useraudit.password_expiry
 from useraudit.signals import login_failure_limit_reached, password_has_expired, account_has_expired, password_will_expire_warning
-from useraudit.models import UserDeactivation
-
-# Saving a reference to the USER_MODEL set in the settings.py file
-# Our pre_save handler in password_expiry.py gets registered just for this sender
-# so when we use override_settings to change AUTH_USER_MODEL there is no handler
-# registered for the models we override AUTH_USER_MODEL with.
-USER_MODEL = settings.AUTH_USER_MODEL
-
-
-# Connects/disconnects extra pre_save handlers for tests that override AUTH_USER_MODEL
-# Also see doc for USER_MODEL above
-@receiver(setting_changed)
-def register_pre_save_on_AUTH_USER_MODER_change(sender, setting, value, enter, **kwargs):
-    if setting == "AUTH_USER_MODEL" and value != USER_MODEL:
-        if enter:
-            pre_save.connect(useraudit.password_expiry.user_pre_save, sender=value)
-        else:
-            pre_save.disconnect(useraudit.password_expiry.user_pre_save, sender=value)
+from useraudit.signals import accounts_have_expired
+from useraudit.models import UserDeactivation, UserNotification
+from useraudit.tests.test_notifications import FlakyBackend
 
 
 @override_settings(AUTH_USER_MODEL="useraudit_testapp.MyUser")
@@ -82,6 +68,12 @@ class ExpiryTestCase(TestCase):
         self.assertIsNotNone(u)
         self.assertTrue(u.is_active)
 
+    @override_settings(PASSWORD_EXPIRY_DAYS=5, ACCOUNT_EXPIRY_DAYS=5)
+    def test_expiry_check_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            useraudit.password_expiry.AccountExpiryBackend().authenticate(
+                username=self.username, password=self.password)
+
     @override_settings(ACCOUNT_EXPIRY_DAYS=5)
     def test_expired(self):
         self.setuser(last_login=timezone.now() - timedelta(days=6))
@@ -117,6 +109,15 @@ class ExpiryTestCase(TestCase):
         self.assertIsNotNone(u)
         self.assertTrue(u.is_active)
 
+    @override_settings(ACCOUNT_EXPIRY_DAYS=5)
+    def test_authentication_works_if_reactivated_by_a_loaded_user(self):
+        self.setuser(last_login=timezone.now() - timedelta(days=6))
+        self.authenticate()
+        user = MyUser.objects.get(pk=self.user.pk)
+        user.is_active = True
+        user.save()
+        self.assertIsNotNone(self.authenticate())
+
     @override_settings(ACCOUNT_EXPIRY_DAYS=5)
     def test_fresh_user(self):
         self.setuser(last_login=None)
@@ -254,6 +255,123 @@ class ExpiryTestCase(TestCase):
         self.assertEqual(len(mail.outbox), 1)
         self.assertTrue(re.search(r"expired", mail.outbox[0].subject, re.I))
 
+    @override_settings(ACCOUNT_EXPIRY_DAYS=5)
+    def test_command_deactivates_in_chunks(self):
+        long_ago = timezone.now() - timedelta(days=6)
+        self.setuser(last_login=long_ago)
+        for i in range(4):
+            MyUser.objects.create(username="user%d" % i, email="user%d@localhost" % i, last_login=long_ago)
+        MyUser.objects.create(username="recent", email="recent@localhost", last_login=timezone.now())
+        out = StringIO()
+        management.call_command("disable_inactive_users", chunk_size=2, stdout=out)
+        self.assertEqual(MyUser.objects.filter(is_active=True).count(), 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertIn("5 account(s) expired", out.getvalue())
+        self.assertIn("Deactivating user: user0", out.getvalue())
+
+    @override_settings(ACCOUNT_EXPIRY_DAYS=5)
+    def test_command_rerun_doesnt_notify_twice(self):
+        self.setuser(last_login=timezone.now() - timedelta(days=6))
+        management.call_command("disable_inactive_users", verbosity=0)
+        management.call_command("disable_inactive_users", verbosity=0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(ACCOUNT_EXPIRY_DAYS=5)
+    def test_command_notifies_after_crash_between_commit_and_send(self):
+        long_ago = timezone.now() - timedelta(days=6)
+        self.setuser(last_login=long_ago)
+        MyUser.objects.create(username="other", email="other@localhost", last_login=long_ago)
+
+        def crash(*args, **kwargs):
+            raise SystemExit("killed")
+
+        # The first chunk is committed, the process dies before sending its e-mails
+        with mock.patch("useraudit.notifications.MailDispatcher.send", crash):
+            with self.assertRaises(SystemExit):
+                management.call_command("disable_inactive_users", chunk_size=1, verbosity=0)
+        self.assertEqual(MyUser.objects.filter(is_active=False).count(), 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+        management.call_command("disable_inactive_users", chunk_size=1, verbosity=0)
+        self.assertEqual(sorted(msg.to[0] for msg in mail.outbox), ["other@localhost", "testuser@localhost"])
+        self.assertFalse(UserNotification.objects.filter(sent__isnull=True).exists())
+        management.call_command("disable_inactive_users", verbosity=0)
+        self.assertEqual(len(mail.outbox), 2)
+
+    @override_settings(ACCOUNT_EXPIRY_DAYS=5)
+    def test_command_records_deactivations_per_chunk(self):
+        long_ago = timezone.now() - timedelta(days=6)
+        self.setuser(last_login=long_ago)
+        for i in range(2):
+            MyUser.objects.create(username="user%d" % i, last_login=long_ago)
+        chunks = []
+
+        def on_expired(sender, users, **kwargs):
+            chunks.append(users)
+
+        accounts_have_expired.connect(on_expired)
+        try:
+            management.call_command("disable_inactive_users", chunk_size=2, email=False, verbosity=0)
+        finally:
+            accounts_have_expired.disconnect(on_expired)
+        self.assertEqual([len(users) for users in chunks], [2, 1])
+        self.assertEqual(
+            sorted(UserDeactivation.objects.filter(reason=UserDeactivation.ACCOUNT_EXPIRED).values_list(
+                "username", flat=True)),
+            sorted([self.username, "user0", "user1"]))
+
+    @override_settings(ACCOUNT_EXPIRY_DAYS=5, USERAUDIT_EXPIRY_OVERRIDES={
+        "is_staff": {"ACCOUNT_EXPIRY_DAYS": 10},
+        "group:contractors": {"ACCOUNT_EXPIRY_DAYS": 2},
+    })
+    def test_command_applies_expiry_overrides(self):
+        self.setuser(last_login=timezone.now() - timedelta(days=6))
+        for username, days_ago, staff in (("staff", 6, True), ("old_staff", 11, True), ("contractor", 3, False)):
+            MyUser.objects.create(username=username, email="%s@localhost" % username, is_staff=staff,
+                                  last_login=timezone.now() - timedelta(days=days_ago))
+        MyUser.objects.get(username="contractor").groups.add(Group.objects.create(name="contractors"))
+        management.call_command("disable_inactive_users", chunk_size=2, verbosity=0)
+        self.assertEqual(sorted(MyUser.objects.filter(is_active=False).values_list("username", flat=True)),
+                         ["contractor", "old_staff", self.username])
+        self.assertEqual(sorted(UserDeactivation.objects.values_list("username", flat=True)),
+                         ["contractor", "old_staff", self.username])
+        contractor_email = [msg for msg in mail.outbox if msg.to == ["contractor@localhost"]][0]
+        self.assertIn("period of 2 days", contractor_email.body)
+
+    @override_settings(ACCOUNT_EXPIRY_DAYS=5, EMAIL_BACKEND="useraudit.tests.test_notifications.FlakyBackend")
+    def test_command_sends_failed_emails_on_next_run(self):
+        FlakyBackend.failures = 1
+        self.setuser(last_login=timezone.now() - timedelta(days=6))
+        management.call_command("disable_inactive_users", verbosity=0, retries=0, stderr=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertIsNone(UserNotification.objects.get(username=self.username).sent)
+        management.call_command("disable_inactive_users", verbosity=0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNotNone(UserNotification.objects.get(username=self.username).sent)
+
+    ###########################################################################
+    # password expiry notification test cases
+
+    @override_settings(PASSWORD_EXPIRY_DAYS=10, PASSWORD_EXPIRY_WARNING_DAYS=3)
+    def test_notify_password_expiry(self):
+        self.setuser(password_change_date=timezone.now() - timedelta(days=8))
+        for username, days_ago in (("fresh", 0), ("expired", 11)):
+            MyUser.objects.create(username=username, email="%s@localhost" % username)
+            MyUser.objects.filter(username=username).update(
+                password_change_date=timezone.now() - timedelta(days=days_ago))
+        management.call_command("notify_password_expiry", chunk_size=1, verbosity=0)
+        self.assertEqual([msg.to for msg in mail.outbox], [["testuser@localhost"]])
+        self.assertTrue(re.search(r"will expire in \d day", mail.outbox[0].body))
+
+    @override_settings(PASSWORD_EXPIRY_DAYS=10, PASSWORD_EXPIRY_WARNING_DAYS=3)
+    def test_notify_password_expiry_once_per_password(self):
+        self.setuser(password_change_date=timezone.now() - timedelta(days=8))
+        management.call_command("notify_password_expiry", verbosity=0)
+        management.call_command("notify_password_expiry", verbosity=0)
+        self.assertEqual(len(mail.outbox), 1)
+        management.call_command("notify_password_expiry", interval=0, verbosity=0)
+        self.assertEqual(len(mail.outbox), 2)
+
     ###########################################################################
     # inactive account test cases
 
@@ -332,6 +450,28 @@ class ProfileExpiryTestCase(TestCase):
         self.assertIsNone(u)
         self.assertFalse(self.user2.is_active)
 
+    @override_settings(PASSWORD_EXPIRY_DAYS=5)
+    def test_profile_is_loaded_with_the_user(self):
+        with self.assertNumQueries(1):
+            useraudit.password_expiry.AccountExpiryBackend().authenticate(
+                username=self.username, password=self.password)
+
+    @override_settings(PASSWORD_EXPIRY_DAYS=5)
+    def test_profile_is_loaded_with_the_user_async(self):
+        with self.assertNumQueries(1):
+            async_to_sync(useraudit.password_expiry.AccountExpiryBackend().aauthenticate)(
+                username=self.username, password=self.password)
+
+    @override_settings(PASSWORD_EXPIRY_DAYS=10, PASSWORD_EXPIRY_WARNING_DAYS=3)
+    def test_notify_password_expiry(self):
+        self.user.myprofile.password_change_date = timezone.now() - timedelta(days=8)
+        self.user.myprofile.save()
+        User.objects.create(username="fresh", email="fresh@localhost")
+        management.call_command("notify_password_expiry", verbosity=0)
+        self.assertEqual([msg.to for msg in mail.outbox], [["testuser@localhost"]])
+        self.assertEqual(UserNotification.objects.get(kind=UserNotification.PASSWORD_EXPIRY_WARNING).username,
+                         self.username)
+
     @override_settings(
         AUTH_USER_MODEL_PASSWORD_CHANGE_DATE_ATTR="myprofile.asdfgh",
     )
@@ -463,3 +603,45 @@ class MiddlewareTestCase(TestCase):
     def test_middleware_loads_on_django_1_10s_new_style_middleware(self):
         handler = BaseHandler()
         handler.load_middleware()
+
+
+@override_settings(AUTH_USER_MODEL="useraudit_testapp.MyUser", PASSWORD_EXPIRY_DAYS=10, PASSWORD_EXPIRY_WARNING_DAYS=3)
+class AsyncExpiryTestCase(TestCase):
+    username = "testuser"
+
+    def setUp(self):
+        self.user = MyUser.objects.create(
+            username=self.username,
+            last_login=timezone.now(),
+            password_change_date=timezone.now(),
+        )
+
+    def aauthenticate(self):
+        return async_to_sync(useraudit.password_expiry.AccountExpiryBackend().aauthenticate)(
+            username=self.username, password="any")
+
+    def test_not_expired(self):
+        self.assertIsNone(self.aauthenticate())
+
+    def test_password_expired(self):
+        MyUser.objects.filter(pk=self.user.pk).update(password_change_date=timezone.now() - timedelta(days=11))
+        with self.assertRaises(PermissionDenied):
+            self.aauthenticate()
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEquals(UserDeactivation.objects.get(username=self.username).reason,
+                          UserDeactivation.PASSWORD_EXPIRED)
+
+    def test_warning(self):
+        warnings = []
+
+        def on_warning(sender, user, days_left, **kwargs):
+            warnings.append(days_left)
+
+        MyUser.objects.filter(pk=self.user.pk).update(password_change_date=timezone.now() - timedelta(days=8))
+        password_will_expire_warning.connect(on_warning)
+        try:
+            self.assertIsNone(self.aauthenticate())
+        finally:
+            password_will_expire_warning.disconnect(on_warning)
+        self.assertEquals(warnings, [1])
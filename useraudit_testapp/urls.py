@@ -1,6 +1,6 @@
-from django.conf.urls import url, include
+from django.urls import include, re_path
 
 
 urlpatterns = [
-    url(r'^useraudit', include('useraudit.urls')),
+    re_path(r'^useraudit', include('useraudit.urls')),
 ]